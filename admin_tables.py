@@ -0,0 +1,152 @@
+"""Paginated, sortable and filterable admin listings of users and orders.
+
+Each page is one keyset query on (sort column, primary key) that selects
+only the columns the table shows, so its cost does not grow with the page
+number. The CSV download runs the same query without the page limit and
+streams it (bulk.stream_rows).
+"""
+from datetime import datetime, timedelta
+
+from pagination import decode_sort_cursor, encode_cursor, keyset_after
+
+ORDER_STATUSES = ('Pending', 'Completed')
+
+
+class Listing:
+    def __init__(self, select, id_column, id_key, columns, sorts, default_sort, filters):
+        self.select = select
+        self.id_column = id_column
+        self.id_key = id_key
+        self.columns = columns
+        # sort name (also the row key) -> (SQL expression, cursor kind)
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.filters = filters
+
+    def parse(self, args):
+        # Returns the normalised query string (for links) plus the WHERE
+        # clauses and parameters it stands for.
+        sort = args.get('sort')
+        if sort not in self.sorts:
+            sort = self.default_sort
+        direction = 'asc' if args.get('dir') == 'asc' else 'desc'
+        query = {'sort': sort, 'dir': direction}
+        clauses, params = [], []
+        for build in self.filters:
+            build(args, query, clauses, params)
+        return query, clauses, params
+
+    def _sql(self, query, clauses, params, after=None, limit=None):
+        expr, _ = self.sorts[query['sort']]
+        descending = query['dir'] == 'desc'
+        seek, seek_params = keyset_after(expr, self.id_column, after, descending)
+        where = clauses + ([seek] if seek else [])
+        order = 'DESC' if descending else 'ASC'
+        sql = self.select
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {expr} {order}, {self.id_column} {order}'
+        params = list(params) + list(seek_params)
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        return sql, tuple(params)
+
+    def fetch_page(self, cursor, args, size):
+        query, clauses, params = self.parse(args)
+        after = decode_sort_cursor(args.get('after'), self.sorts[query['sort']][1])
+        cursor.execute(*self._sql(query, clauses, params, after, size + 1))
+        rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[query['sort']], last[self.id_key])
+        return rows, next_cursor, query, after is None
+
+    def export_query(self, args):
+        query, clauses, params = self.parse(args)
+        return self._sql(query, clauses, params)
+
+
+def _prefix(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def _user_search(args, query, clauses, params):
+    q = args.get('q', '').strip()
+    if q:
+        # Prefix matches, so the unique username/email indexes are used.
+        query['q'] = q
+        clauses.append('(u.username LIKE %s OR u.email LIKE %s)')
+        params += [_prefix(q), _prefix(q)]
+
+
+def _order_status(args, query, clauses, params):
+    status = args.get('status')
+    if status in ORDER_STATUSES:
+        query['status'] = status
+        clauses.append('o.status = %s')
+        params.append(status)
+
+
+def _order_username(args, query, clauses, params):
+    username = args.get('username', '').strip()
+    if username:
+        query['username'] = username
+        clauses.append('u.username = %s')
+        params.append(username)
+
+
+def _order_dates(args, query, clauses, params):
+    since, until = _day(args.get('since')), _day(args.get('until'))
+    if since:
+        query['since'] = args['since']
+        clauses.append('o.created_at >= %s')
+        params.append(since)
+    if until:
+        query['until'] = args['until']
+        clauses.append('o.created_at < %s')
+        params.append(until + timedelta(days=1))
+
+
+USERS = Listing(
+    'SELECT u.user_id, u.username, u.email, u.created_at FROM users u',
+    'u.user_id', 'user_id',
+    ('user_id', 'username', 'email', 'created_at'),
+    {'user_id': ('u.user_id', 'int'),
+     'username': ('u.username', 'str'),
+     'email': ('u.email', 'str'),
+     'created_at': ('u.created_at', 'datetime')},
+    'created_at',
+    (_user_search,))
+
+ORDERS_SELECT = '''SELECT o.order_id, u.username, o.total_amount, o.status, o.created_at
+       FROM {table} o JOIN users u ON o.user_id = u.user_id'''
+ORDERS_COLUMNS = ('order_id', 'username', 'total_amount', 'status', 'created_at')
+ORDERS_SORTS = {'order_id': ('o.order_id', 'int'),
+                'total_amount': ('o.total_amount', 'decimal'),
+                'created_at': ('o.created_at', 'datetime')}
+
+
+def _archived(args, query, clauses, params):
+    # Only marks the query, so links and the CSV download stay on the archive.
+    query['archive'] = '1'
+
+
+ORDERS = Listing(
+    ORDERS_SELECT.format(table='orders'),
+    'o.order_id', 'order_id', ORDERS_COLUMNS, ORDERS_SORTS, 'created_at',
+    (_order_status, _order_username, _order_dates))
+
+ORDERS_ARCHIVE = Listing(
+    ORDERS_SELECT.format(table='orders_archive'),
+    'o.order_id', 'order_id', ORDERS_COLUMNS, ORDERS_SORTS, 'created_at',
+    (_archived, _order_status, _order_username, _order_dates))
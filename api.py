@@ -0,0 +1,358 @@
+"""Versioned JSON API (/api/v1) for front-ends and mobile clients.
+
+    GET    /api/v1/artworks                 gallery page (same filters/sort as /)
+    GET    /api/v1/artworks?ids=3,5,8       batch lookup, in the order asked
+    GET    /api/v1/artworks/<id>            one artwork (?include=related)
+    GET    /api/v1/cart                     the session's cart
+    POST   /api/v1/cart/items               add lines      } each returns the
+    PATCH  /api/v1/cart/items               set quantities } updated cart
+    DELETE /api/v1/cart/items/<id>          remove a line  }
+    DELETE /api/v1/cart                     empty the cart }
+    GET    /api/v1/orders                   the signed-in user's orders, with items
+                                            (?archive=1: the archived ones)
+
+Reads go through the same catalogue cache and keyset queries as the HTML
+pages. ``fields=artwork_id,title,price`` trims artwork objects to what the
+client shows. Prices and totals are strings ("1250.00", never floats) and
+dates ISO 8601. Every GET carries an ETag and answers If-None-Match with a
+304; bodies over API_COMPRESS_MIN_BYTES are sent brotli (when the Brotli
+package is installed) or gzip compressed. Mutations only accept
+application/json bodies, which a cross-site HTML form cannot send.
+"""
+import gzip
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Blueprint, abort, current_app, g, jsonify, request, session
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import BadRequest, HTTPException, MethodNotAllowed, NotFound
+
+import cart_store
+import catalogue_cache
+import db_pool
+import facets
+import recommendations
+from catalogue import CARD_COLUMNS, fetch_artwork, fetch_artwork_page, fetch_artworks_by_id
+from images import image_urls
+from orders import fetch_items_by_order, fetch_user_orders
+from pagination import decode_cursor, page_size
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PREFIX = '/api/v1'
+ARTWORK_FIELDS = ('artwork_id', 'title', 'artist_name', 'description', 'price', 'available_qty',
+                  'image', 'created_at', 'updated_at')
+RELATED_FIELDS = ('artwork_id', 'title', 'artist_name', 'price', 'image', 'reason')
+
+bp = Blueprint('api', __name__, url_prefix=PREFIX)
+_config = {'batch_max': 100, 'compress_min': 1024}
+
+
+class ApiJSONProvider(DefaultJSONProvider):
+    # Flask's default writes dates as RFC 822 strings; the API promises
+    # ISO 8601, and DECIMAL money as exact strings.
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+
+def init_app(app):
+    _config.update(batch_max=app.config['API_BATCH_MAX'],
+                   compress_min=app.config['API_COMPRESS_MIN_BYTES'])
+    app.json = ApiJSONProvider(app)
+    app.register_blueprint(bp)
+    # Unmatched URLs and methods never reach the blueprint's own handlers.
+    app.register_error_handler(NotFound, _unrouted)
+    app.register_error_handler(MethodNotAllowed, _unrouted)
+
+
+def _unrouted(e):
+    if request.path.startswith(PREFIX + '/'):
+        return _error(e)
+    return e
+
+
+@bp.errorhandler(HTTPException)
+def _error(e):
+    response = jsonify(error={'status': e.code, 'message': e.description})
+    response.status_code = e.code
+    if isinstance(e, MethodNotAllowed) and e.valid_methods:
+        response.allow.update(e.valid_methods)
+    return response
+
+
+# -- response finishing: ETag, 304 and compression -----------------------------------
+
+def _compress(response):
+    if response.status_code == 304 or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers:
+        return
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < _config['compress_min']:
+        return
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    elif encoding == 'gzip':
+        # mtime=0: a timestamp in the header would change the ETag every second.
+        response.set_data(gzip.compress(body, compresslevel=6, mtime=0))
+    else:
+        return
+    response.headers['Content-Encoding'] = encoding
+
+
+@bp.after_request
+def _finish(response):
+    # Compressed first, so each encoding gets its own ETag, as it should.
+    _compress(response)
+    if request.method in ('GET', 'HEAD') and response.status_code == 200:
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache' if g.get('api_private') else 'public, no-cache'
+        if g.get('api_private'):
+            response.vary.add('Cookie')
+        response.make_conditional(request)
+    return response
+
+
+# -- representations -----------------------------------------------------------------
+
+def requested_fields(allowed):
+    value = request.args.get('fields')
+    if not value:
+        return allowed
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise BadRequest(f"unknown field(s): {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return fields
+
+
+def artwork_json(art, fields):
+    return {f: image_urls(art) if f == 'image' else art.get(f) for f in fields}
+
+
+def _load_artwork(artwork_id):
+    conn = db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    art = fetch_artwork(cursor, artwork_id)
+    cursor.close()
+    conn.close()
+    return art
+
+
+def _load_artworks(artwork_ids):
+    conn = db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    rows = fetch_artworks_by_id(cursor, artwork_ids)
+    cursor.close()
+    conn.close()
+    return rows
+
+
+def _parse_ids(value):
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise BadRequest(f'ids must be artwork ids separated by commas, got {part!r}')
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not ids:
+        raise BadRequest('ids is empty')
+    if len(ids) > _config['batch_max']:
+        raise BadRequest(f"at most {_config['batch_max']} ids per request")
+    return ids
+
+
+# -- catalogue -----------------------------------------------------------------------
+
+@bp.route('/artworks')
+def artworks():
+    fields = requested_fields(ARTWORK_FIELDS)
+    if 'ids' in request.args:
+        ids = _parse_ids(request.args['ids'])
+        rows = catalogue_cache.get_cache().get_artworks(ids, _load_artworks)
+        return jsonify(artworks=[artwork_json(rows[i], fields) for i in ids if i in rows],
+                       missing=[i for i in ids if i not in rows])
+
+    size = page_size(request.args.get('size'), current_app.config['GALLERY_PAGE_SIZE'])
+    selection = facets.parse_selection(request.args)
+    sort = facets.parse_sort(request.args)
+    token = request.args.get('after')
+    if selection or sort != 'newest':
+        conn = db_pool.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(*facets.browse_query(selection, sort, token, size))
+        rows, next_cursor = facets.browse_result(cursor.fetchall(), sort, size)
+        cursor.close()
+        conn.close()
+    else:
+        after = decode_cursor(token)
+
+        def loader():
+            conn = db_pool.get_connection()
+            cursor = conn.cursor(dictionary=True)
+            page = fetch_artwork_page(cursor, after, size, columns=CARD_COLUMNS)
+            cursor.close()
+            conn.close()
+            return page
+        # Shares cache entries with the gallery page itself.
+        rows, next_cursor = catalogue_cache.get_cache().get_listing(
+            'card', token if after else None, size, loader)
+    body = {'artworks': [artwork_json(row, fields) for row in rows], 'next': next_cursor}
+    if request.args.get('counts') == '1':
+        index = facets.get_index()
+        counts, body['total'] = index.counts(selection)
+        body['facets'] = {facet: [{'value': value, 'label': facets.value_label(index, facet, value),
+                                   'count': count} for value, count in values]
+                          for facet, values in counts.items()}
+    return jsonify(body)
+
+
+@bp.route('/artworks/<int:artwork_id>')
+def artwork(artwork_id):
+    fields = requested_fields(ARTWORK_FIELDS)
+    art = catalogue_cache.get_cache().get_artwork(artwork_id, _load_artwork)
+    if not art:
+        abort(404, f'artwork {artwork_id} not found')
+    body = artwork_json(art, fields)
+    if 'related' in request.args.get('include', '').split(','):
+        conn = db_pool.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        body['related'] = [artwork_json(row, RELATED_FIELDS)
+                           for row in recommendations.fetch_related(cursor, artwork_id)]
+        cursor.close()
+        conn.close()
+    return jsonify(body)
+
+
+# -- cart ----------------------------------------------------------------------------
+
+def cart_json(cursor, cart_id):
+    lines = cart_store.get_items(cursor, cart_id)
+    rows = catalogue_cache.get_cache().get_artworks(lines.keys(), _load_artworks) if lines else {}
+    items, total = [], Decimal('0.00')
+    for artwork_id, qty in lines.items():
+        art = rows.get(int(artwork_id))
+        if art is None:
+            continue
+        subtotal = art['price'] * qty
+        total += subtotal
+        items.append({'artwork_id': art['artwork_id'], 'title': art['title'],
+                      'artist_name': art['artist_name'], 'price': art['price'],
+                      'quantity': qty, 'subtotal': subtotal,
+                      'available_qty': art['available_qty'], 'image': image_urls(art)})
+    return {'items': items, 'count': sum(item['quantity'] for item in items), 'total': total}
+
+
+def _json_lines(minimum):
+    # Accepts {"artwork_id": 3, "quantity": 2} or {"items": [...] } of those.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise BadRequest('expected a JSON object (Content-Type: application/json)')
+    lines = data['items'] if 'items' in data else [data]
+    if not isinstance(lines, list) or not lines or len(lines) > _config['batch_max']:
+        raise BadRequest(f"items must be a list of 1 to {_config['batch_max']} lines")
+    parsed = {}
+    for line in lines:
+        try:
+            artwork_id, qty = int(line['artwork_id']), int(line.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise BadRequest('each line needs an integer artwork_id and quantity')
+        if qty < minimum:
+            raise BadRequest(f'quantity must be at least {minimum}')
+        parsed[artwork_id] = qty
+    return parsed
+
+
+def _store_lines(store, lines):
+    # Returns change(cursor, cart_id) for _update_cart. Whether an artwork
+    # exists is decided by the insert itself, not the catalogue cache, which
+    # may still hold an artwork deleted since.
+    def change(cursor, cart_id):
+        unknown = [artwork_id for artwork_id, qty in lines.items()
+                   if not store(cursor, cart_id, artwork_id, qty)]
+        if unknown:
+            abort(404, f"unknown artwork id(s): {', '.join(map(str, unknown))}")
+    return change
+
+
+def _update_cart(change):
+    # change(cursor, cart_id) runs in the same transaction that reads the
+    # cart back, so the response shows exactly what was stored.
+    g.api_private = True
+    conn = db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    cart_id = cart_store.current_cart_id(cursor, create=change is not None)
+    if change is not None:
+        try:
+            change(cursor, cart_id)
+        except Exception:
+            # All lines or none.
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise
+    body = cart_json(cursor, cart_id)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return jsonify(body)
+
+
+@bp.route('/cart')
+def cart():
+    return _update_cart(None)
+
+
+@bp.route('/cart/items', methods=['POST'])
+def add_cart_items():
+    return _update_cart(_store_lines(cart_store.add_item, _json_lines(minimum=1)))
+
+
+@bp.route('/cart/items', methods=['PATCH'])
+def set_cart_items():
+    return _update_cart(_store_lines(cart_store.set_item, _json_lines(minimum=0)))
+
+
+@bp.route('/cart/items/<int:artwork_id>', methods=['DELETE'])
+def remove_cart_item(artwork_id):
+    return _update_cart(lambda cursor, cart_id: cart_store.set_item(cursor, cart_id, artwork_id, 0))
+
+
+@bp.route('/cart', methods=['DELETE'])
+def clear_cart():
+    return _update_cart(cart_store.clear)
+
+
+# -- orders --------------------------------------------------------------------------
+
+@bp.route('/orders')
+def orders():
+    g.api_private = True
+    if 'user_id' not in session:
+        abort(401, 'sign in to see your orders')
+    archived = request.args.get('archive') == '1'
+    before = decode_cursor(request.args.get('before'))
+    size = page_size(request.args.get('size'), current_app.config['PROFILE_ORDERS_PAGE_SIZE'])
+    conn = db_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    rows, next_cursor = fetch_user_orders(cursor, session['user_id'], before, size, archived)
+    items_by_order = fetch_items_by_order(cursor, [o['order_id'] for o in rows], archived)
+    cursor.close()
+    conn.close()
+    for order in rows:
+        order['items'] = [{'artwork_id': item['artwork_id'], 'title': item['title'],
+                           'quantity': item['quantity'], 'unit_price': item['unit_price']}
+                          for item in items_by_order.get(order['order_id'], [])]
+    return jsonify(orders=rows, next=next_cursor)
@@ -1,11 +1,34 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, stream_with_context, abort
 import mysql.connector
 from mysql.connector import Error
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import timedelta
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+import db_pool
+import catalogue_cache
+import rollups
+import images
+import uploads
+import page_cache
+import cart_store
+import instrumentation
+import benchmark
+import migrate
+import bulk
+import admin_tables
+import passwords
+import jobs
+import recommendations
+import facets
+import archive
+import api
+import startup
+from page_cache import cached_page
+from catalogue import fetch_artwork_page, fetch_artwork, fetch_artworks_by_id, ADMIN_COLUMNS, CARD_COLUMNS
+from pagination import decode_cursor, page_size
+from search import search_artworks
+from orders import fetch_user_orders, fetch_items_by_order, place_order, OutOfStock, InvalidQuantity, checkout_stress_command
 
 # Load environment variables
 load_dotenv()
@@ -18,31 +41,208 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app.secret_key = os.getenv('SECRET_KEY', 'devkey')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Hand upload delivery to the front proxy: X-Sendfile (Apache/lighttpd) or
+# X-Accel-Redirect to an internal nginx location such as /_uploads/
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+app.config['UPLOAD_ACCEL_REDIRECT_PREFIX'] = os.getenv('UPLOAD_ACCEL_REDIRECT_PREFIX')
+# Browser cache lifetime for pre-hashing uploads whose content may change
+app.config['UPLOAD_LEGACY_MAX_AGE'] = int(os.getenv('UPLOAD_LEGACY_MAX_AGE', 3600))
 app.permanent_session_lifetime = timedelta(days=7)
 
+# Performance instrumentation (PERF_INSTRUMENTATION=0 removes all hooks)
+app.config['PERF_INSTRUMENTATION'] = os.getenv('PERF_INSTRUMENTATION', '1') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+app.config['SLOW_QUERY_LOG'] = os.getenv('SLOW_QUERY_LOG', 'slow_queries.log')
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')  # lets Prometheus scrape /metrics
+
+# Database connection pool settings
+app.config['DB_CONNECT_ARGS'] = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv("DB_PASSWORD"),   # <-- your MySQL password
+    'database': os.getenv('DB_NAME', 'artstore'),
+}
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+app.config['DB_POOL_MAX_OVERFLOW'] = int(os.getenv('DB_POOL_MAX_OVERFLOW', 5))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# aiomysql pool of the async views in asgi.py (per worker)
+app.config['ASYNC_DB_POOL_MIN'] = int(os.getenv('ASYNC_DB_POOL_MIN', 1))
+app.config['ASYNC_DB_POOL_MAX'] = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
+
+# Gallery listing page size (overridable per request with ?size=)
+app.config['GALLERY_PAGE_SIZE'] = int(os.getenv('GALLERY_PAGE_SIZE', 24))
+app.config['ADMIN_PAGE_SIZE'] = int(os.getenv('ADMIN_PAGE_SIZE', 50))
+app.config['PROFILE_ORDERS_PAGE_SIZE'] = int(os.getenv('PROFILE_ORDERS_PAGE_SIZE', 20))
+
+# Password hashing runs in a process pool (per server worker): at most
+# WORKERS + QUEUE hashes in flight, a request waits WAIT seconds for a slot
+# before a 503. Hashes made with another METHOD are upgraded at sign-in.
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', 8))
+app.config['PASSWORD_HASH_WAIT'] = float(os.getenv('PASSWORD_HASH_WAIT', 1))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+# Failed sign-ins allowed per account / per client address within the window
+app.config['LOGIN_MAX_FAILURES'] = int(os.getenv('LOGIN_MAX_FAILURES', 5))
+app.config['LOGIN_MAX_IP_FAILURES'] = int(os.getenv('LOGIN_MAX_IP_FAILURES', 50))
+app.config['LOGIN_FAILURE_WINDOW'] = int(os.getenv('LOGIN_FAILURE_WINDOW', 900))
+# Registrations allowed per client address within the same window
+app.config['REGISTER_MAX_PER_IP'] = int(os.getenv('REGISTER_MAX_PER_IP', 20))
+# Where the throttle counters live (Redis, shared by all workers); unset
+# keeps them per process
+app.config['THROTTLE_STORE_URL'] = os.getenv('THROTTLE_STORE_URL', os.getenv('CATALOGUE_CACHE_URL'))
+# Reverse proxies in front of the app that set X-Forwarded-For/-Proto; the
+# client address the throttles key on is taken from them (0 = direct)
+app.config['TRUSTED_PROXY_HOPS'] = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+
+# Background threads that build thumbnails/WebP variants of uploads
+app.config['IMAGE_WORKERS'] = int(os.getenv('IMAGE_WORKERS', 2))
+# Queue image processing as a job ("flask jobs worker") instead of a thread
+app.config['IMAGE_JOBS'] = os.getenv('IMAGE_JOBS', '1') == '1'
+
+# Background jobs (jobs.py): periodic jobs and their interval in seconds (0 = off)
+app.config['JOB_SCHEDULES'] = {
+    'orders.sync_statuses': int(os.getenv('JOB_ORDER_STATUS_EVERY', 600)),
+    'rollups.refresh': int(os.getenv('JOB_ROLLUPS_EVERY', 3600)),
+    'rollups.fold_orders': int(os.getenv('JOB_ROLLUPS_FOLD_EVERY', 30)),
+    'carts.purge_stale': int(os.getenv('JOB_CART_PURGE_EVERY', 86400)),
+    'jobs.purge': int(os.getenv('JOB_PURGE_EVERY', 86400)),
+    'recommendations.refresh': int(os.getenv('JOB_RECOMMENDATIONS_EVERY', 900)),
+    'recommendations.rebuild': int(os.getenv('JOB_RECOMMENDATIONS_REBUILD_EVERY', 86400)),
+    'orders.archive': int(os.getenv('JOB_ORDER_ARCHIVE_EVERY', 86400)),
+}
+app.config['JOB_LOCK_TIMEOUT'] = int(os.getenv('JOB_LOCK_TIMEOUT', 600))
+app.config['JOB_RETRY_BASE'] = int(os.getenv('JOB_RETRY_BASE', 10))
+app.config['JOB_RETENTION_DAYS'] = int(os.getenv('JOB_RETENTION_DAYS', 7))
+app.config['CART_TTL_DAYS'] = int(os.getenv('CART_TTL_DAYS', 30))
+# Completed orders older than this move to the archive tables (archive.py)
+app.config['ORDER_ARCHIVE_AFTER_DAYS'] = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', 365))
+app.config['ORDER_ARCHIVE_BATCH'] = int(os.getenv('ORDER_ARCHIVE_BATCH', 1000))
+
+# Gallery facet counts (facets.py): the in-memory index is rebuilt after
+# catalogue writes at most every REFRESH seconds, and at least every MAX_AGE
+app.config['FACET_REFRESH_SECONDS'] = int(os.getenv('FACET_REFRESH_SECONDS', 30))
+app.config['FACET_MAX_AGE'] = int(os.getenv('FACET_MAX_AGE', 600))
+app.config['FACET_ARTIST_LIMIT'] = int(os.getenv('FACET_ARTIST_LIMIT', 12))
+
+# Related artworks shown on the detail page (recommendations.py)
+app.config['RELATED_TOP_K'] = int(os.getenv('RELATED_TOP_K', 8))
+
+# JSON API (api.py): most ids/cart lines per batch request, and the smallest
+# response body worth compressing
+app.config['API_BATCH_MAX'] = int(os.getenv('API_BATCH_MAX', 100))
+app.config['API_COMPRESS_MIN_BYTES'] = int(os.getenv('API_COMPRESS_MIN_BYTES', 1024))
+
+# Startup (startup.py): warm each server worker's DB pool and catalogue cache
+# before it takes traffic; keep compiled template bytecode in this directory
+app.config['STARTUP_WARM'] = os.getenv('STARTUP_WARM', '1') == '1'
+app.config['TEMPLATE_CACHE_DIR'] = os.getenv('TEMPLATE_CACHE_DIR')
+
+# Catalogue cache (set CATALOGUE_CACHE_ENABLED=0 to compare against no cache)
+app.config['CATALOGUE_CACHE_ENABLED'] = os.getenv('CATALOGUE_CACHE_ENABLED', '1') == '1'
+app.config['CATALOGUE_CACHE_TTL'] = int(os.getenv('CATALOGUE_CACHE_TTL', 300))
+app.config['CATALOGUE_CACHE_SIZE'] = int(os.getenv('CATALOGUE_CACHE_SIZE', 5000))
+app.config['CATALOGUE_CACHE_URL'] = os.getenv('CATALOGUE_CACHE_URL')  # e.g. redis://localhost:6379/0
+
+# Rendered-page cache for / and /artwork/<id>
+app.config['PAGE_CACHE_ENABLED'] = os.getenv('PAGE_CACHE_ENABLED', '1') == '1'
+app.config['PAGE_CACHE_TTL'] = int(os.getenv('PAGE_CACHE_TTL', 300))
+app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', 1000))
+
+if app.config['TRUSTED_PROXY_HOPS']:
+    hops = app.config['TRUSTED_PROXY_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+db_pool.init_app(app)
+catalogue_cache.init_app(app)
+page_cache.init_app(app)
+instrumentation.init_app(app)
+passwords.init_app(app)
+jobs.init_app(app)
+recommendations.init_app(app)
+facets.init_app(app)
+archive.init_app(app)
+api.init_app(app)
+startup.init_app(app)
+app.cli.add_command(checkout_stress_command)
+app.cli.add_command(rollups.rollups_cli)
+images.init_app(app, on_done=lambda artwork_id: catalogue_cache.get_cache().invalidate_artworks([artwork_id]))
+app.cli.add_command(images.backfill_images_command)
+app.cli.add_command(benchmark.bench_cli)
+app.cli.add_command(migrate.db_cli)
+app.cli.add_command(bulk.bulk_cli)
+app.cli.add_command(jobs.jobs_cli)
+app.cli.add_command(recommendations.recommendations_cli)
+app.cli.add_command(archive.archive_cli)
+
 
 def get_db_connection():
-    conn = mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password=os.getenv("DB_PASSWORD"),   # <-- your MySQL password
-        database='artstore'
-    )
-    return conn
+    # Borrow a pooled connection; conn.close() hands it back to the pool.
+    return db_pool.get_connection()
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
-def index():
+
+# Cache loaders: only called on a cache miss, so hits never touch the pool.
+def load_artwork(artwork_id):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    art = fetch_artwork(cursor, artwork_id)
+    cursor.close()
+    conn.close()
+    return art
+
+
+def load_artworks(artwork_ids):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT a.*, ar.name as artist_name FROM artworks a LEFT JOIN artists ar ON a.artist_id = ar.artist_id')
-    artworks = cursor.fetchall()
+    rows = fetch_artworks_by_id(cursor, artwork_ids)
     cursor.close()
     conn.close()
-    return render_template('index.html', artworks=artworks)
+    return rows
+
+
+def load_listing_page(after, size, columns):
+    def loader():
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        page = fetch_artwork_page(cursor, after, size, columns=columns)
+        cursor.close()
+        conn.close()
+        return page
+    return loader
+
+@app.route('/')
+@cached_page(lambda kwargs: 'listing')
+def index():
+    size = page_size(request.args.get('size'), app.config['GALLERY_PAGE_SIZE'])
+    selection = facets.parse_selection(request.args)
+    sort = facets.parse_sort(request.args)
+    if selection or sort != 'newest':
+        token = request.args.get('after')
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(*facets.browse_query(selection, sort, token, size))
+        artworks, next_cursor = facets.browse_result(cursor.fetchall(), sort, size)
+        cursor.close()
+        conn.close()
+        is_first_page = not token
+    else:
+        after = decode_cursor(request.args.get('after'))
+        token = request.args.get('after') if after else None
+        artworks, next_cursor = catalogue_cache.get_cache().get_listing(
+            'card', token, size, load_listing_page(after, size, CARD_COLUMNS))
+        is_first_page = after is None
+    facet_panel, total = facets.facet_panel(facets.get_index(), selection, sort)
+    g.last_modified = max((a['updated_at'] for a in artworks), default=None)
+    return render_template('index.html', artworks=artworks, next_cursor=next_cursor,
+                           is_first_page=is_first_page, facets=facet_panel, total=total,
+                           sort=sort, browse_args=facets.query_args(selection, sort))
 
 
 
@@ -53,12 +253,16 @@ def register():
         username = request.form['username']
         email = request.form['email']
         password = request.form['password']
-        hashed = generate_password_hash(password)
+        if not passwords.signup_allowed():
+            flash('Too many sign-ups from your network. Please try again later.', 'danger')
+            return render_template('register.html')
+        hashed = passwords.hash_password(password)
         conn = get_db_connection()
         cursor = conn.cursor()
         try:
             cursor.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)',
                            (username, email, hashed))
+            rollups.on_user_created(cursor)
             conn.commit()
             flash('Registered! Please login.', 'success')
             return redirect(url_for('login'))
@@ -74,19 +278,32 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        if passwords.throttled('user', username):
+            flash('Too many failed attempts. Please try again later.', 'danger')
+            return render_template('login.html')
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         cursor.execute('SELECT * FROM users WHERE username = %s', (username,))
         user = cursor.fetchone()
         cursor.close()
         conn.close()
-        if user and check_password_hash(user['password'], password):
+        if user and passwords.verify_password(user['password'], password):
+            passwords.clear_failures('user', username)
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
+            passwords.rehash_if_needed(cursor, 'users', 'user_id', user['user_id'],
+                                       user['password'], password)
             session.permanent = True
             session['user_id'] = user['user_id']
             session['username'] = user['username']
+            cart_store.merge_on_login(cursor, user['user_id'])
+            conn.commit()
+            cursor.close()
+            conn.close()
             flash('Logged in successfully.', 'success')
             return redirect(url_for('index'))
         else:
+            passwords.record_failure('user', username)
             flash('Invalid credentials', 'danger')
     return render_template('login.html')
 
@@ -95,18 +312,28 @@ def admin_login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        if passwords.throttled('admin', username):
+            flash('Too many failed attempts. Please try again later.', 'danger')
+            return render_template('admin_login.html')
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         cursor.execute('SELECT * FROM admins WHERE username = %s', (username,))
         admin = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if admin and check_password_hash(admin['password'], password):
+        if admin and passwords.verify_password(admin['password'], password):
+            passwords.clear_failures('admin', username)
+            passwords.rehash_if_needed(cursor, 'admins', 'admin_id', admin['admin_id'],
+                                       admin['password'], password)
+            conn.commit()
+            cursor.close()
+            conn.close()
             session['admin_id'] = admin['admin_id']
             session['admin_username'] = admin['username']
             flash('Admin logged in.', 'success')
             return redirect(url_for('admin_dashboard'))
         else:
+            cursor.close()
+            conn.close()
+            passwords.record_failure('admin', username)
             flash('Invalid admin credentials', 'danger')
     return render_template('admin_login.html')
 
@@ -114,13 +341,13 @@ def admin_login():
 def admin_dashboard():
     if 'admin_id' not in session:
         return redirect(url_for('admin_login'))
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT a.*, ar.name as artist_name FROM artworks a LEFT JOIN artists ar ON a.artist_id = ar.artist_id')
-    artworks = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template('admin_dashboard.html', artworks=artworks)
+    after = decode_cursor(request.args.get('after'))
+    size = page_size(request.args.get('size'), app.config['GALLERY_PAGE_SIZE'])
+    token = request.args.get('after') if after else None
+    artworks, next_cursor = catalogue_cache.get_cache().get_listing(
+        'admin', token, size, load_listing_page(after, size, ADMIN_COLUMNS))
+    return render_template('admin_dashboard.html', artworks=artworks, next_cursor=next_cursor,
+                           is_first_page=after is None)
 
 @app.route('/admin/add', methods=['GET', 'POST'])
 def add_artwork():
@@ -139,11 +366,17 @@ def add_artwork():
         file = request.files.get('image')
         filename = None
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            filename = uploads.store_upload(file, app.config['UPLOAD_FOLDER'])
         cursor.execute('INSERT INTO artworks (title, description, price, image_filename, artist_id, available_qty) VALUES (%s,%s,%s,%s,%s,%s)',
                        (title, description, price, filename, artist_id, qty))
+        artwork_id = cursor.lastrowid
+        rollups.on_artwork_added(cursor, price)
+        if filename and app.config['IMAGE_JOBS']:
+            images.enqueue(cursor, [artwork_id], filename)
         conn.commit()
+        catalogue_cache.get_cache().invalidate_listings()
+        if filename and not app.config['IMAGE_JOBS']:
+            images.submit(artwork_id, filename)
         flash('Artwork added!', 'success')
         cursor.close()
         conn.close()
@@ -152,50 +385,92 @@ def add_artwork():
     conn.close()
     return render_template('add_artwork.html', artists=artists)
 
+@app.route('/admin/import', methods=['GET', 'POST'])
+def admin_import():
+    if 'admin_id' not in session:
+        return redirect(url_for('admin_login'))
+    if request.method == 'POST':
+        data = request.files.get('data')
+        if not data or not data.filename:
+            flash('Choose a CSV or JSONL file to import.', 'warning')
+            return redirect(url_for('admin_import'))
+        images_zip = request.files.get('images')
+        if images_zip and not images_zip.filename:
+            images_zip = None
+        # Progress lines are streamed while the batches are inserted.
+        return Response(stream_with_context(bulk.stream_import(data, images_zip)),
+                        mimetype='text/plain')
+    return render_template('admin_import.html')
+
+@app.route('/admin/export/<what>.<fmt>')
+def admin_export(what, fmt):
+    if 'admin_id' not in session:
+        return redirect(url_for('admin_login'))
+    if what not in bulk.EXPORTS or fmt not in bulk.FORMATS:
+        abort(404)
+    return Response(bulk.export(what, fmt), mimetype=bulk.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={what}.{fmt}'})
+
 
 
 
 @app.route('/artwork/<int:artwork_id>')
+@cached_page(lambda kwargs: f"artwork:{kwargs['artwork_id']}")
 def artwork_detail(artwork_id):
+    art = catalogue_cache.get_cache().get_artwork(artwork_id, load_artwork)
+    if not art:
+        flash('Artwork not found', 'warning')
+        return redirect(url_for('index'))
+    g.last_modified = art['updated_at']
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT a.*, ar.name as artist_name FROM artworks a LEFT JOIN artists ar ON a.artist_id = ar.artist_id WHERE a.artwork_id = %s', (artwork_id,))
-    art = cursor.fetchone()
+    related = recommendations.fetch_related(cursor, artwork_id)
     cursor.close()
     conn.close()
-    if not art:
-        flash('Artwork not found', 'warning')
-        return redirect(url_for('index'))
-    return render_template('artwork_detail.html', art=art)
+    return render_template('artwork_detail.html', art=art, related=related)
 
 @app.route('/add_to_cart/<int:artwork_id>', methods=['POST'])
 def add_to_cart(artwork_id):
-    qty = int(request.form.get('quantity', 1))
-    cart = session.get('cart', {})
-    cart[str(artwork_id)] = cart.get(str(artwork_id), 0) + qty
-    session['cart'] = cart
+    try:
+        qty = int(request.form.get('quantity', 1))
+    except ValueError:
+        qty = 0
+    if qty < 1:
+        flash('Please choose a quantity of at least 1.', 'warning')
+        return redirect(url_for('artwork_detail', artwork_id=artwork_id))
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cart_id = cart_store.current_cart_id(cursor, create=True)
+    added = cart_store.add_item(cursor, cart_id, artwork_id, qty)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    if not added:
+        flash('That artwork is no longer available.', 'warning')
+        return redirect(url_for('index'))
     flash('Added to cart', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/cart')
 def cart():
-    cart = session.get('cart', {})
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cart = cart_store.get_items(cursor, cart_store.current_cart_id(cursor))
+    conn.commit()
+    cursor.close()
+    conn.close()
     items = []
     total = 0.0
     if cart:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        format_ids = ','.join(['%s'] * len(cart.keys()))
-        cursor.execute(f'SELECT * FROM artworks WHERE artwork_id IN ({format_ids})', tuple(cart.keys()))
-        rows = cursor.fetchall()
-        for r in rows:
+        # Line prices come from the catalogue cache, which the admin write
+        # routes invalidate, so a cart view is one small indexed query.
+        rows = catalogue_cache.get_cache().get_artworks(cart.keys(), load_artworks)
+        for r in rows.values():
             aid = str(r['artwork_id'])
             q = cart.get(aid, 0)
             subtotal = q * float(r['price'])
             total += subtotal
             items.append({'art': r, 'qty': q, 'subtotal': subtotal})
-        cursor.close()
-        conn.close()
     return render_template('cart.html', items=items, total=total)
 
 @app.route('/checkout_page')
@@ -221,64 +496,31 @@ def checkout():
             flash('Please fill all fields before submitting.', 'danger')
             return redirect(url_for('checkout'))
 
-        cart = session.get('cart', {})
-        if not cart:
-            flash('Cart is empty.', 'warning')
-            return redirect(url_for('index'))
-
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-
-        # Fetch artworks
-        ids = tuple(cart.keys())
-        format_ids = ','.join(['%s'] * len(ids))
-        cursor.execute(f'SELECT * FROM artworks WHERE artwork_id IN ({format_ids})', ids)
-        rows = cursor.fetchall()
-
-        # Calculate total
-        total = sum(float(r['price']) * cart[str(r['artwork_id'])] for r in rows)
-
-        # Apply order discount
-        discount_percentage = 0
-        if total >= 10000:
-            discount_percentage = 15
-        elif total >= 5000:
-            discount_percentage = 10
-
-        discount_amount = total * discount_percentage / 100
-        total_after_discount = total - discount_amount
-
-
-        # Insert order
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO orders (user_id, total_amount, address, delivery_date, payment_mode)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (session['user_id'], total_after_discount, address, delivery_date, payment_mode))
-        order_id = cursor.lastrowid
-        
-
-        # Insert items
-        for r in rows:
-            qty = cart[str(r['artwork_id'])]
-            cursor.execute('''
-                INSERT INTO order_items (order_id, artwork_id, quantity, unit_price)
-                VALUES (%s, %s, %s, %s)
-            ''', (order_id, r['artwork_id'], qty, float(r['price'])))
-            cursor.execute('UPDATE artworks SET status = %s WHERE artwork_id = %s', ('Sold', r['artwork_id']))
-            cursor.execute('''
-                UPDATE artworks
-                SET available_qty = available_qty - %s
-                WHERE artwork_id = %s
-            ''', (qty, r['artwork_id']))
-
-
-
+        cart_id = cart_store.current_cart_id(cursor)
+        cart = cart_store.get_items(cursor, cart_id)
         conn.commit()
         cursor.close()
-        conn.close()
+        if not cart:
+            conn.close()
+            flash('Cart is empty.', 'warning')
+            return redirect(url_for('index'))
+
+        try:
+            order_id, total_after_discount, discount_percentage = place_order(
+                conn, session['user_id'], cart, address, delivery_date, payment_mode,
+                cart_id=cart_id)
+        except OutOfStock as e:
+            flash(f'Sorry, not enough stock left for: {", ".join(e.titles)}.', 'danger')
+            return redirect(url_for('cart'))
+        except InvalidQuantity:
+            flash('Every cart line needs a quantity of at least 1.', 'danger')
+            return redirect(url_for('cart'))
+        finally:
+            conn.close()
+        catalogue_cache.get_cache().invalidate_artworks(cart.keys())
 
-        session.pop('cart', None)
         # Prepare success message
         if discount_percentage > 0:
             message = f"🎉 Congrats! You got a {discount_percentage}% discount."
@@ -300,6 +542,7 @@ def checkout():
 def logout():
     session.pop('user_id', None)
     session.pop('username', None)
+    cart_store.forget()
     return redirect(url_for('login'))
 
 @app.route('/admin_logout')
@@ -308,9 +551,22 @@ def admin_logout():
     session.pop('admin_name', None)
     return redirect(url_for('admin_login'))
 
+@app.route('/admin/db_pool')
+def admin_db_pool():
+    if 'admin_id' not in session:
+        return redirect(url_for('admin_login'))
+    return jsonify(db_pool.get_pool().stats())
+
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    if 'admin_id' not in session:
+        return redirect(url_for('admin_login'))
+    return jsonify(catalogue=catalogue_cache.get_cache().stats(),
+                   pages=page_cache.get_cache().stats())
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return uploads.serve_upload(filename)
 # --------------------------
 # ADMIN DELETE ARTWORK
 # --------------------------
@@ -321,11 +577,16 @@ def delete_artwork(artwork_id):
         return redirect(url_for('admin_login'))
 
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM artworks WHERE artwork_id = %s', (artwork_id,))
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT price FROM artworks WHERE artwork_id = %s FOR UPDATE', (artwork_id,))
+    art = cursor.fetchone()
+    if art:
+        cursor.execute('DELETE FROM artworks WHERE artwork_id = %s', (artwork_id,))
+        rollups.on_artwork_deleted(cursor, artwork_id, art['price'])
     conn.commit()
     cursor.close()
     conn.close()
+    catalogue_cache.get_cache().invalidate_artworks([artwork_id])
     flash('Artwork deleted successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
@@ -361,6 +622,7 @@ def update_quantity(artwork_id):
     conn.commit()
     cursor.close()
     conn.close()
+    catalogue_cache.get_cache().invalidate_artworks([artwork_id])
 
     flash('Artwork quantity updated successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -375,43 +637,16 @@ def analytics():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    # --- Price distribution (for donut chart) ---
-    cursor.execute("""
-        SELECT 
-            CASE 
-                WHEN price < 1000 THEN 'Below ₹1000'
-                WHEN price BETWEEN 1000 AND 5000 THEN '₹1000 - ₹5000'
-                WHEN price BETWEEN 5000 AND 10000 THEN '₹5000 - ₹10000'
-                ELSE 'Above ₹10000'
-            END AS price_range,
-            COUNT(*) AS count
-        FROM artworks
-        GROUP BY price_range
-    """)
-    price_data = cursor.fetchall()
-
-    # --- Top 5 expensive artworks ---
-    cursor.execute("SELECT title, price FROM artworks ORDER BY price DESC LIMIT 5")
-    expensive_artworks = cursor.fetchall()
-
-    # --- 5 most recent artworks ---
-    cursor.execute("""
-        SELECT title, price, image_filename 
-        FROM artworks 
-        ORDER BY created_at DESC 
-        LIMIT 5
-    """)
-    recent_artworks = cursor.fetchall()
+    # Dashboards read only the precomputed rollups (see rollups.py)
+    data = rollups.read_analytics(cursor)
+    if data['updated_at'] is None:
+        rollups.refresh_all(conn)
+        data = rollups.read_analytics(cursor)
 
     cursor.close()
     conn.close()
 
-    return render_template(
-        'analytics.html',
-        price_data=price_data,
-        expensive_artworks=expensive_artworks,
-        recent_artworks=recent_artworks
-    )
+    return render_template('analytics.html', **data)
 
 @app.route('/search', methods=['GET'])
 def search():
@@ -420,45 +655,26 @@ def search():
         return redirect(url_for('login'))
 
     query = request.args.get('q', '').strip()
+    if not query:
+        return redirect(url_for('index'))
+    page = page_size(request.args.get('page'), 1, maximum=1000)
+    size = app.config['GALLERY_PAGE_SIZE']
 
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-
-    # Check available columns dynamically
-    cursor.execute("SHOW COLUMNS FROM artworks")
-    columns = [col['Field'] for col in cursor.fetchall()]
-
-    sql = "SELECT * FROM artworks"
-    params = ()
-
-    if query:
-        conditions = []
-        if 'title' in columns:
-            conditions.append("title LIKE %s")
-        if 'artist_name' in columns:
-            conditions.append("artist_name LIKE %s")
-        if 'artist' in columns:
-            conditions.append("artist LIKE %s")
-        if 'description' in columns:
-            conditions.append("description LIKE %s")
-
-        if conditions:
-            sql += " WHERE " + " OR ".join(conditions)
-            params = tuple([f"%{query}%"] * len(conditions))
-
-    cursor.execute(sql, params)
-    artworks = cursor.fetchall()
-
+    artworks, has_more = search_artworks(cursor, query, page, size)
     cursor.close()
     conn.close()
 
     # ✅ If no artworks found, flash message & return index with message
     if not artworks:
         flash(f'No results found for "{query}". Please try another search.', 'info')
-        return render_template('index.html', artworks=[], query=query, no_results=True)
+        return render_template('index.html', artworks=[], query=query, no_results=True,
+                               page=page, has_more=False)
 
     # ✅ If artworks found, show them
-    return render_template('index.html', artworks=artworks, query=query, no_results=False)
+    return render_template('index.html', artworks=artworks, query=query, no_results=False,
+                           page=page, has_more=has_more)
 
 from datetime import date, datetime
 
@@ -479,65 +695,28 @@ def profile():
     """, (session['user_id'],))
     user_info = cursor.fetchone()
 
-    # Fetch all orders for this user
-    cursor.execute("""
-        SELECT order_id, total_amount, status, delivery_date, created_at
-        FROM orders
-        WHERE user_id = %s
-        ORDER BY created_at DESC
-    """, (session['user_id'],))
-    orders = cursor.fetchall()
-
-    # ---------------------- 🔥 AUTO UPDATE STATUS ----------------------
-    for order in orders:
-        order_date = order["created_at"]
-        delivery_date = order["delivery_date"]
-
-        # Convert datetime to date only
-        if isinstance(order_date, datetime):
-            order_date = order_date.date()
-
-        if isinstance(delivery_date, datetime):
-            delivery_date = delivery_date.date()
-
-        # --- If delivery date passed → mark completed ---
-        if delivery_date < date.today() and order["status"] != "Completed":
-            cursor.execute("""
-                UPDATE orders 
-                SET status = 'Completed'
-                WHERE order_id = %s
-            """, (order["order_id"],))
-            conn.commit()
-            order["status"] = "Completed"
-
-        # --- If delivery date is today or future → pending ---
-        elif delivery_date >= date.today() and order["status"] != "Pending":
-            cursor.execute("""
-                UPDATE orders 
-                SET status = 'Pending'
-                WHERE order_id = %s
-            """, (order["order_id"],))
-            conn.commit()
-            order["status"] = "Pending"
+    # Order statuses are moved on by the orders.sync_statuses job.
 
-        # Save cleaned date formats so they are easy to show in HTML
-        order["order_date"] = order_date
-        order["delivery_date"] = delivery_date
+    # Fetch one page of this user's orders (?archive=1: the archived ones)
+    archived = request.args.get('archive') == '1'
+    before = decode_cursor(request.args.get('before'))
+    size = page_size(request.args.get('size'), app.config['PROFILE_ORDERS_PAGE_SIZE'])
+    orders, next_cursor = fetch_user_orders(cursor, session['user_id'], before, size, archived)
 
     # ---------------------- Fetch order items ----------------------
+    items_by_order = fetch_items_by_order(cursor, [o["order_id"] for o in orders], archived)
+
     for order in orders:
-        cursor.execute("""
-            SELECT oi.quantity, oi.unit_price,
-                   a.title, a.image_filename
-            FROM order_items oi
-            JOIN artworks a ON oi.artwork_id = a.artwork_id
-            WHERE oi.order_id = %s
-        """, (order["order_id"],))
-        
-        items_list = cursor.fetchall()
+        # Convert datetime to date only so they are easy to show in HTML
+        if isinstance(order["created_at"], datetime):
+            order["order_date"] = order["created_at"].date()
+        else:
+            order["order_date"] = order["created_at"]
+        if isinstance(order["delivery_date"], datetime):
+            order["delivery_date"] = order["delivery_date"].date()
 
         final_items = []
-        for item in items_list:
+        for item in items_by_order.get(order["order_id"], []):
             image = item["image_filename"] or "placeholder.png"
 
             final_items.append({
@@ -552,7 +731,9 @@ def profile():
     cursor.close()
     conn.close()
 
-    return render_template("profile.html", user=user_info, orders=orders)
+    return render_template("profile.html", user=user_info, orders=orders,
+                           next_cursor=next_cursor, is_first_page=before is None,
+                           archived=archived)
 
 
 
@@ -564,22 +745,19 @@ def admin_manage():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT COUNT(*) AS count FROM users")
-    total_users = cursor.fetchone()['count']
-
-    cursor.execute("SELECT COUNT(*) AS count FROM orders")
-    total_orders = cursor.fetchone()['count']
-
-    cursor.execute("SELECT COUNT(*) AS count FROM artworks")
-    total_artworks = cursor.fetchone()['count']
+    totals, updated_at = rollups.read_totals(cursor)
+    if updated_at is None:
+        rollups.refresh_all(conn)
+        totals, updated_at = rollups.read_totals(cursor)
 
     cursor.close()
     conn.close()
 
     return render_template('admin_manage.html',
-                           total_users=total_users,
-                           total_orders=total_orders,
-                           total_artworks=total_artworks,
+                           total_users=totals.get('users', 0),
+                           total_orders=totals.get('orders', 0),
+                           total_artworks=totals.get('artworks', 0),
+                           updated_at=updated_at,
                            current_year=datetime.now().year)
 
 
@@ -588,38 +766,38 @@ def admin_manage():
 def admin_manage_users():
     if not session.get('admin_id'):
         return redirect(url_for('admin_login'))
-
-    conn = get_db_connection()  # get connection
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users")
-    user_data = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    return render_template('admin_users.html', users=user_data)
+    return admin_listing(admin_tables.USERS, 'admin_users.html', 'users')
 
 
 @app.route('/admin/manage/orders')
 def admin_manage_orders():
     if not session.get('admin_id'):
         return redirect(url_for('admin_login'))
+    if request.args.get('archive') == '1':
+        return admin_listing(admin_tables.ORDERS_ARCHIVE, 'admin_orders.html', 'archived_orders')
+    return admin_listing(admin_tables.ORDERS, 'admin_orders.html', 'orders')
+
 
-    conn = get_db_connection()  # get connection
+def admin_listing(listing, template, name):
+    if request.args.get('format') == 'csv':
+        rows = bulk.stream_rows(*listing.export_query(request.args))
+        return Response(bulk.write_chunks(rows, listing.columns, 'csv'), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={name}.csv'})
+
+    size = page_size(request.args.get('size'), app.config['ADMIN_PAGE_SIZE'], maximum=500)
+    conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT o.order_id, u.username, o.total_amount, o.status, o.created_at
-        FROM orders o
-        JOIN users u ON o.user_id = u.user_id
-    """)
-    order_data = cursor.fetchall()
+    rows, next_cursor, query, is_first_page = listing.fetch_page(cursor, request.args, size)
     cursor.close()
     conn.close()
-
-    return render_template('admin_orders.html', orders=order_data)
+    return render_template(template, rows=rows, next_cursor=next_cursor, query=query,
+                           is_first_page=is_first_page, statuses=admin_tables.ORDER_STATUSES)
 
 
 
 
 if __name__ == '__main__':
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # Development server only; deploy with "python serve.py run".
+    startup.prepare(app)
+    startup.warm(app)
     app.run(debug=True)
@@ -0,0 +1,131 @@
+"""Moves old, completed orders from the hot tables to the archive.
+
+``orders``/``order_items`` only ever grew, so every history, admin and
+rollup query paid for years of orders nobody looks at. The orders.archive
+job moves orders that are Completed and older than ORDER_ARCHIVE_AFTER_DAYS
+into ``orders_archive``/``order_items_archive``, ORDER_ARCHIVE_BATCH orders
+per transaction, so the hot tables and their indexes stay small enough to
+live in the buffer pool.
+
+Pages read the hot tables by default; the profile, the admin order table
+and /api/v1/orders read the archive instead with ``?archive=1``. The
+rollup refresh counts both.
+
+    flask archive run [--days N] [--batch N]
+    flask archive status
+"""
+import time
+
+import click
+from flask.cli import with_appcontext
+
+import db_pool
+import jobs
+
+ORDER_COLUMNS = 'order_id, user_id, total_amount, status, address, delivery_date, payment_mode, created_at'
+ITEM_COLUMNS = 'order_item_id, order_id, artwork_id, quantity, unit_price'
+
+_config = {'after_days': 365, 'batch': 1000}
+
+
+def init_app(app):
+    _config.update(after_days=app.config['ORDER_ARCHIVE_AFTER_DAYS'],
+                   batch=app.config['ORDER_ARCHIVE_BATCH'])
+
+
+def order_tables(archived):
+    # (orders table, order items table) a read path should use.
+    return ('orders_archive', 'order_items_archive') if archived else ('orders', 'order_items')
+
+
+def archive_batch(conn, after_days, batch):
+    # Moves one batch in one transaction; returns how many orders moved.
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT order_id FROM orders
+            WHERE status = 'Completed' AND created_at < NOW() - INTERVAL %s DAY
+            ORDER BY created_at, order_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (after_days, batch))
+        order_ids = tuple(order_id for (order_id,) in cursor.fetchall())
+        if order_ids:
+            format_ids = ','.join(['%s'] * len(order_ids))
+            cursor.execute(f'''
+                INSERT INTO orders_archive ({ORDER_COLUMNS})
+                SELECT {ORDER_COLUMNS} FROM orders WHERE order_id IN ({format_ids})
+            ''', order_ids)
+            cursor.execute(f'''
+                INSERT INTO order_items_archive ({ITEM_COLUMNS})
+                SELECT {ITEM_COLUMNS} FROM order_items WHERE order_id IN ({format_ids})
+            ''', order_ids)
+            cursor.execute(f'DELETE FROM order_items WHERE order_id IN ({format_ids})', order_ids)
+            cursor.execute(f'DELETE FROM orders WHERE order_id IN ({format_ids})', order_ids)
+        conn.commit()
+        return len(order_ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def archive_orders(conn, after_days=None, batch=None, echo=None):
+    after_days = _config['after_days'] if after_days is None else after_days
+    batch = batch or _config['batch']
+    start = time.perf_counter()
+    moved = 0
+    while True:
+        count = archive_batch(conn, after_days, batch)
+        moved += count
+        if echo and count:
+            echo(f'  {moved} orders archived')
+        if count < batch:
+            break
+    if echo:
+        echo(f'{moved} orders older than {after_days} days archived in {time.perf_counter() - start:.1f}s')
+    return moved
+
+
+@jobs.job('orders.archive')
+def archive_job(conn, payload):
+    archive_orders(conn, payload.get('after_days'), payload.get('batch'))
+
+
+@click.group('archive')
+def archive_cli():
+    """Order history archiving."""
+
+
+@archive_cli.command('run')
+@click.option('--days', type=int, default=None, help='Archive completed orders older than this (default ORDER_ARCHIVE_AFTER_DAYS).')
+@click.option('--batch', type=int, default=None, help='Orders moved per transaction (default ORDER_ARCHIVE_BATCH).')
+@with_appcontext
+def run_command(days, batch):
+    """Move old, completed orders to the archive tables now."""
+    conn = db_pool.get_pool().acquire()
+    try:
+        archive_orders(conn, days, batch, echo=click.echo)
+    finally:
+        conn.release()
+
+
+@archive_cli.command('status')
+@with_appcontext
+def status_command():
+    """Row counts of the hot and archive order tables."""
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        for table in ('orders', 'order_items', 'orders_archive', 'order_items_archive'):
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            click.echo(f'{table:<20} {cursor.fetchone()[0]}')
+        cursor.execute('''
+            SELECT COUNT(*) FROM orders
+            WHERE status = 'Completed' AND created_at < NOW() - INTERVAL %s DAY
+        ''', (_config['after_days'],))
+        click.echo(f"due for archiving ({_config['after_days']} days): {cursor.fetchone()[0]}")
+        cursor.close()
+    finally:
+        conn.release()
@@ -0,0 +1,388 @@
+"""ASGI entry point with async versions of the read-heavy routes.
+
+    CATALOGUE_CACHE_URL=redis://localhost:6379/0 uvicorn asgi:application --workers 2
+    python asgi.py bench --users 64
+
+With more than one worker the caches must live in Redis (CATALOGUE_CACHE_URL):
+in-process caches are only invalidated in the worker that made the change.
+
+/, /artwork/<id>, /search and /analytics are served here on an aiomysql
+pool, so a single worker keeps many queries in flight at once and
+/analytics issues its three reads concurrently. Every other route (and
+anything not GET/HEAD) is handed to the regular Flask app through
+asgiref's WsgiToAsgi. Pages are still rendered with Flask's templates,
+session cookie and caches, so the two halves are interchangeable.
+"""
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import time
+
+import click
+from flask import flash, g, make_response, redirect, render_template, request, session, url_for
+
+import benchmark
+import catalogue_cache
+import db_pool
+import facets
+import instrumentation
+import page_cache
+import recommendations
+import rollups
+import search as search_queries
+import startup
+from catalogue import CARD_COLUMNS, DETAIL_SQL, artwork_page_query, artwork_page_result
+from pagination import decode_cursor, page_size
+from serve import wait_until_up
+
+app = startup.get_app()
+
+try:
+    import aiomysql
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # optional: only needed for the async mode
+    aiomysql = WsgiToAsgi = None
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+# -- database ---------------------------------------------------------------------
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                args = app.config['DB_CONNECT_ARGS']
+                # autocommit: a pooled connection must not keep serving reads
+                # from a stale REPEATABLE READ snapshot.
+                _pool = await aiomysql.create_pool(
+                    host=args['host'], user=args['user'], password=args['password'] or '',
+                    db=args['database'], charset='utf8mb4', autocommit=True,
+                    minsize=app.config['ASYNC_DB_POOL_MIN'],
+                    maxsize=app.config['ASYNC_DB_POOL_MAX'],
+                    pool_recycle=app.config['DB_POOL_RECYCLE'])
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+async def fetchall(sql, params=()):
+    pool = await get_pool()
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, params or None)
+            rows = await cursor.fetchall()
+    if app.config['PERF_INSTRUMENTATION']:
+        instrumentation.record_query(sql, params, time.perf_counter() - start, len(rows))
+    return list(rows)
+
+
+async def fetchone(sql, params=()):
+    rows = await fetchall(sql, params)
+    return rows[0] if rows else None
+
+
+# -- views ------------------------------------------------------------------------
+# Same behaviour as the sync views of the same name in app.py.
+
+async def cached(page_scope, view):
+    cache = page_cache.get_cache()
+    if cache.bypassed():
+        return await view()
+    key = cache.key(page_scope)
+    entry = cache.lookup(key)
+    if entry is not None:
+        response = make_response(entry['body'])
+    else:
+        start = time.perf_counter()
+        response = make_response(await view())
+        entry = cache.store(key, response, time.perf_counter() - start)
+        if entry is None:
+            return response
+    return cache.finish(response, entry)
+
+
+def index_needs_sync():
+    # Filtered and re-sorted listings (and the first facet index build) are
+    # served by the sync view.
+    return (facets.get_index(wait=False) is None or bool(facets.parse_selection(request.args))
+            or facets.parse_sort(request.args) != 'newest')
+
+
+async def index():
+    index = facets.get_index(wait=False)
+
+    async def view():
+        after = decode_cursor(request.args.get('after'))
+        size = page_size(request.args.get('size'), app.config['GALLERY_PAGE_SIZE'])
+        token = request.args.get('after') if after else None
+
+        async def loader():
+            return artwork_page_result(await fetchall(*artwork_page_query(after, size, CARD_COLUMNS)), size)
+
+        artworks, next_cursor = await catalogue_cache.get_cache().aget_listing('card', token, size, loader)
+        facet_panel, total = facets.facet_panel(index, {}, 'newest')
+        g.last_modified = max((a['updated_at'] for a in artworks), default=None)
+        return render_template('index.html', artworks=artworks, next_cursor=next_cursor,
+                               is_first_page=after is None, facets=facet_panel, total=total,
+                               sort='newest', browse_args={})
+    return await cached('listing', view)
+
+
+async def artwork_detail(artwork_id):
+    async def view():
+        async def loader(artwork_id):
+            return await fetchone(DETAIL_SQL + ' WHERE a.artwork_id = %s', (artwork_id,))
+
+        art = await catalogue_cache.get_cache().aget_artwork(artwork_id, loader)
+        if not art:
+            flash('Artwork not found', 'warning')
+            return redirect(url_for('index'))
+        g.last_modified = art['updated_at']
+        related = await fetchall(recommendations.RELATED_SQL, (artwork_id,))
+        return render_template('artwork_detail.html', art=art, related=related)
+    return await cached(f'artwork:{artwork_id}', view)
+
+
+async def search():
+    if 'user_id' not in session:
+        flash('Please login to search artworks.', 'warning')
+        return redirect(url_for('login'))
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return redirect(url_for('index'))
+    page = page_size(request.args.get('page'), 1, maximum=1000)
+    size = app.config['GALLERY_PAGE_SIZE']
+
+    schema = search_queries.cached_schema()
+    if schema is None:
+        schema = search_queries.remember_schema(
+            *await asyncio.gather(*(fetchall(sql) for sql in search_queries.SCHEMA_QUERIES)))
+    sql = search_queries.search_query(schema, query, page, size)
+    artworks, has_more = (search_queries.search_result(await fetchall(*sql), size)
+                          if sql else ([], False))
+
+    if not artworks:
+        flash(f'No results found for "{query}". Please try another search.', 'info')
+        return render_template('index.html', artworks=[], query=query, no_results=True,
+                               page=page, has_more=False)
+    return render_template('index.html', artworks=artworks, query=query, no_results=False,
+                           page=page, has_more=has_more)
+
+
+async def analytics():
+    if 'user_id' not in session and 'admin_id' not in session:
+        flash("Please login to view analytics.", "warning")
+        return redirect(url_for('login'))
+
+    async def read():
+        results = await asyncio.gather(*(fetchall(sql, params)
+                                         for sql, params in rollups.analytics_queries()))
+        return rollups.assemble_analytics(*results)
+
+    data = await read()
+    if data['updated_at'] is None:
+        # First run: bootstrap the rollups, as the sync view does.
+        await asyncio.to_thread(refresh_rollups)
+        data = await read()
+    return render_template('analytics.html', **data)
+
+
+def refresh_rollups():
+    conn = db_pool.get_pool().acquire()
+    try:
+        rollups.refresh_all(conn)
+    finally:
+        conn.release()
+
+
+ASYNC_VIEWS = {
+    'index': index,
+    'artwork_detail': artwork_detail,
+    'search': search,
+    'analytics': analytics,
+}
+# Checked before any before_request hook runs: a request handed to the sync
+# app must not run them twice.
+SYNC_WHEN = {
+    'index': index_needs_sync,
+}
+
+
+# -- ASGI plumbing ------------------------------------------------------------------
+
+def wsgi_environ(scope):
+    # Enough of a WSGI environ for Flask to build its request, session and
+    # url_for from; these views never read a request body.
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncApplication:
+    def __init__(self, flask_app, views, sync_when):
+        self.flask_app = flask_app
+        self.views = views
+        self.sync_when = sync_when
+        self.fallback = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            if await self.handle(scope, send):
+                return
+        await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await get_pool()
+                await asyncio.to_thread(startup.warm, self.flask_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_pool()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, send):
+        # Returns False when the request is not ours and the sync app should
+        # answer it instead; that is decided before the request hooks run.
+        flask_app = self.flask_app
+        with flask_app.request_context(wsgi_environ(scope)):
+            view = self.views.get(request.endpoint)
+            if view is None:
+                return False
+            needs_sync = self.sync_when.get(request.endpoint)
+            if needs_sync is not None and needs_sync():
+                return False
+            # Same dispatch and error handling as Flask's wsgi_app.
+            try:
+                try:
+                    rv = flask_app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**request.view_args)
+                except Exception as e:
+                    rv = flask_app.handle_user_exception(e)
+                response = flask_app.finalize_request(rv)
+            except Exception as e:
+                response = flask_app.handle_exception(e)
+            body = b'' if scope['method'] == 'HEAD' else response.get_data()
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                        for k, v in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return True
+
+
+application = AsyncApplication(app, ASYNC_VIEWS, SYNC_WHEN) if aiomysql is not None else None
+
+
+# -- side-by-side benchmark -----------------------------------------------------------
+
+@click.group()
+def cli():
+    """Async (ASGI) mode of the read-heavy routes."""
+
+
+@cli.command('bench')
+@click.option('--users', 'vusers', default=64, show_default=True, help='Concurrent virtual users.')
+@click.option('--duration', default=30.0, show_default=True, help='Measured seconds per server.')
+@click.option('--warmup', default=5.0, show_default=True)
+@click.option('--threads', type=int, default=8, show_default=True,
+              help='Threads of the single sync worker.')
+@click.option('--caches/--no-caches', default=False, show_default=True,
+              help='Keep the catalogue/page caches on (they hide the DB waits being compared).')
+@click.option('--sync-port', default=8052, show_default=True)
+@click.option('--async-port', default=8053, show_default=True)
+@click.option('--admin-username', default='admin', show_default=True)
+@click.option('--admin-password', envvar='BENCH_ADMIN_PASSWORD')
+def bench_command(vusers, duration, warmup, threads, caches, sync_port, async_port,
+                  admin_username, admin_password):
+    """One sync worker (gunicorn gthread) versus one async worker (uvicorn).
+
+    Both serve the same database and are driven over HTTP with the
+    read-only part of the benchmark.py route mix.
+    """
+    if application is None:
+        raise click.ClickException('The async mode needs aiomysql and asgiref (and uvicorn to serve it).')
+    env = dict(os.environ)
+    if not caches:
+        env.update(CATALOGUE_CACHE_ENABLED='0', PAGE_CACHE_ENABLED='0')
+    # Same number of database connections on both sides.
+    env.update(DB_POOL_SIZE=str(threads), DB_POOL_MAX_OVERFLOW='0',
+               ASYNC_DB_POOL_MAX=str(threads))
+    servers = (
+        ('sync', sync_port,
+         [sys.executable, os.path.join(app.root_path, 'serve.py'), 'run', '--server', 'gunicorn',
+          '--bind', f'127.0.0.1:{sync_port}', '--workers', '1', '--threads', str(threads),
+          '--jobs', '0']),
+        ('async', async_port,
+         [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+          '--port', str(async_port), '--workers', '1', '--no-access-log']),
+    )
+    mix = {name: weight for name, weight in benchmark.default_mix().items()
+           if name in ('index', 'artwork', 'search', 'analytics')}
+
+    results = []
+    with app.app_context():
+        for label, port, command in servers:
+            process = subprocess.Popen(command, cwd=app.root_path, env=env)
+            try:
+                url = f'http://127.0.0.1:{port}'
+                wait_until_up(url, process)
+                result, path = benchmark.run_benchmark(
+                    app, vusers, duration, warmup, mix=mix, base_url=url,
+                    admin_username=admin_username, admin_password=admin_password, label=label)
+                benchmark.print_report(result)
+                click.echo(f'Saved {path}\n')
+                results.append(result)
+            finally:
+                process.terminate()
+                process.wait(60)
+    benchmark.print_comparison(*results)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,651 @@
+"""Synthetic data seeding and a concurrent load driver for the main routes.
+
+    flask bench seed --size 100k --reset
+    flask bench run --users 16 --duration 30 --label baseline
+    flask bench compare bench_results/<a>.json bench_results/<b>.json
+
+``run`` drives the app in-process through the Flask test client (no server
+needed) or, with --base-url, a running server over HTTP. Either way the data
+lives in the local MySQL/MariaDB named by the DB_* settings; nothing here
+talks to the network beyond that.
+"""
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+import catalogue_cache
+import db_pool
+import instrumentation
+import migrate
+import page_cache
+import rollups
+
+SIZES = {
+    '1k': {'artists': 50, 'artworks': 1_000, 'users': 200, 'orders': 2_000},
+    '100k': {'artists': 2_000, 'artworks': 100_000, 'users': 10_000, 'orders': 100_000},
+    '1m': {'artists': 20_000, 'artworks': 1_000_000, 'users': 100_000, 'orders': 1_000_000},
+}
+BENCH_PASSWORD = 'benchpass'
+# The first artworks of every seed get effectively unlimited stock so the
+# checkout scenario never runs dry.
+HOT_ARTWORKS = 100
+HOT_STOCK = 10 ** 6
+RESULTS_DIR = 'bench_results'
+
+WORDS = ('sunset', 'river', 'abstract', 'portrait', 'ocean', 'forest', 'city', 'dream',
+         'light', 'shadow', 'monsoon', 'garden', 'mountain', 'blue', 'golden', 'silent',
+         'harbour', 'festival', 'study', 'night', 'lotus', 'desert', 'rain', 'temple')
+FIRST_NAMES = ('Asha', 'Ravi', 'Meera', 'Kabir', 'Leela', 'Arjun', 'Nina', 'Omar',
+               'Priya', 'Sam', 'Tara', 'Vikram', 'Zoya', 'Ishaan', 'Maya', 'Dev')
+LAST_NAMES = ('Roy', 'Kumar', 'Iyer', 'Shah', 'Das', 'Mehta', 'Khan', 'Bose',
+              'Nair', 'Rao', 'Singh', 'Patel', 'Ghosh', 'Menon', 'Sen', 'Joshi')
+
+# name -> (endpoint, identity, weight in the default mix)
+SCENARIOS = {
+    'index': ('index', 'anon', 30),
+    'artwork': ('artwork_detail', 'anon', 30),
+    'search': ('search', 'user', 10),
+    'cart': ('cart', 'user', 6),
+    'checkout': ('checkout', 'user', 2),
+    'profile': ('profile', 'user', 10),
+    'analytics': ('analytics', 'user', 8),
+    'admin_manage': ('admin_manage', 'admin', 4),
+}
+
+
+# -- seeding ----------------------------------------------------------------------
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert_sql(table, columns):
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+
+
+def _insert(conn, table, columns, rows, batch_size, total, on_batch=None):
+    # on_batch(cursor) runs inside each batch's transaction, e.g. to write
+    # the child rows generated alongside it.
+    sql = _insert_sql(table, columns)
+    cursor = conn.cursor()
+    done, start = 0, time.perf_counter()
+    for batch in _batched(rows, batch_size):
+        cursor.executemany(sql, batch)
+        if on_batch is not None:
+            on_batch(cursor)
+        conn.commit()
+        done += len(batch)
+        click.echo(f'\r  {table}: {done:,}/{total:,}', nl=False)
+    cursor.close()
+    click.echo(f'\r  {table}: {done:,} rows in {time.perf_counter() - start:.1f}s')
+
+
+def _next_id(conn, table, column):
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT COALESCE(MAX({column}), 0) FROM {table}')
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return value + 1
+
+
+def seed(conn, counts, batch_size=5000, rng=None):
+    # Bulk load: skip per-row FK/unique checks, the generated ids are consistent.
+    # The connection is pooled, so the checks come back on even if seeding fails.
+    cursor = conn.cursor()
+    cursor.execute('SET foreign_key_checks = 0, unique_checks = 0')
+    cursor.close()
+    try:
+        _seed_rows(conn, counts, batch_size, rng or random.Random(42))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor = conn.cursor()
+        cursor.execute('SET foreign_key_checks = 1, unique_checks = 1')
+        cursor.close()
+    rollups.refresh_all(conn)
+
+
+def _seed_rows(conn, counts, batch_size, rng):
+    now = datetime.now().replace(microsecond=0)
+    two_years = 2 * 365 * 86400
+
+    def moment():
+        return now - timedelta(seconds=rng.randint(0, two_years))
+
+    first_artist = _next_id(conn, 'artists', 'artist_id')
+    artist_ids = range(first_artist, first_artist + counts['artists'])
+    _insert(conn, 'artists', ('artist_id', 'name', 'bio'), (
+        (i, f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}',
+         f'Works mostly with {rng.choice(WORDS)} and {rng.choice(WORDS)} themes.')
+        for i in artist_ids), batch_size, counts['artists'])
+
+    first_artwork = _next_id(conn, 'artworks', 'artwork_id')
+    prices = [round(rng.uniform(100, 50000), 2) for _ in range(counts['artworks'])]
+
+    def artworks():
+        for n, price in enumerate(prices):
+            words = rng.sample(WORDS, 6)
+            qty = HOT_STOCK if n < HOT_ARTWORKS else rng.randint(0, 20)
+            yield (first_artwork + n, ' '.join(words[:3]).title(),
+                   'A study of ' + ', '.join(words[1:]) + '. ' + ' '.join(rng.choices(WORDS, k=20)),
+                   price, rng.choice(artist_ids), qty,
+                   'Available' if qty else 'Sold', moment())
+    _insert(conn, 'artworks', ('artwork_id', 'title', 'description', 'price', 'artist_id',
+                               'available_qty', 'status', 'created_at'),
+            artworks(), batch_size, counts['artworks'])
+
+    first_user = _next_id(conn, 'users', 'user_id')
+    # One hash for every synthetic account; hashing a million times would
+    # dominate the seed.
+    password = generate_password_hash(BENCH_PASSWORD)
+    _insert(conn, 'users', ('user_id', 'username', 'email', 'password', 'created_at'), (
+        (i, f'bench{i}', f'bench{i}@example.test', password, moment())
+        for i in range(first_user, first_user + counts['users'])), batch_size, counts['users'])
+
+    first_order = _next_id(conn, 'orders', 'order_id')
+    items = []
+    item_sql = _insert_sql('order_items', ('order_id', 'artwork_id', 'quantity', 'unit_price'))
+
+    def flush_items(cursor):
+        cursor.executemany(item_sql, items)
+        items.clear()
+
+    def orders():
+        today = date.today()
+        for order_id in range(first_order, first_order + counts['orders']):
+            placed = moment()
+            delivery = placed.date() + timedelta(days=rng.randint(3, 10))
+            total = 0
+            for _ in range(rng.randint(1, 3)):
+                n = rng.randrange(len(prices))
+                qty = rng.randint(1, 2)
+                total += prices[n] * qty
+                items.append((order_id, first_artwork + n, qty, prices[n]))
+            yield (order_id, rng.randrange(first_user, first_user + counts['users']),
+                   round(total, 2), 'Completed' if delivery < today else 'Pending',
+                   'Bench Street 1', delivery, rng.choice(('COD', 'UPI', 'Card')), placed)
+    _insert(conn, 'orders', ('order_id', 'user_id', 'total_amount', 'status', 'address',
+                             'delivery_date', 'payment_mode', 'created_at'),
+            orders(), batch_size, counts['orders'], on_batch=flush_items)
+
+
+# -- clients ----------------------------------------------------------------------
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def sign_in(self, user_id=None, username=None, admin_id=None):
+        with self.client.session_transaction() as sess:
+            if user_id is not None:
+                sess['user_id'] = user_id
+                sess['username'] = username
+            if admin_id is not None:
+                sess['admin_id'] = admin_id
+                sess['admin_username'] = 'bench-admin'
+        return True
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    # Plain urllib with a cookie jar. It opens a connection per request, so
+    # compare HTTP runs with HTTP runs only.
+
+    def __init__(self, base_url, admin_username=None, admin_password=None):
+        self.base_url = base_url.rstrip('/')
+        self.admin_username = admin_username
+        self.admin_password = admin_password
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def sign_in(self, user_id=None, username=None, admin_id=None):
+        if admin_id is not None:
+            if not self.admin_username:
+                return False
+            status = self.request('POST', '/admin/login', {
+                'username': self.admin_username, 'password': self.admin_password})
+        else:
+            status = self.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+        return status in (302, 303)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def get_text(self, path):
+        req = urllib.request.Request(self.base_url + path)
+        with self.opener.open(req, timeout=60) as resp:
+            return resp.read().decode()
+
+
+# -- load driver ------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile.
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise click.BadParameter(f'unknown route {name!r}; choose from {", ".join(SCENARIOS)}')
+        mix[name] = float(weight) if weight else SCENARIOS[name][2]
+    return mix
+
+
+_METRIC_LINE = re.compile(r'^artvault_db_queries_per_request_(sum|count)\{endpoint="([^"]+)"\} (\S+)$')
+
+
+def query_totals(admin_client=None):
+    # endpoint -> [statements, requests], from the instrumentation registry
+    # (in-process) or the /metrics exposition of the server under test.
+    totals = {}
+    if admin_client is None:
+        for endpoint, hist in list(instrumentation.registry.queries_per_request.items()):
+            _, count, total = hist.samples()
+            totals[endpoint] = [total, count]
+        return totals
+    try:
+        text = admin_client.get_text('/metrics')
+    except (urllib.error.URLError, OSError):
+        return totals
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            kind, endpoint, value = match.groups()
+            totals.setdefault(endpoint, [0.0, 0.0])[kind == 'count'] = float(value)
+    return totals
+
+
+class VirtualUser:
+    def __init__(self, make_client, user, admin_id, fixtures, rng):
+        self.rng = rng
+        self.fixtures = fixtures
+        self.clients = {'anon': make_client(), 'user': make_client(), 'admin': make_client()}
+        self.signed_in = {
+            'anon': True,
+            'user': self.clients['user'].sign_in(user_id=user['user_id'], username=user['username']),
+            'admin': admin_id is not None and self.clients['admin'].sign_in(admin_id=admin_id),
+        }
+
+    def _random_artwork(self):
+        return self.rng.randint(self.fixtures['min_artwork'], self.fixtures['max_artwork'])
+
+    def _fill_cart(self):
+        hot = self.fixtures['hot_artworks']
+        artwork_id = self.rng.choice(hot) if hot else self._random_artwork()
+        self.clients['user'].request('POST', f'/add_to_cart/{artwork_id}', {'quantity': 1})
+
+    def prepare(self):
+        if self.signed_in['user']:
+            self._fill_cart()
+
+    def step(self, name):
+        # Returns (status, seconds) for the timed request only; set-up calls
+        # such as refilling the cart before a checkout are not measured.
+        client = self.clients[SCENARIOS[name][1]]
+        data, method = None, 'GET'
+        if name == 'index':
+            path = '/'
+        elif name == 'artwork':
+            path = f'/artwork/{self._random_artwork()}'
+        elif name == 'search':
+            path = '/search?' + urllib.parse.urlencode({'q': self.rng.choice(WORDS)})
+        elif name == 'cart':
+            path = '/cart'
+        elif name == 'checkout':
+            self._fill_cart()
+            method, path = 'POST', '/checkout'
+            data = {'address': 'Bench Street 1', 'payment_mode': 'COD',
+                    'delivery_date': (date.today() + timedelta(days=7)).isoformat()}
+        elif name == 'profile':
+            path = '/profile'
+        elif name == 'analytics':
+            path = '/analytics'
+        else:
+            path = '/admin/manage'
+        start = time.perf_counter()
+        status = client.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        if name == 'checkout':
+            self._fill_cart()
+        return status, elapsed
+
+
+def load_fixtures(vusers):
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('SELECT MIN(artwork_id) AS lo, MAX(artwork_id) AS hi FROM artworks')
+        row = cursor.fetchone()
+        if row['lo'] is None:
+            raise click.ClickException('No artworks; run "flask bench seed" first.')
+        cursor.execute('SELECT artwork_id FROM artworks WHERE available_qty >= %s LIMIT %s',
+                       (HOT_STOCK // 2, HOT_ARTWORKS))
+        hot = [r['artwork_id'] for r in cursor.fetchall()]
+        cursor.execute("SELECT user_id, username FROM users WHERE username LIKE 'bench%%' "
+                       'ORDER BY user_id LIMIT %s', (vusers,))
+        users = cursor.fetchall()
+        if not users:
+            raise click.ClickException('No bench users; run "flask bench seed" first.')
+        cursor.execute('SELECT MIN(admin_id) AS admin_id FROM admins')
+        admin_id = cursor.fetchone()['admin_id']
+        dataset = {}
+        for table in ('artists', 'artworks', 'users', 'orders', 'order_items'):
+            cursor.execute(f'SELECT COUNT(*) AS n FROM {table}')
+            dataset[table] = cursor.fetchone()['n']
+        cursor.close()
+    finally:
+        conn.release()
+    fixtures = {'min_artwork': row['lo'], 'max_artwork': row['hi'], 'hot_artworks': hot}
+    return fixtures, users, admin_id, dataset
+
+
+def run_load(make_client, users, admin_id, fixtures, mix, vusers, duration, warmup, seed_value=1):
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    lock = threading.Lock()
+    ready = threading.Barrier(vusers + 1)
+    state = {}
+
+    def worker(n):
+        rng = random.Random(seed_value * 1000 + n)
+        vuser = None
+        try:
+            vuser = VirtualUser(make_client, users[n % len(users)], admin_id, fixtures, rng)
+            vuser.prepare()
+        finally:
+            ready.wait()
+        names = [name for name in mix if vuser.signed_in[SCENARIOS[name][1]]]
+        if not names:
+            return
+        weights = [mix[name] for name in names]
+        local = {name: [] for name in names}
+        local_errors = dict.fromkeys(names, 0)
+        while True:
+            now = time.perf_counter()
+            if now >= state['end']:
+                break
+            name = rng.choices(names, weights)[0]
+            try:
+                status, elapsed = vuser.step(name)
+            except Exception:
+                status, elapsed = None, time.perf_counter() - now
+            if now < state['measure_from']:
+                continue
+            local[name].append(elapsed)
+            if status not in (200, 304):
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(vusers)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    start = time.perf_counter()
+    state['measure_from'] = start + warmup
+    state['end'] = start + warmup + duration
+    for t in threads:
+        t.join()
+    return samples, errors
+
+
+def summarise(samples, errors, duration, queries_before, queries_after):
+    routes = {}
+    for name, values in samples.items():
+        values.sort()
+        endpoint = SCENARIOS[name][0]
+        before = queries_before.get(endpoint, [0, 0])
+        after = queries_after.get(endpoint, [0, 0])
+        requests_seen = after[1] - before[1]
+        routes[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'throughput': round(len(values) / duration, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 2) if values else None,
+            'p50_ms': _ms(percentile(values, 50)),
+            'p95_ms': _ms(percentile(values, 95)),
+            'p99_ms': _ms(percentile(values, 99)),
+            'max_ms': _ms(values[-1] if values else None),
+            'queries_per_request': (round((after[0] - before[0]) / requests_seen, 2)
+                                    if requests_seen else None),
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return routes, {'requests': total, 'errors': sum(errors.values()),
+                    'throughput': round(total / duration, 2)}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(result):
+    click.echo(f"{'route':<14}{'reqs':>8}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}")
+    for name, r in result['routes'].items():
+        click.echo(f"{name:<14}{r['requests']:>8}{r['errors']:>6}{r['throughput']:>9}"
+                   f"{_fmt(r['p50_ms'])}{_fmt(r['p95_ms'])}{_fmt(r['p99_ms'])}"
+                   f"{_fmt(r['queries_per_request'], 7)}")
+    total = result['total']
+    click.echo(f"{'total':<14}{total['requests']:>8}{total['errors']:>6}{total['throughput']:>9}")
+
+
+def _fmt(value, width=9):
+    return f'{"-" if value is None else value:>{width}}'
+
+
+# -- CLI --------------------------------------------------------------------------
+
+@click.group('bench')
+def bench_cli():
+    """Seed synthetic data, load-test the routes and compare runs."""
+
+
+@bench_cli.command('seed')
+@click.option('--size', type=click.Choice(sorted(SIZES)), default='1k', show_default=True)
+@click.option('--artworks', type=int, help='Override the artwork count of --size.')
+@click.option('--users', type=int, help='Override the user count of --size.')
+@click.option('--orders', type=int, help='Override the order count of --size.')
+@click.option('--batch', default=5000, show_default=True, help='Rows per INSERT batch/transaction.')
+@click.option('--reset', is_flag=True, help='Drop the database and rebuild it with the migrations first.')
+@click.option('--seed', 'seed_value', default=42, show_default=True, help='Random seed.')
+@with_appcontext
+def seed_command(size, artworks, users, orders, batch, reset, seed_value):
+    """Fill the database with a synthetic catalogue, users and order history."""
+    counts = dict(SIZES[size])
+    for key, value in (('artworks', artworks), ('users', users), ('orders', orders)):
+        if value is not None:
+            counts[key] = value
+    if reset:
+        click.confirm(f"Drop and recreate {current_app.config['DB_CONNECT_ARGS']['database']}?",
+                      abort=True)
+        db_pool.get_pool().dispose()
+        migrate.drop_database(current_app.config['DB_CONNECT_ARGS'])
+        conn = migrate.connect(current_app.config['DB_CONNECT_ARGS'], create=True)
+        try:
+            migrate.upgrade(conn)
+        finally:
+            conn.close()
+    start = time.perf_counter()
+    conn = db_pool.get_pool().acquire()
+    try:
+        seed(conn, counts, batch, random.Random(seed_value))
+    finally:
+        conn.release()
+    # Cached rows and pages predate the new data (matters with a shared Redis).
+    catalogue_cache.get_cache().clear()
+    page_cache.get_cache().backend.clear()
+    click.echo(f'Seeded {counts} in {time.perf_counter() - start:.1f}s '
+               f'(bench users log in with password "{BENCH_PASSWORD}")')
+
+
+def run_benchmark(app, vusers=8, duration=30.0, warmup=5.0, mix=None, base_url=None,
+                  admin_username=None, admin_password=None, label='run', seed_value=1, save=True):
+    # Returns (result, saved_path); needs an app context for the fixtures.
+    mix = mix or default_mix()
+    fixtures, users, admin_id, dataset = load_fixtures(vusers)
+
+    if base_url:
+        def make_client():
+            return HttpClient(base_url, admin_username, admin_password)
+        metrics_client = make_client()
+        if not metrics_client.sign_in(admin_id=admin_id):
+            metrics_client = None
+    else:
+        def make_client():
+            return InProcessClient(app)
+        metrics_client = None
+    # In-process counts come from the registry directly; over HTTP they need
+    # an admin session on the server's /metrics.
+    count_queries = app.config['PERF_INSTRUMENTATION'] if not base_url else metrics_client is not None
+
+    click.echo(f"{vusers} users, {warmup:g}s warm-up + {duration:g}s against "
+               f"{base_url or 'the in-process app'} ({dataset['artworks']:,} artworks)")
+    before = query_totals(metrics_client) if count_queries else {}
+    samples, errors = run_load(make_client, users, admin_id, fixtures, mix, vusers,
+                               duration, warmup, seed_value)
+    after = query_totals(metrics_client) if count_queries else {}
+    routes, total = summarise(samples, errors, duration, before, after)
+
+    result = {
+        'label': label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'mode': 'http' if base_url else 'in-process',
+        'base_url': base_url,
+        'users': vusers,
+        'duration': duration,
+        'warmup': warmup,
+        'mix': mix,
+        'dataset': dataset,
+        'config': {key: app.config.get(key) for key in (
+            'DB_POOL_SIZE', 'DB_POOL_MAX_OVERFLOW', 'CATALOGUE_CACHE_ENABLED',
+            'PAGE_CACHE_ENABLED', 'PERF_INSTRUMENTATION')},
+        'routes': routes,
+        'total': total,
+    }
+    path = None
+    if save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{re.sub(r'[^A-Za-z0-9_.-]', '_', label)}.json")
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result, path
+
+
+def default_mix():
+    return {name: weight for name, (_, _, weight) in SCENARIOS.items()}
+
+
+def print_comparison(a, b, fail_over=None):
+    # Returns the routes whose p95 regressed by more than fail_over percent.
+    click.echo(f"baseline  {a['label']} @ {a.get('revision')} {a['started_at']} ({a['mode']})")
+    click.echo(f"candidate {b['label']} @ {b.get('revision')} {b['started_at']} ({b['mode']})")
+    if a['dataset'] != b['dataset']:
+        click.echo('warning: the runs used different datasets', err=True)
+    click.echo(f"{'route':<14}{'metric':<8}{'baseline':>11}{'candidate':>11}{'change':>9}")
+    regressions = []
+    for name in a['routes']:
+        if name not in b['routes']:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries_per_request'):
+            old, new = a['routes'][name][metric], b['routes'][name][metric]
+            change = (new - old) / old * 100 if old and new is not None else None
+            click.echo(f"{name:<14}{metric.replace('_ms', ''):<8}{_fmt(old, 11)}{_fmt(new, 11)}"
+                       f"{_fmt(None if change is None else f'{change:+.1f}%')}")
+            if metric == 'p95_ms' and fail_over is not None and change is not None and change > fail_over:
+                regressions.append(name)
+    old, new = a['total']['throughput'], b['total']['throughput']
+    click.echo(f"{'total':<14}{'req/s':<8}{_fmt(old, 11)}{_fmt(new, 11)}"
+               f"{_fmt(f'{(new - old) / old * 100:+.1f}%' if old else None)}")
+    return regressions
+
+
+@bench_cli.command('run')
+@click.option('--users', 'vusers', default=8, show_default=True, help='Concurrent virtual users.')
+@click.option('--duration', default=30.0, show_default=True, help='Measured seconds.')
+@click.option('--warmup', default=5.0, show_default=True, help='Unmeasured seconds before that.')
+@click.option('--mix', default=','.join(f'{name}={w}' for name, (_, _, w) in SCENARIOS.items()),
+              show_default=True, help='Routes and weights, e.g. "index=5,artwork=5,checkout=1".')
+@click.option('--base-url', help='Drive a running server over HTTP instead of in-process.')
+@click.option('--admin-username', default='admin', show_default=True, help='For --base-url runs.')
+@click.option('--admin-password', envvar='BENCH_ADMIN_PASSWORD', help='For --base-url runs.')
+@click.option('--label', default='run', show_default=True, help='Name stored with the results.')
+@click.option('--seed', 'seed_value', default=1, show_default=True, help='Random seed for the route mix.')
+@click.option('--no-save', is_flag=True, help='Print the report without writing bench_results/.')
+@with_appcontext
+def run_command(vusers, duration, warmup, mix, base_url, admin_username, admin_password,
+                label, seed_value, no_save):
+    """Drive the main routes with concurrent virtual users and report latency."""
+    result, path = run_benchmark(current_app._get_current_object(), vusers, duration, warmup,
+                                 parse_mix(mix), base_url, admin_username, admin_password,
+                                 label, seed_value, save=not no_save)
+    print_report(result)
+    if path:
+        click.echo(f'Saved {path}')
+
+
+@bench_cli.command('compare')
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+@click.option('--fail-over', type=float,
+              help='Exit non-zero if any route p95 regresses by more than this many percent.')
+def compare_command(baseline, candidate, fail_over):
+    """Show per-route latency and throughput deltas between two saved runs."""
+    regressions = print_comparison(json.load(baseline), json.load(candidate), fail_over)
+    if regressions:
+        raise click.ClickException(f'p95 regressed more than {fail_over}% on: {", ".join(regressions)}')
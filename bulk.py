@@ -0,0 +1,426 @@
+"""Bulk catalogue import (CSV/JSONL plus a zip of images) and streaming exports.
+
+    flask catalogue import artworks.csv --images images.zip
+    flask catalogue export artworks --format jsonl -o artworks.jsonl
+    flask catalogue export orders -o orders.csv
+
+The admin pages /admin/import and /admin/export/<what>.<fmt> use the same
+code. Import columns: title, price (required), description, artist (name;
+created if unknown), qty, image (a file name inside the zip).
+"""
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import as_completed
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from mysql.connector import Error
+
+import catalogue_cache
+import db_pool
+import images
+import rollups
+import uploads
+
+BATCH_SIZE = 1000
+FETCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_PRICE = Decimal('100000000')
+
+ORDER_EXPORT_SQL = '''
+    SELECT o.order_id, o.created_at, u.username, o.status, o.total_amount,
+           o.payment_mode, o.delivery_date, oi.artwork_id, a.title,
+           oi.quantity, oi.unit_price
+    FROM {orders} o
+    JOIN users u ON o.user_id = u.user_id
+    JOIN {items} oi ON oi.order_id = o.order_id
+    LEFT JOIN artworks a ON a.artwork_id = oi.artwork_id
+    ORDER BY o.order_id, oi.order_item_id
+'''
+ORDER_EXPORT_COLUMNS = ('order_id', 'created_at', 'username', 'status', 'total_amount', 'payment_mode',
+                        'delivery_date', 'artwork_id', 'title', 'quantity', 'unit_price')
+
+EXPORTS = {
+    'artworks': ('''
+        SELECT a.artwork_id, a.title, a.description, a.price, a.available_qty, a.status,
+               ar.name AS artist, a.image_filename, a.created_at
+        FROM artworks a
+        LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+        ORDER BY a.artwork_id
+    ''', ('artwork_id', 'title', 'description', 'price', 'available_qty', 'status',
+          'artist', 'image_filename', 'created_at')),
+    # One line per order item.
+    'orders': (ORDER_EXPORT_SQL.format(orders='orders', items='order_items'), ORDER_EXPORT_COLUMNS),
+    'archived_orders': (ORDER_EXPORT_SQL.format(orders='orders_archive', items='order_items_archive'),
+                        ORDER_EXPORT_COLUMNS),
+}
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+class RowError(ValueError):
+    pass
+
+
+# -- reading and validating rows -----------------------------------------------------
+
+def detect_format(filename):
+    ext = filename.rsplit('.', 1)[-1].lower()
+    if ext in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if ext == 'csv':
+        return 'csv'
+    raise RowError(f'unsupported file type .{ext} (use .csv or .jsonl)')
+
+
+def read_rows(stream, fmt):
+    # stream is a text stream; yields (line number, dict or RowError).
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f'invalid JSON: {e}')
+
+
+def clean_row(raw):
+    if isinstance(raw, RowError):
+        raise raw
+    if not isinstance(raw, dict):
+        raise RowError('expected an object per line')
+
+    title = str(raw.get('title') or '').strip()
+    if not title:
+        raise RowError('title is required')
+    if len(title) > 200:
+        raise RowError('title is longer than 200 characters')
+
+    try:
+        price = Decimal(str(raw.get('price', '')).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"price {raw.get('price')!r} is not a number")
+    if not 0 <= price < MAX_PRICE:
+        raise RowError('price is out of range')
+
+    qty = raw.get('qty', raw.get('available_qty'))
+    try:
+        qty = 1 if qty in (None, '') else int(qty)
+    except (TypeError, ValueError):
+        raise RowError(f'qty {qty!r} is not a whole number')
+    if qty < 0:
+        raise RowError('qty cannot be negative')
+
+    artist = str(raw.get('artist') or '').strip() or None
+    if artist and len(artist) > 150:
+        raise RowError('artist name is longer than 150 characters')
+
+    image = str(raw.get('image') or '').strip() or None
+    if image and image.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS:
+        raise RowError(f'image {image!r} is not a png/jpg/gif')
+
+    return {
+        'title': title,
+        'description': str(raw.get('description') or '').strip() or None,
+        'price': price,
+        'qty': qty,
+        'artist': artist,
+        'image': image,
+        'filename': None,
+    }
+
+
+class ImageArchive:
+    # Image lookup by file name (with or without folders) inside a zip.
+
+    def __init__(self, file):
+        self.zip = zipfile.ZipFile(file)
+        self.members = {}
+        for info in self.zip.infolist():
+            if not info.is_dir():
+                self.members.setdefault(info.filename, info)
+                self.members.setdefault(os.path.basename(info.filename), info)
+
+    def read(self, name):
+        info = self.members.get(name)
+        if info is None:
+            raise RowError(f'image {name!r} is not in the archive')
+        return self.zip.read(info)
+
+
+# -- import ---------------------------------------------------------------------------
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.artists_created = 0
+        self.images = 0
+        self.errors = []
+        self.futures = []
+        self.started = time.perf_counter()
+
+    def reject(self, line_no, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_no, str(error)))
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.imported / elapsed if elapsed else 0
+        return (f'{self.rows} rows read, {self.imported} imported, {self.rejected} rejected, '
+                f'{self.artists_created} new artists, {self.images} images queued '
+                f'({elapsed:.1f}s, {rate:.0f} rows/s)')
+
+
+def resolve_artists(cursor, names, known):
+    # Fills known[casefolded name] -> artist_id for a batch, inserting the
+    # artists that do not exist yet. Returns how many were created.
+    # artists.name compares case-insensitively, so keys are casefolded.
+    def lookup(wanted):
+        format_names = ','.join(['%s'] * len(wanted))
+        cursor.execute(f'''
+            SELECT name, MIN(artist_id) FROM artists
+            WHERE name IN ({format_names}) GROUP BY name
+        ''', tuple(wanted))
+        for name, artist_id in cursor.fetchall():
+            known.setdefault(name.casefold(), artist_id)
+
+    wanted = {}
+    for name in names:
+        wanted.setdefault(name.casefold(), name)
+    lookup(list(wanted.values()))
+    missing = [name for key, name in wanted.items() if key not in known]
+    if missing:
+        cursor.executemany('INSERT INTO artists (name) VALUES (%s)', [(name,) for name in missing])
+        lookup(missing)
+    return len(missing)
+
+
+def _insert_batch(conn, batch, artist_ids, report):
+    cursor = conn.cursor()
+    try:
+        names = {row['artist'] for row in batch
+                 if row['artist'] and row['artist'].casefold() not in artist_ids}
+        if names:
+            report.artists_created += resolve_artists(cursor, names, artist_ids)
+        cursor.executemany('''
+            INSERT INTO artworks
+                (title, description, price, image_filename, artist_id, available_qty, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', [(row['title'], row['description'], row['price'], row['filename'],
+               artist_ids[row['artist'].casefold()] if row['artist'] else None,
+               row['qty'], 'Available' if row['qty'] > 0 else 'Sold') for row in batch])
+        rollups.on_artworks_imported(cursor, [row['price'] for row in batch])
+
+        # A multi-row INSERT does not report every new id, so the artworks
+        # that need image variants are found again by their file.
+        filenames = sorted({row['filename'] for row in batch if row['filename']})
+        by_file = {}
+        if filenames:
+            format_names = ','.join(['%s'] * len(filenames))
+            cursor.execute(f'''
+                SELECT artwork_id, image_filename FROM artworks
+                WHERE image_filename IN ({format_names}) AND image_variants IS NULL
+            ''', tuple(filenames))
+            for artwork_id, filename in cursor.fetchall():
+                by_file.setdefault(filename, []).append(artwork_id)
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    report.imported += len(batch)
+    for filename, artwork_ids in by_file.items():
+        report.futures.append(images.submit_shared(artwork_ids, filename))
+        report.images += 1
+    catalogue_cache.get_cache().invalidate_listings()
+
+
+def import_artworks(conn, rows, archive=None, upload_folder=None, batch_size=BATCH_SIZE):
+    # Generator: validates and inserts `rows` (from read_rows) in batches of
+    # one multi-row INSERT + commit each, yielding the running ImportReport
+    # after every batch. Invalid rows are skipped and reported.
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    report = ImportReport()
+    artist_ids = {}
+    batch = []
+    for line_no, raw in rows:
+        report.rows += 1
+        try:
+            row = clean_row(raw)
+            if row['image']:
+                if archive is None:
+                    raise RowError('row names an image but no image archive was given')
+                ext = row['image'].rsplit('.', 1)[-1].lower()
+                row['filename'] = uploads.store_bytes(
+                    archive.read(row['image']), 'jpg' if ext == 'jpeg' else ext, upload_folder)
+        except RowError as e:
+            report.reject(line_no, e)
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _insert_batch(conn, batch, artist_ids, report)
+            batch = []
+            yield report
+    if batch:
+        _insert_batch(conn, batch, artist_ids, report)
+    yield report
+
+
+def stream_import(data_file, images_file=None):
+    # Progress lines for /admin/import, streamed while the import runs.
+    try:
+        fmt = detect_format(data_file.filename)
+        archive = ImageArchive(images_file.stream) if images_file else None
+    except (RowError, zipfile.BadZipFile) as e:
+        yield f'Import failed: {e}\n'
+        return
+    text = io.TextIOWrapper(data_file.stream, encoding='utf-8-sig', newline='')
+    conn = db_pool.get_pool().acquire()
+    try:
+        report = None
+        for report in import_artworks(conn, read_rows(text, fmt), archive):
+            yield report.summary() + '\n'
+        for line_no, message in report.errors:
+            yield f'line {line_no}: {message}\n'
+        if report.rejected > len(report.errors):
+            yield f'... and {report.rejected - len(report.errors)} more rejected rows\n'
+        yield 'Done. Image variants are being built in the background.\n'
+    except Error as e:
+        yield f'Import stopped by a database error: {e}\n'
+    finally:
+        conn.release()
+
+
+# -- export ---------------------------------------------------------------------------
+
+def stream_rows(sql, params=()):
+    # Rows come off an unbuffered cursor FETCH_SIZE at a time on a dedicated
+    # connection, so memory stays flat however large the result is.
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, params or ())
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+        cursor.close()
+    finally:
+        # An export abandoned half way leaves unread rows; release() then
+        # drops the connection rather than pooling it.
+        conn.release()
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export_rows(what):
+    return stream_rows(EXPORTS[what][0])
+
+
+def export(what, fmt):
+    return write_chunks(export_rows(what), EXPORTS[what][1], fmt)
+
+
+def write_chunks(rows, columns, fmt, chunk_rows=500):
+    # Generator of text chunks (CSV with a header row, or JSON lines).
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        if writer:
+            writer.writerow([_plain(row[c]) for c in columns])
+        else:
+            buffer.write(json.dumps({c: _plain(row[c]) for c in columns}, ensure_ascii=False) + '\n')
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+# -- CLI ------------------------------------------------------------------------------
+
+@click.group('catalogue')
+def bulk_cli():
+    """Bulk import and export of the catalogue."""
+
+
+@bulk_cli.command('import')
+@click.argument('data', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', 'images_zip', type=click.Path(exists=True, dir_okay=False),
+              help='Zip archive holding the files named in the image column.')
+@click.option('--batch', default=BATCH_SIZE, show_default=True, help='Rows per INSERT/transaction.')
+@click.option('--image-workers', type=int, help='Threads building image variants (default IMAGE_WORKERS).')
+@with_appcontext
+def import_command(data, images_zip, batch, image_workers):
+    """Import artworks from a CSV or JSONL file."""
+    try:
+        fmt = detect_format(data)
+    except RowError as e:
+        raise click.BadParameter(str(e), param_hint='DATA')
+    if image_workers:
+        images.set_workers(image_workers)
+    archive = ImageArchive(images_zip) if images_zip else None
+    conn = db_pool.get_pool().acquire()
+    try:
+        with open(data, encoding='utf-8-sig', newline='') as f:
+            for report in import_artworks(conn, read_rows(f, fmt), archive, batch_size=batch):
+                click.echo(f'\r{report.summary()}', nl=False)
+    finally:
+        conn.release()
+    click.echo()
+    for line_no, message in report.errors:
+        click.echo(f'line {line_no}: {message}', err=True)
+
+    failed = 0
+    with click.progressbar(as_completed(report.futures), length=len(report.futures),
+                           label='Building image variants') as futures:
+        for future in futures:
+            if future.exception() is not None:
+                failed += 1
+    click.echo(f'{report.images - failed} images processed, {failed} failed.')
+
+
+@bulk_cli.command('export')
+@click.argument('what', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Defaults to stdout.')
+@with_appcontext
+def export_command(what, fmt, output):
+    """Stream the catalogue or the order history to CSV/JSONL."""
+    out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        for chunk in export(what, fmt):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
@@ -0,0 +1,140 @@
+"""Server-side shopping carts.
+
+The signed session cookie only carries ``cart_id``; the lines live in the
+``carts``/``cart_items`` tables. A signed-in user's cart is bound to their
+account, so it follows them across devices and is merged with whatever they
+put in the cart before logging in.
+"""
+import uuid
+
+from flask import current_app, session
+
+import jobs
+
+
+def current_cart_id(cursor, create=False):
+    cart_id = session.get('cart_id')
+    if cart_id is not None:
+        # The row may be gone (purged as stale, or merged away at login);
+        # writing to it would fail the cart_items foreign key.
+        cursor.execute('SELECT 1 FROM carts WHERE cart_id = %s', (cart_id,))
+        if cursor.fetchone() is None:
+            session.pop('cart_id', None)
+            cart_id = None
+    if cart_id is None and session.get('user_id'):
+        # carts.user_id is unique: a signed-in user gets their own row back.
+        cursor.execute('SELECT cart_id FROM carts WHERE user_id = %s', (session['user_id'],))
+        row = cursor.fetchone()
+        if row is not None:
+            cart_id = row['cart_id']
+            session['cart_id'] = cart_id
+    # Carts from before this change were a dict inside the cookie itself.
+    legacy = session.get('cart') or {}
+    if cart_id is None and (create or legacy):
+        cart_id = uuid.uuid4().hex
+        cursor.execute('INSERT INTO carts (cart_id, user_id) VALUES (%s, %s)',
+                       (cart_id, session.get('user_id')))
+        session['cart_id'] = cart_id
+    for artwork_id, qty in legacy.items():
+        # Lines for artworks deleted since are skipped by add_item.
+        if int(qty) >= 1:
+            add_item(cursor, cart_id, artwork_id, int(qty))
+    if 'cart' in session:
+        # Migrated once; dropped so the lines are never added again.
+        session.pop('cart')
+    return cart_id
+
+
+def get_items(cursor, cart_id):
+    # {artwork_id (str): quantity}, the shape checkout/place_order expect.
+    if cart_id is None:
+        return {}
+    cursor.execute('SELECT artwork_id, quantity FROM cart_items WHERE cart_id = %s', (cart_id,))
+    return {str(row['artwork_id']): row['quantity'] for row in cursor.fetchall()}
+
+
+# Lines are inserted from the artworks row, so an id that does not exist
+# (or was deleted) inserts nothing instead of failing the foreign key.
+# add_item/set_item return False in that case.
+
+def add_item(cursor, cart_id, artwork_id, qty):
+    if qty < 1:
+        raise ValueError(f'quantity must be at least 1, got {qty}')
+    cursor.execute('''
+        INSERT INTO cart_items (cart_id, artwork_id, quantity)
+        SELECT %s, artwork_id, %s FROM artworks WHERE artwork_id = %s
+        ON DUPLICATE KEY UPDATE quantity = cart_items.quantity + VALUES(quantity)
+    ''', (cart_id, qty, artwork_id))
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute('UPDATE carts SET updated_at = NOW() WHERE cart_id = %s', (cart_id,))
+    return True
+
+
+def set_item(cursor, cart_id, artwork_id, qty):
+    if qty <= 0:
+        cursor.execute('DELETE FROM cart_items WHERE cart_id = %s AND artwork_id = %s',
+                       (cart_id, artwork_id))
+    else:
+        cursor.execute('''
+            INSERT INTO cart_items (cart_id, artwork_id, quantity)
+            SELECT %s, artwork_id, %s FROM artworks WHERE artwork_id = %s
+            ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)
+        ''', (cart_id, qty, artwork_id))
+        if cursor.rowcount == 0:
+            cursor.execute('SELECT 1 FROM artworks WHERE artwork_id = %s', (artwork_id,))
+            if cursor.fetchone() is None:
+                return False
+    cursor.execute('UPDATE carts SET updated_at = NOW() WHERE cart_id = %s', (cart_id,))
+    return True
+
+
+def clear(cursor, cart_id):
+    cursor.execute('DELETE FROM cart_items WHERE cart_id = %s', (cart_id,))
+
+
+def merge_on_login(cursor, user_id):
+    # Call right after session['user_id'] is set. The anonymous cart is
+    # folded into the account's cart (quantities add up) or, if the account
+    # has none yet, simply claimed by it.
+    anon_cart = current_cart_id(cursor)
+    cursor.execute('SELECT cart_id FROM carts WHERE user_id = %s', (user_id,))
+    row = cursor.fetchone()
+    user_cart = row['cart_id'] if row else None
+
+    if user_cart is None and anon_cart is not None:
+        cursor.execute('UPDATE carts SET user_id = %s WHERE cart_id = %s', (user_id, anon_cart))
+        user_cart = anon_cart
+    elif user_cart is not None and anon_cart not in (None, user_cart):
+        cursor.execute('''
+            INSERT INTO cart_items (cart_id, artwork_id, quantity)
+            SELECT %s, artwork_id, quantity FROM cart_items WHERE cart_id = %s
+            ON DUPLICATE KEY UPDATE quantity = cart_items.quantity + VALUES(quantity)
+        ''', (user_cart, anon_cart))
+        cursor.execute('DELETE FROM carts WHERE cart_id = %s AND user_id IS NULL', (anon_cart,))
+
+    if user_cart is not None:
+        session['cart_id'] = user_cart
+
+
+def forget():
+    # On logout: the account's cart stays in the database for next time.
+    session.pop('cart_id', None)
+    session.pop('cart', None)
+
+
+@jobs.job('carts.purge_stale')
+def purge_stale(conn, payload):
+    # Anonymous carts nobody has touched for CART_TTL_DAYS; a signed-in
+    # user's cart is kept. cart_items go with them (ON DELETE CASCADE).
+    cursor = conn.cursor()
+    while True:
+        cursor.execute('''
+            DELETE FROM carts
+            WHERE user_id IS NULL AND updated_at < NOW() - INTERVAL %s DAY
+            LIMIT 1000
+        ''', (current_app.config['CART_TTL_DAYS'],))
+        conn.commit()
+        if cursor.rowcount < 1000:
+            break
+    cursor.close()
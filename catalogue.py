@@ -0,0 +1,64 @@
+"""Artwork catalogue queries shared by the gallery and admin listings."""
+from pagination import encode_cursor, keyset_after
+
+# Only what a gallery card renders: the description is cut down in SQL so the
+# TEXT column never crosses the wire in full for a listing page.
+CARD_COLUMNS = '''
+    a.artwork_id, a.title, LEFT(a.description, 160) AS description, a.price,
+    a.image_filename, a.image_variants, a.available_qty, a.created_at,
+    a.updated_at, ar.name AS artist_name
+'''
+
+ADMIN_COLUMNS = '''
+    a.artwork_id, a.title, a.price, a.image_filename, a.image_variants,
+    a.available_qty, a.created_at, a.updated_at, ar.name AS artist_name
+'''
+
+
+def artwork_page_query(after=None, limit=24, columns=CARD_COLUMNS):
+    # Newest first, keyset on (created_at, artwork_id) backed by
+    # idx_artworks_created_id. One extra row tells us whether a next page exists.
+    where, params = keyset_after('a.created_at', 'a.artwork_id', after)
+    sql = f'''
+        SELECT {columns}
+        FROM artworks a
+        LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+        {'WHERE ' + where if where else ''}
+        ORDER BY a.created_at DESC, a.artwork_id DESC
+        LIMIT %s
+    '''
+    return sql, params + (limit + 1,)
+
+
+def artwork_page_result(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['created_at'], last['artwork_id'])
+    return rows, next_cursor
+
+
+def fetch_artwork_page(cursor, after=None, limit=24, columns=CARD_COLUMNS):
+    cursor.execute(*artwork_page_query(after, limit, columns))
+    return artwork_page_result(cursor.fetchall(), limit)
+
+
+DETAIL_SQL = '''
+    SELECT a.*, ar.name AS artist_name
+    FROM artworks a
+    LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+'''
+
+
+def fetch_artwork(cursor, artwork_id):
+    cursor.execute(DETAIL_SQL + ' WHERE a.artwork_id = %s', (artwork_id,))
+    return cursor.fetchone()
+
+
+def fetch_artworks_by_id(cursor, artwork_ids):
+    if not artwork_ids:
+        return {}
+    format_ids = ','.join(['%s'] * len(artwork_ids))
+    cursor.execute(DETAIL_SQL + f' WHERE a.artwork_id IN ({format_ids})', tuple(artwork_ids))
+    return {row['artwork_id']: row for row in cursor.fetchall()}
@@ -0,0 +1,249 @@
+"""Read-through cache for artwork rows and listing pages.
+
+Rows are cached by (artwork id, generation) and listing pages by
+(generation, variant, cursor, size). A write bumps the artwork's and the
+listing generation, so old entries simply stop being addressed and age out
+of the LRU. The generation is read before loading, so a reader that loaded
+a row before the write stores it under the dead key.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional backend
+    redis = None
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    # Any Redis-protocol server on the local box (redis, valkey, keydb ...).
+
+    def __init__(self, url, prefix='artvault:'):
+        if redis is None:
+            raise RuntimeError('CATALOGUE_CACHE_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+        return True, pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def size(self):
+        return None
+
+
+class CatalogueCache:
+    def __init__(self, backend, ttl=300, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        found, value = self.backend.get(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found, value
+
+    def _artwork_key(self, artwork_id):
+        return f'artwork:{artwork_id}:{self.generation(f"artwork:{artwork_id}")}'
+
+    # -- readers -----------------------------------------------------------
+
+    def get_artwork(self, artwork_id, loader):
+        if not self.enabled:
+            return loader(artwork_id)
+        key = self._artwork_key(artwork_id)
+        found, row = self._lookup(key)
+        if not found:
+            row = loader(artwork_id)
+            if row is not None:
+                self.backend.set(key, row, self.ttl)
+        return row
+
+    def get_artworks(self, artwork_ids, loader):
+        # loader(ids) -> {artwork_id: row}; only the misses go to MySQL.
+        ids = [int(i) for i in artwork_ids]
+        if not self.enabled:
+            return loader(ids)
+        rows, missing = {}, {}
+        for artwork_id in ids:
+            key = self._artwork_key(artwork_id)
+            found, row = self._lookup(key)
+            if found:
+                rows[artwork_id] = row
+            else:
+                missing[artwork_id] = key
+        if missing:
+            for artwork_id, row in loader(list(missing)).items():
+                self.backend.set(missing[artwork_id], row, self.ttl)
+                rows[artwork_id] = row
+        return rows
+
+    def get_listing(self, variant, cursor_token, size, loader):
+        if not self.enabled:
+            return loader()
+        generation = self.generation('listing')
+        key = f'listing:{generation}:{variant}:{cursor_token or ""}:{size}'
+        found, page = self._lookup(key)
+        if not found:
+            page = loader()
+            self.backend.set(key, page, self.ttl)
+        return page
+
+    # -- asyncio twins of the readers above (asgi.py); loaders are coroutines --
+
+    async def aget_artwork(self, artwork_id, loader):
+        if not self.enabled:
+            return await loader(artwork_id)
+        key = self._artwork_key(artwork_id)
+        found, row = self._lookup(key)
+        if not found:
+            row = await loader(artwork_id)
+            if row is not None:
+                self.backend.set(key, row, self.ttl)
+        return row
+
+    async def aget_listing(self, variant, cursor_token, size, loader):
+        if not self.enabled:
+            return await loader()
+        key = f'listing:{self.generation("listing")}:{variant}:{cursor_token or ""}:{size}'
+        found, page = self._lookup(key)
+        if not found:
+            page = await loader()
+            self.backend.set(key, page, self.ttl)
+        return page
+
+    # -- invalidation hooks (called from the write routes) -------------------
+
+    def invalidate_artworks(self, artwork_ids):
+        ids = [int(i) for i in artwork_ids]
+        self.backend.delete(*(self._artwork_key(i) for i in ids))
+        for artwork_id in ids:
+            self.backend.incr(f'gen:artwork:{artwork_id}')
+        self.invalidate_listings()
+
+    def generation(self, scope):
+        # Bumped on every invalidation of that scope ('listing' or
+        # 'artwork:<id>'); anything keyed by it goes stale at once.
+        return self.backend.counter(f'gen:{scope}')
+
+    def invalidate_listings(self):
+        self.backend.incr('gen:listing')
+        self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+        self.invalidate_listings()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'backend': type(self.backend).__name__,
+            'entries': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.backend.evictions,
+            'expirations': self.backend.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+_cache = None
+
+
+def init_app(app):
+    global _cache
+    if app.config['CATALOGUE_CACHE_URL']:
+        backend = RedisBackend(app.config['CATALOGUE_CACHE_URL'])
+    else:
+        backend = MemoryBackend(app.config['CATALOGUE_CACHE_SIZE'])
+    _cache = CatalogueCache(backend,
+                            ttl=app.config['CATALOGUE_CACHE_TTL'],
+                            enabled=app.config['CATALOGUE_CACHE_ENABLED'])
+
+
+def get_cache():
+    return _cache
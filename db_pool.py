@@ -0,0 +1,250 @@
+"""Small MySQL connection pool used behind get_db_connection()."""
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import Error
+from flask import g, has_app_context
+
+
+class PoolTimeout(Error):
+    pass
+
+
+class PooledConnection:
+    # Thin proxy around a mysql.connector connection. close() hands the
+    # connection back to the pool instead of tearing down the socket, so the
+    # existing "conn.close()" calls in the routes keep working unchanged.
+
+    def __init__(self, pool, raw, overflow=False):
+        self._pool = pool
+        self._raw = raw
+        self.overflow = overflow
+        self.scoped = False
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        if _cursor_wrapper is not None:
+            cursor = _cursor_wrapper(cursor)
+        return cursor
+
+    def close(self):
+        # Request scoped connections are returned on teardown.
+        if self.scoped:
+            return
+        self.release()
+
+    def release(self):
+        if self._raw is not None:
+            self._pool.release(self)
+
+
+class ConnectionPool:
+    def __init__(self, connect_args, size=5, max_overflow=5, timeout=10.0,
+                 recycle=1800, pre_ping=True):
+        self.connect_args = dict(connect_args)
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._open = 0
+
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.connect_time = 0.0
+        self.recycled = 0
+        self.ping_failures = 0
+        self.checkouts = 0
+
+    # -- connection lifecycle ---------------------------------------------
+
+    def _connect(self, overflow=False):
+        start = time.perf_counter()
+        raw = mysql.connector.connect(**self.connect_args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.connects += 1
+            self.connect_time += elapsed
+        return PooledConnection(self, raw, overflow=overflow)
+
+    def _discard(self, conn):
+        raw, conn._raw = conn._raw, None
+        try:
+            raw.close()
+        except Error:
+            pass
+
+    def _is_stale(self, conn):
+        if self.recycle and time.monotonic() - conn.last_used > self.recycle:
+            self.recycled += 1
+            return True
+        if self.pre_ping:
+            try:
+                conn.raw.ping(reconnect=False)
+            except Error:
+                self.ping_failures += 1
+                return True
+        return False
+
+    def acquire(self):
+        deadline = None
+        with self._available:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    conn = None
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.timeout
+                    self.waits += 1
+                    wait_start = time.monotonic()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += time.monotonic() - wait_start
+                    raise PoolTimeout(msg='Timed out waiting for a database connection')
+                self._available.wait(remaining)
+            if deadline is not None:
+                self.wait_time += time.monotonic() - wait_start
+            self.in_use += 1
+            self.checkouts += 1
+
+        try:
+            if conn is not None and self._is_stale(conn):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect(overflow=self._open > self.size)
+        except Exception:
+            with self._available:
+                self.in_use -= 1
+                self._open -= 1
+                self._available.notify()
+            raise
+        conn.scoped = False
+        return conn
+
+    def release(self, conn):
+        keep = conn.raw is not None
+        if keep:
+            try:
+                # Never hand the next borrower someone else's open transaction.
+                if conn.raw.in_transaction:
+                    conn.raw.rollback()
+            except Error:
+                keep = False
+        with self._available:
+            self.in_use -= 1
+            if keep and len(self._idle) < self.size:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                conn = None
+            else:
+                self._open -= 1
+            self._available.notify()
+        if conn is not None and conn.raw is not None:
+            self._discard(conn)
+
+    def dispose(self):
+        with self._available:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'connect_time': round(self.connect_time, 6),
+                'recycled': self.recycled,
+                'ping_failures': self.ping_failures,
+            }
+
+
+_pool = None
+_cursor_wrapper = None
+
+
+def set_cursor_wrapper(wrapper):
+    # Used by instrumentation to time every statement; None means plain cursors.
+    global _cursor_wrapper
+    _cursor_wrapper = wrapper
+
+
+def init_app(app):
+    global _pool
+    _pool = ConnectionPool(
+        app.config['DB_CONNECT_ARGS'],
+        size=app.config['DB_POOL_SIZE'],
+        max_overflow=app.config['DB_POOL_MAX_OVERFLOW'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        recycle=app.config['DB_POOL_RECYCLE'],
+        pre_ping=app.config['DB_POOL_PRE_PING'],
+    )
+    app.teardown_appcontext(release_scoped_connection)
+
+
+def get_pool():
+    return _pool
+
+
+def reset_after_fork():
+    # A forked server worker must not share sockets or locks with its parent:
+    # drop whatever was inherited (without closing it, the parent still owns
+    # those sockets) and start from an empty pool with the same settings.
+    global _pool
+    old = _pool
+    _pool = ConnectionPool(old.connect_args, size=old.size, max_overflow=old.max_overflow,
+                           timeout=old.timeout, recycle=old.recycle, pre_ping=old.pre_ping)
+
+
+def get_connection():
+    # Inside a request/app context every caller shares one checked-out
+    # connection which goes back to the pool on teardown.
+    if not has_app_context():
+        return _pool.acquire()
+    conn = g.get('_db_conn')
+    if conn is None or conn.raw is None:
+        conn = _pool.acquire()
+        conn.scoped = True
+        g._db_conn = conn
+    return conn
+
+
+def release_scoped_connection(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.scoped = False
+        conn.release()
@@ -0,0 +1,296 @@
+"""Faceted gallery browsing: filters, sort orders and per-value counts.
+
+The gallery (/) accepts repeatable ``artist``, ``price`` (bucket number),
+``year`` and ``availability`` parameters plus ``sort`` (newest, price_asc,
+price_desc). Results come from one keyset query on indexed columns.
+
+The counts next to every facet value come from an in-memory FacetIndex:
+one bitmap (a Python int, bit i = i-th artwork by id) per facet value, so a
+count under any combination of filters is an AND plus a popcount, a few
+microseconds each. Counts are disjunctive: a facet's own selection does not
+narrow its own counts, so other values stay clickable. The index is
+rebuilt in a background thread when the catalogue listing generation moves
+(every artwork write bumps it), at most every FACET_REFRESH_SECONDS.
+"""
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from flask import request, url_for
+
+import catalogue_cache
+import db_pool
+from catalogue import CARD_COLUMNS
+from pagination import decode_cursor, decode_sort_cursor, encode_cursor, keyset_after
+from rollups import PRICE_BUCKETS, price_bucket
+
+log = logging.getLogger('artvault.facets')
+
+FACETS = ('availability', 'price', 'year', 'artist')
+FACET_LABELS = {'availability': 'Availability', 'price': 'Price', 'year': 'Added', 'artist': 'Artist'}
+AVAILABILITY = {'available': ('Available', 'a.available_qty > 0'), 'sold': ('Sold out', 'a.available_qty <= 0')}
+# Same boundaries as rollups.price_bucket(), one SQL range per bucket.
+PRICE_RANGES = ('a.price < 1000', 'a.price BETWEEN 1000 AND 5000',
+                'a.price > 5000 AND a.price <= 10000', 'a.price > 10000')
+SORTS = {
+    'newest': ('a.created_at', 'datetime', True),
+    'price_asc': ('a.price', 'decimal', False),
+    'price_desc': ('a.price', 'decimal', True),
+}
+BUCKET_NUMBER = {bucket: i for i, bucket in enumerate(PRICE_BUCKETS)}
+ARTIST_BITMAP_CACHE = 256
+
+_index = None
+_building = threading.Lock()
+_config = {'refresh_seconds': 30, 'max_age': 600, 'artist_limit': 12}
+
+
+def init_app(app):
+    _config.update(refresh_seconds=app.config['FACET_REFRESH_SECONDS'],
+                   max_age=app.config['FACET_MAX_AGE'],
+                   artist_limit=app.config['FACET_ARTIST_LIMIT'])
+
+
+# -- the bitmap index --------------------------------------------------------------
+
+def _to_bitmap(positions, size):
+    bits = bytearray((size >> 3) + 1)
+    for p in positions:
+        bits[p >> 3] |= 1 << (p & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex:
+    def __init__(self, rows, artist_names, generation):
+        # rows: (artwork_id, artist_id, price, available, year) ordered by id.
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.ids = array('i')
+        positions = {facet: {} for facet in FACETS}
+        for p, (artwork_id, artist_id, price, available, year) in enumerate(rows):
+            self.ids.append(artwork_id)
+            for facet, value in (('availability', 'available' if available else 'sold'),
+                                 ('price', BUCKET_NUMBER[price_bucket(price)]),
+                                 ('year', year),
+                                 ('artist', artist_id)):
+                if value is not None:
+                    positions[facet].setdefault(value, array('i')).append(p)
+        self.size = len(self.ids)
+        self.all = (1 << self.size) - 1
+        # Artists are too many to keep a full-width bitmap each; their
+        # positions are kept and turned into bitmaps when asked for.
+        self.artist_positions = positions.pop('artist')
+        self.artist_names = artist_names
+        self.top_artists = sorted(self.artist_positions,
+                                  key=lambda a: len(self.artist_positions[a]), reverse=True)
+        self.bitmaps = {facet: {value: _to_bitmap(ps, self.size) for value, ps in values.items()}
+                        for facet, values in positions.items()}
+        self._artist_bitmaps = {}
+
+    def bitmap(self, facet, value):
+        if facet != 'artist':
+            return self.bitmaps[facet].get(value, 0)
+        cached = self._artist_bitmaps.get(value)
+        if cached is None:
+            if len(self._artist_bitmaps) >= ARTIST_BITMAP_CACHE:
+                self._artist_bitmaps.clear()
+            cached = _to_bitmap(self.artist_positions.get(value, ()), self.size)
+            self._artist_bitmaps[value] = cached
+        return cached
+
+    def mask(self, facet, values):
+        if not values:
+            return self.all
+        mask = 0
+        for value in values:
+            mask |= self.bitmap(facet, value)
+        return mask
+
+    def values(self, facet, selected):
+        if facet == 'availability':
+            return list(AVAILABILITY)
+        if facet == 'price':
+            return list(range(len(PRICE_BUCKETS)))
+        if facet == 'year':
+            return sorted(self.bitmaps['year'], reverse=True)
+        shown = self.top_artists[:_config['artist_limit']]
+        return shown + [a for a in selected if a not in shown]
+
+    def counts(self, selection):
+        # -> ({facet: [(value, count)]}, number of matching artworks)
+        masks = {facet: self.mask(facet, selection.get(facet)) for facet in FACETS}
+        counts = {}
+        for facet in FACETS:
+            others = self.all
+            for other in FACETS:
+                if other != facet and selection.get(other):
+                    others &= masks[other]
+            counts[facet] = [(value, (others & self.bitmap(facet, value)).bit_count())
+                             for value in self.values(facet, selection.get(facet, ()))]
+        matching = self.all
+        for mask in masks.values():
+            matching &= mask
+        return counts, matching.bit_count()
+
+
+def build_index(generation):
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT artist_id, name FROM artists')
+        artist_names = dict(cursor.fetchall())
+        cursor.close()
+        cursor = conn.cursor(buffered=False)
+        cursor.execute('''
+            SELECT artwork_id, artist_id, price, available_qty > 0, YEAR(created_at)
+            FROM artworks ORDER BY artwork_id
+        ''')
+        index = FacetIndex(cursor, artist_names, generation)
+        cursor.close()
+    finally:
+        conn.release()
+    return index
+
+
+def _rebuild(generation):
+    global _index
+    try:
+        start = time.perf_counter()
+        _index = build_index(generation)
+        log.info('facet index of %d artworks built in %.2fs', _index.size, time.perf_counter() - start)
+    except Exception:
+        log.exception('facet index rebuild failed')
+    finally:
+        _building.release()
+
+
+def get_index(wait=True):
+    # The current index; a stale one is still returned while its
+    # replacement builds. wait=False never blocks (None until the first
+    # build is done).
+    global _index
+    generation = catalogue_cache.get_cache().generation('listing')
+    index = _index
+    if index is None:
+        if not wait:
+            if _building.acquire(blocking=False):
+                threading.Thread(target=_rebuild, args=(generation,), daemon=True, name='facets').start()
+            return None
+        with _building:
+            if _index is None:
+                _index = build_index(generation)
+        return _index
+    age = time.monotonic() - index.built_at
+    stale = (index.generation != generation and age >= _config['refresh_seconds']) \
+        or age >= _config['max_age']
+    if stale and _building.acquire(blocking=False):
+        threading.Thread(target=_rebuild, args=(generation,), daemon=True, name='facets').start()
+    return index
+
+
+# -- request side -------------------------------------------------------------------
+
+def parse_selection(args):
+    selection = {}
+    for value in args.getlist('availability'):
+        if value in AVAILABILITY:
+            selection.setdefault('availability', []).append(value)
+    for facet, valid in (('price', lambda v: 0 <= v < len(PRICE_BUCKETS)),
+                         ('year', lambda v: 1900 < v < 3000),
+                         ('artist', lambda v: v > 0)):
+        for value in args.getlist(facet):
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+            if valid(value) and value not in selection.get(facet, ()):
+                selection.setdefault(facet, []).append(value)
+    return selection
+
+
+def parse_sort(args):
+    sort = args.get('sort')
+    return sort if sort in SORTS else 'newest'
+
+
+def filter_sql(selection):
+    clauses, params = [], []
+    if selection.get('availability'):
+        clauses.append('(' + ' OR '.join(AVAILABILITY[v][1] for v in selection['availability']) + ')')
+    if selection.get('price'):
+        clauses.append('(' + ' OR '.join(f'({PRICE_RANGES[v]})' for v in selection['price']) + ')')
+    if selection.get('year'):
+        clauses.append('(' + ' OR '.join(['(a.created_at >= %s AND a.created_at < %s)'] * len(selection['year'])) + ')')
+        for year in selection['year']:
+            params += [datetime(year, 1, 1), datetime(year + 1, 1, 1)]
+    if selection.get('artist'):
+        clauses.append(f"a.artist_id IN ({','.join(['%s'] * len(selection['artist']))})")
+        params += selection['artist']
+    return clauses, params
+
+
+def browse_query(selection, sort, after_token, size):
+    column, kind, descending = SORTS[sort]
+    after = decode_cursor(after_token) if kind == 'datetime' else decode_sort_cursor(after_token, kind)
+    clauses, params = filter_sql(selection)
+    seek, seek_params = keyset_after(column, 'a.artwork_id', after, descending)
+    if seek:
+        clauses.append(seek)
+        params += list(seek_params)
+    order = 'DESC' if descending else 'ASC'
+    sql = f'''
+        SELECT {CARD_COLUMNS}
+        FROM artworks a
+        LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+        {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        ORDER BY {column} {order}, a.artwork_id {order}
+        LIMIT %s
+    '''
+    return sql, tuple(params) + (size + 1,)
+
+
+def browse_result(rows, sort, size):
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        key = 'created_at' if sort == 'newest' else 'price'
+        next_cursor = encode_cursor(rows[-1][key], rows[-1]['artwork_id'])
+    return rows, next_cursor
+
+
+def value_label(index, facet, value):
+    if facet == 'availability':
+        return AVAILABILITY[value][0]
+    if facet == 'price':
+        return PRICE_BUCKETS[value]
+    if facet == 'artist':
+        return index.artist_names.get(value, f'Artist #{value}')
+    return str(value)
+
+
+def query_args(selection, sort, **extra):
+    args = {facet: values for facet, values in selection.items() if values}
+    if sort != 'newest':
+        args['sort'] = sort
+    args.update({k: v for k, v in extra.items() if v is not None})
+    return args
+
+
+def facet_panel(index, selection, sort):
+    # Template-ready facets: label, count, selected and the URL that
+    # toggles the value (and restarts paging).
+    counts, total = index.counts(selection)
+    panel = []
+    for facet in FACETS:
+        chosen = selection.get(facet, [])
+        values = []
+        for value, count in counts[facet]:
+            toggled = dict(selection)
+            toggled[facet] = [v for v in chosen if v != value] if value in chosen else chosen + [value]
+            values.append({'label': value_label(index, facet, value), 'count': count,
+                           'selected': value in chosen,
+                           'url': url_for(request.endpoint, **query_args(toggled, sort))})
+        panel.append({'name': facet, 'label': FACET_LABELS[facet], 'values': values})
+    return panel, total
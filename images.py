@@ -0,0 +1,219 @@
+"""Derivative images (card/detail/zoom, WebP + JPEG) for artwork uploads.
+
+Derivatives are written next to the original in the upload folder as
+``<stem>__<size>-v<n>.<ext>`` and described in ``artworks.image_variants``::
+
+    {"card": {"w": 480, "h": 360, "webp": "...", "jpeg": "..."}, ...}
+
+so listing queries already carry everything a template needs for srcset.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import url_for
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps
+
+import db_pool
+import jobs
+
+log = logging.getLogger(__name__)
+
+# Target widths; images are never upscaled past their original size.
+SIZES = {'card': 480, 'detail': 1024, 'zoom': 2048}
+# Part of every variant filename: bump it whenever SIZES/FORMATS change so the
+# new files get new (immutable) URLs instead of overwriting cached ones.
+VARIANT_VERSION = 1
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+_executor = None
+_workers = 2
+_upload_folder = None
+_on_done = None
+
+
+def init_app(app, on_done=None):
+    # on_done(artwork_id) runs after the variants are stored, e.g. to drop
+    # the artwork from the catalogue cache.
+    global _executor, _workers, _upload_folder, _on_done
+    _workers = app.config['IMAGE_WORKERS']
+    _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix='images')
+    _upload_folder = app.config['UPLOAD_FOLDER']
+    _on_done = on_done
+    app.jinja_env.globals['artwork_srcset'] = srcset
+    app.jinja_env.globals['artwork_image_url'] = image_url
+
+
+def reset_after_fork():
+    # Executor threads do not survive fork(); give each server worker its own.
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix='images')
+
+
+def set_workers(workers):
+    # More threads for a one-off job such as a bulk import on its own box.
+    global _executor, _workers
+    _workers = workers
+    _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix='images')
+
+
+def shutdown(wait=True):
+    # Lets queued variants finish before a worker exits.
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+
+
+def derivative_name(filename, size, fmt):
+    stem = filename.rsplit('.', 1)[0]
+    return f'{stem}__{size}-v{VARIANT_VERSION}.{"jpg" if fmt == "jpeg" else fmt}'
+
+
+def make_derivatives(upload_folder, filename):
+    with Image.open(os.path.join(upload_folder, filename)) as original:
+        # Apply the EXIF rotation, then drop every metadata block (EXIF, GPS,
+        # ICC, XMP) so none of it is carried into the derivatives.
+        clean = ImageOps.exif_transpose(original)
+        if clean.mode not in ('RGB', 'RGBA'):
+            clean = clean.convert('RGBA' if 'transparency' in clean.info else 'RGB')
+        else:
+            clean = clean.copy()
+        clean.info = {}
+
+    variants = {}
+    for size, width in SIZES.items():
+        resized = clean
+        if clean.width > width:
+            height = round(clean.height * width / clean.width)
+            resized = clean.resize((width, height), Image.LANCZOS)
+        entry = {'w': resized.width, 'h': resized.height}
+        for fmt, (pil_format, options) in FORMATS.items():
+            out = resized.convert('RGB') if fmt == 'jpeg' and resized.mode != 'RGB' else resized
+            name = derivative_name(filename, size, fmt)
+            out.save(os.path.join(upload_folder, name), pil_format, **options)
+            entry[fmt] = name
+        variants[size] = entry
+    return variants
+
+
+def process_artwork_image(artwork_id, filename, upload_folder=None):
+    return process_shared_image([artwork_id], filename, upload_folder)
+
+
+def process_shared_image(artwork_ids, filename, upload_folder=None):
+    # Content-addressed uploads can back several artworks (bulk imports reuse
+    # files); the variants are built once and recorded on all of them.
+    start = time.perf_counter()
+    variants = make_derivatives(upload_folder or _upload_folder, filename)
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        format_ids = ','.join(['%s'] * len(artwork_ids))
+        cursor.execute(f'UPDATE artworks SET image_variants = %s WHERE artwork_id IN ({format_ids})',
+                       (json.dumps(variants), *artwork_ids))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.release()
+    if _on_done:
+        for artwork_id in artwork_ids:
+            _on_done(artwork_id)
+    log.info('image variants for artwork(s) %s built in %.2fs', artwork_ids, time.perf_counter() - start)
+    return variants
+
+
+def submit(artwork_id, filename):
+    # Runs off the request thread; the admin is redirected straight away and
+    # pages fall back to the original image until the variants exist.
+    return submit_shared([artwork_id], filename)
+
+
+def submit_shared(artwork_ids, filename):
+    future = _executor.submit(process_shared_image, list(artwork_ids), filename)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def enqueue(cursor, artwork_ids, filename):
+    # Durable alternative to submit(): a job in the caller's transaction,
+    # built by "flask jobs worker" and retried if it fails.
+    return jobs.enqueue(cursor, 'images.process',
+                        {'artwork_ids': list(artwork_ids), 'filename': filename})
+
+
+@jobs.job('images.process', max_attempts=3)
+def process_job(conn, payload):
+    process_shared_image(payload['artwork_ids'], payload['filename'])
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        log.error('image processing failed', exc_info=exc)
+
+
+# -- template helpers ------------------------------------------------------------
+
+def _variants(art):
+    variants = art.get('image_variants')
+    if isinstance(variants, (str, bytes)):
+        variants = json.loads(variants)
+    return variants or {}
+
+
+def image_url(art, size='card', fmt='jpeg'):
+    variants = _variants(art)
+    if size in variants:
+        return url_for('uploaded_file', filename=variants[size][fmt])
+    return url_for('uploaded_file', filename=art['image_filename'])
+
+
+def image_urls(art):
+    # The original plus every variant, for JSON clients (api.py).
+    if not art.get('image_filename'):
+        return None
+    urls = {'original': url_for('uploaded_file', filename=art['image_filename'])}
+    for size, v in _variants(art).items():
+        urls[size] = {'width': v['w'], 'webp': url_for('uploaded_file', filename=v['webp']),
+                      'jpeg': url_for('uploaded_file', filename=v['jpeg'])}
+    return urls
+
+
+def srcset(art, fmt='webp'):
+    variants = _variants(art)
+    return ', '.join(
+        f"{url_for('uploaded_file', filename=v[fmt])} {v['w']}w"
+        for v in sorted(variants.values(), key=lambda v: v['w'])
+    )
+
+
+@click.command('backfill-images')
+@click.option('--all', 'redo', is_flag=True, help='Rebuild variants that already exist too.')
+@with_appcontext
+def backfill_images_command(redo):
+    """Build image variants for artworks uploaded before the pipeline existed."""
+    conn = db_pool.get_pool().acquire()
+    cursor = conn.cursor(dictionary=True)
+    sql = 'SELECT artwork_id, image_filename FROM artworks WHERE image_filename IS NOT NULL'
+    if not redo:
+        sql += ' AND image_variants IS NULL'
+    cursor.execute(sql)
+    pending = cursor.fetchall()
+    cursor.close()
+    conn.release()
+
+    done = failed = 0
+    futures = [(row, _executor.submit(process_artwork_image, row['artwork_id'], row['image_filename']))
+               for row in pending]
+    for row, future in futures:
+        try:
+            future.result()
+            done += 1
+        except (OSError, ValueError) as e:
+            failed += 1
+            click.echo(f"artwork {row['artwork_id']} ({row['image_filename']}): {e}", err=True)
+    click.echo(f'{done} artworks processed, {failed} failed.')
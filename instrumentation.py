@@ -0,0 +1,293 @@
+"""Request/query/template timing, N+1 detection, slow-query log and /metrics.
+
+Nothing here is installed when PERF_INSTRUMENTATION=0: cursors are then the
+plain mysql.connector ones and no request hooks or signals are registered.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import abort, g, has_request_context, request, session, Response
+from flask import before_render_template, template_rendered
+
+import catalogue_cache
+import db_pool
+import page_cache
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+slow_log = logging.getLogger('artvault.slow_query')
+n_plus_one_log = logging.getLogger('artvault.n_plus_one')
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def samples(self):
+        # Cumulative bucket counts, as Prometheus expects.
+        with self._lock:
+            running, out = 0, []
+            for bound, n in zip(self.buckets, self.counts):
+                running += n
+                out.append((bound, running))
+            return out, self.count, self.sum
+
+
+class Registry:
+    def __init__(self):
+        self.request_latency = defaultdict(Histogram)
+        self.queries_per_request = defaultdict(lambda: Histogram(COUNT_BUCKETS))
+        self.query_latency = defaultdict(Histogram)
+        self.query_rows = Counter()
+        self.template_latency = defaultdict(Histogram)
+        self.n_plus_one = Counter()
+        self.slow_queries = 0
+        self.collectors = []
+        # name -> (help, label name, {label: Histogram}) for other modules.
+        self.extra_histograms = {}
+        # shape -> (sql, params, endpoint) for the first execution of every
+        # statement shape, while a plan audit has capturing switched on.
+        self.captured = None
+
+    def histogram(self, name, help_text, label_name):
+        entry = self.extra_histograms.get(name)
+        if entry is None:
+            entry = self.extra_histograms.setdefault(
+                name, (help_text, label_name, defaultdict(Histogram)))
+        return entry[2]
+
+    def reset(self):
+        collectors = self.collectors
+        self.__init__()
+        self.collectors = collectors
+
+
+registry = Registry()
+
+_config = {'slow_query_seconds': 0.2, 'n_plus_one_threshold': 5}
+
+
+def register_collector(collector):
+    # collector() -> iterable of (name, type, help, [(labels_dict, value), ...])
+    registry.collectors.append(collector)
+
+
+# -- SQL shapes -----------------------------------------------------------------
+
+_WS = re.compile(r'\s+')
+_IN_LIST = re.compile(r'IN \((?:%s, ?)+%s\)|IN \(%s\)', re.IGNORECASE)
+_MULTI_VALUES = re.compile(r'(VALUES \([^)]*\))(?:, ?\([^)]*\))+', re.IGNORECASE)
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+\b")
+
+
+def query_shape(sql):
+    # Collapses whitespace, literals and variable-length IN/VALUES lists so
+    # one statement in a loop always maps to the same shape.
+    shape = _WS.sub(' ', sql).strip()
+    shape = _IN_LIST.sub('IN (...)', shape)
+    shape = _MULTI_VALUES.sub(r'\1, ...', shape)
+    return _LITERALS.sub('?', shape)
+
+
+def _redact(params):
+    if not params:
+        return '()'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: <{type(v).__name__}>' for k, v in params.items()) + '}'
+    return '(' + ', '.join(f'<{type(v).__name__}>' for v in params) + ')'
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, sql, params):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            record_query(sql, params, time.perf_counter() - start, self._cursor.rowcount)
+
+    def execute(self, sql, params=(), *args, **kwargs):
+        return self._timed(lambda s, p: self._cursor.execute(s, p, *args, **kwargs), sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self._timed(self._cursor.executemany, sql, seq_params)
+
+
+def record_query(sql, params, elapsed, rowcount):
+    shape = query_shape(sql)
+    registry.query_latency[shape].observe(elapsed)
+    if rowcount and rowcount > 0:
+        registry.query_rows[shape] += rowcount
+    if has_request_context():
+        shapes = g.setdefault('_query_shapes', Counter())
+        shapes[shape] += 1
+    if registry.captured is not None and shape not in registry.captured:
+        registry.captured[shape] = (sql, params, request.endpoint if has_request_context() else '-')
+    if elapsed >= _config['slow_query_seconds']:
+        registry.slow_queries += 1
+        endpoint = request.endpoint if has_request_context() else '-'
+        slow_log.warning('%.1fms rows=%s endpoint=%s sql=%s params=%s',
+                         elapsed * 1000, rowcount, endpoint, shape, _redact(params))
+
+
+# -- request and template hooks -------------------------------------------------
+
+def _before_request():
+    g._request_start = time.perf_counter()
+
+
+def _teardown_request(exc=None):
+    start = g.pop('_request_start', None)
+    if start is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    registry.request_latency[endpoint].observe(time.perf_counter() - start)
+    shapes = g.pop('_query_shapes', Counter())
+    registry.queries_per_request[endpoint].observe(sum(shapes.values()))
+    for shape, count in shapes.items():
+        if count >= _config['n_plus_one_threshold']:
+            registry.n_plus_one[(endpoint, shape)] += 1
+            n_plus_one_log.warning('possible N+1: %s ran %d times in one %s request',
+                                   shape, count, endpoint)
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('_render_starts', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get('_render_starts')
+    if starts:
+        registry.template_latency[template.name or '<string>'].observe(time.perf_counter() - starts.pop())
+
+
+# -- exposition -------------------------------------------------------------------
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')[:200]
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_label(v)}"' for k, v in labels.items()) + '}'
+
+
+def _histogram_lines(name, help_text, histograms, label_name):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, hist in sorted(histograms.items()):
+        buckets, count, total = hist.samples()
+        for bound, cumulative in buckets:
+            lines.append(f'{name}_bucket{_labels({label_name: key, "le": bound})} {cumulative}')
+        lines.append(f'{name}_bucket{_labels({label_name: key, "le": "+Inf"})} {count}')
+        lines.append(f'{name}_sum{_labels({label_name: key})} {total:.6f}')
+        lines.append(f'{name}_count{_labels({label_name: key})} {count}')
+    return lines
+
+
+def render_metrics():
+    lines = []
+    lines += _histogram_lines('artvault_http_request_duration_seconds',
+                              'Request latency by endpoint.', registry.request_latency, 'endpoint')
+    lines += _histogram_lines('artvault_db_queries_per_request',
+                              'SQL statements executed per request.', registry.queries_per_request, 'endpoint')
+    lines += _histogram_lines('artvault_db_query_duration_seconds',
+                              'SQL latency by statement shape.', registry.query_latency, 'query')
+    lines += _histogram_lines('artvault_template_render_seconds',
+                              'Jinja render time by template.', registry.template_latency, 'template')
+
+    for name, (help_text, label_name, histograms) in sorted(registry.extra_histograms.items()):
+        lines += _histogram_lines(name, help_text, histograms, label_name)
+
+    lines += ['# HELP artvault_db_query_rows_total Rows returned or affected by statement shape.',
+              '# TYPE artvault_db_query_rows_total counter']
+    lines += [f'artvault_db_query_rows_total{_labels({"query": q})} {n}'
+              for q, n in sorted(registry.query_rows.items())]
+    lines += ['# HELP artvault_n_plus_one_total Requests that repeated one statement shape too often.',
+              '# TYPE artvault_n_plus_one_total counter']
+    lines += [f'artvault_n_plus_one_total{_labels({"endpoint": e, "query": q})} {n}'
+              for (e, q), n in sorted(registry.n_plus_one.items())]
+    lines += ['# HELP artvault_slow_queries_total Statements slower than SLOW_QUERY_MS.',
+              '# TYPE artvault_slow_queries_total counter',
+              f'artvault_slow_queries_total {registry.slow_queries}']
+
+    for collector in registry.collectors:
+        for name, kind, help_text, samples in collector():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(labels)} {value}' for labels, value in samples]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    token = _config.get('token')
+    authorised = session.get('admin_id') or (
+        token and request.headers.get('Authorization') == f'Bearer {token}')
+    if not authorised:
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def pool_collector():
+    stats = db_pool.get_pool().stats()
+    gauges = ('open', 'idle', 'in_use')
+    for key, value in stats.items():
+        if key in ('size', 'max_overflow'):
+            continue
+        kind = 'gauge' if key in gauges else 'counter'
+        suffix = '' if key in gauges else '_total'
+        yield f'artvault_db_pool_{key}{suffix}', kind, f'Connection pool {key.replace("_", " ")}.', [({}, value)]
+
+
+def cache_collector():
+    for name, cache in (('catalogue', catalogue_cache.get_cache()), ('page', page_cache.get_cache())):
+        stats = cache.stats()
+        for key in ('hits', 'misses', 'evictions'):
+            yield (f'artvault_{name}_cache_{key}_total', 'counter',
+                   f'{name.capitalize()} cache {key}.', [({}, stats[key])])
+
+
+def init_app(app):
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    _config['token'] = app.config.get('METRICS_TOKEN')
+    register_collector(pool_collector)
+    register_collector(cache_collector)
+    if not app.config['PERF_INSTRUMENTATION']:
+        return
+
+    _config['slow_query_seconds'] = app.config['SLOW_QUERY_MS'] / 1000
+    _config['n_plus_one_threshold'] = app.config['N_PLUS_ONE_THRESHOLD']
+    if app.config.get('SLOW_QUERY_LOG'):
+        handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'])
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(handler)
+
+    db_pool.set_cursor_wrapper(InstrumentedCursor)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
@@ -0,0 +1,364 @@
+"""Database-backed background jobs, with retries and periodic schedules.
+
+    flask jobs worker --threads 4      # run as many of these as needed
+    flask jobs status
+    flask jobs enqueue rollups.refresh
+
+A job is a row in ``jobs``. Enqueue it with ``enqueue(cursor, ...)`` inside
+the transaction that makes it necessary, so it exists only if that
+transaction commits. Workers claim due rows with SELECT ... FOR UPDATE SKIP
+LOCKED, so any number of them can share the table. A failed job is retried
+with exponential backoff until ``max_attempts``. While a job runs its worker
+refreshes ``locked_at`` (a heartbeat), so only a job whose worker died goes
+stale; it is handed out again after JOB_LOCK_TIMEOUT, or failed once it has
+used up its attempts. Delivery is at least once, so handlers must be safe
+to run twice.
+
+Periodic jobs come from the JOB_SCHEDULES config ({name: seconds}); the
+``job_schedules`` table makes sure only one worker enqueues each run.
+"""
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from mysql.connector import Error
+
+import db_pool
+
+log = logging.getLogger('artvault.jobs')
+
+_handlers = {}
+_config = {'schedules': {}, 'lock_timeout': 600, 'retry_base': 10, 'retry_max': 3600,
+           'retention_days': 7}
+
+
+def job(name, max_attempts=5):
+    # Registers fn(conn, payload) as the handler for jobs called `name`.
+    def register(fn):
+        _handlers[name] = (fn, max_attempts)
+        return fn
+    return register
+
+
+def init_app(app):
+    _config.update(
+        schedules={name: every for name, every in app.config['JOB_SCHEDULES'].items() if every},
+        lock_timeout=app.config['JOB_LOCK_TIMEOUT'],
+        retry_base=app.config['JOB_RETRY_BASE'],
+        retention_days=app.config['JOB_RETENTION_DAYS'],
+    )
+
+
+def enqueue(cursor, name, payload=None, delay=0, max_attempts=None):
+    if name not in _handlers:
+        raise KeyError(f'no job handler registered for {name!r}')
+    cursor.execute('''
+        INSERT INTO jobs (name, payload, max_attempts, run_at)
+        VALUES (%s, %s, %s, NOW(6) + INTERVAL %s SECOND)
+    ''', (name, json.dumps(payload or {}), max_attempts or _handlers[name][1], delay))
+    return cursor.lastrowid
+
+
+# -- worker side -------------------------------------------------------------------
+
+def claim(conn, worker_id, limit=1):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute('''
+            SELECT job_id, name, payload, attempts, max_attempts FROM jobs
+            WHERE status = 'queued' AND run_at <= NOW(6)
+            ORDER BY run_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (limit,))
+        rows = cursor.fetchall()
+        if rows:
+            format_ids = ','.join(['%s'] * len(rows))
+            cursor.execute(f'''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                       locked_by = %s, locked_at = NOW(6)
+                WHERE job_id IN ({format_ids})
+            ''', (worker_id, *[row['job_id'] for row in rows]))
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    for row in rows:
+        row['attempts'] += 1
+        row['payload'] = json.loads(row['payload']) if row['payload'] else {}
+    return rows
+
+
+def retry_delay(attempts):
+    delay = min(_config['retry_base'] * 2 ** (attempts - 1), _config['retry_max'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(conn, row):
+    # Runs one claimed job and records the outcome. Returns True on success.
+    handler = _handlers.get(row['name'])
+    start = time.perf_counter()
+    try:
+        if handler is None:
+            raise KeyError(f"no job handler registered for {row['name']!r}")
+        handler[0](conn, row['payload'])
+    except Exception:
+        conn.rollback()
+        error = traceback.format_exc(limit=5)
+        final = handler is None or row['attempts'] >= row['max_attempts']
+        log.warning('job %s (%s) failed on attempt %d%s', row['job_id'], row['name'],
+                    row['attempts'], '' if final else ', will retry', exc_info=True)
+        cursor = conn.cursor()
+        if final:
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', last_error = %s, finished_at = NOW(6),
+                       locked_by = NULL
+                WHERE job_id = %s
+            ''', (error, row['job_id']))
+        else:
+            cursor.execute('''
+                UPDATE jobs SET status = 'queued', last_error = %s, locked_by = NULL,
+                       run_at = NOW(6) + INTERVAL %s SECOND
+                WHERE job_id = %s
+            ''', (error, retry_delay(row['attempts']), row['job_id']))
+        conn.commit()
+        cursor.close()
+        return False
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE jobs SET status = 'done', finished_at = NOW(6), locked_by = NULL
+        WHERE job_id = %s
+    ''', (row['job_id'],))
+    conn.commit()
+    cursor.close()
+    log.info('job %s (%s) done in %.2fs', row['job_id'], row['name'], time.perf_counter() - start)
+    return True
+
+
+def enqueue_due_schedules(conn):
+    # One row per schedule; whoever locks it first enqueues the run and
+    # moves next_run_at on, the others skip it.
+    schedules = _config['schedules']
+    if not schedules:
+        return 0
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.executemany('INSERT IGNORE INTO job_schedules (name, next_run_at) VALUES (%s, NOW())',
+                           [(name,) for name in schedules])
+        conn.commit()
+        format_names = ','.join(['%s'] * len(schedules))
+        cursor.execute(f'''
+            SELECT name FROM job_schedules
+            WHERE name IN ({format_names}) AND next_run_at <= NOW()
+            FOR UPDATE SKIP LOCKED
+        ''', tuple(schedules))
+        due = [row['name'] for row in cursor.fetchall()]
+        for name in due:
+            enqueue(cursor, name)
+            cursor.execute('''
+                UPDATE job_schedules SET next_run_at = NOW() + INTERVAL %s SECOND
+                WHERE name = %s
+            ''', (schedules[name], name))
+        conn.commit()
+        return len(due)
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def heartbeat(job_id, worker_id, stop):
+    # Runs beside a job on its own connection, keeping locked_at fresh so
+    # requeue_stale() leaves a long but healthy job alone.
+    every = max(1.0, _config['lock_timeout'] / 4)
+    while not stop.wait(every):
+        conn = db_pool.get_pool().acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET locked_at = NOW(6)
+                WHERE job_id = %s AND locked_by = %s AND status = 'running'
+            ''', (job_id, worker_id))
+            conn.commit()
+            cursor.close()
+        except Error:
+            log.warning('heartbeat for job %s failed', job_id, exc_info=True)
+        finally:
+            conn.release()
+
+
+def requeue_stale(conn):
+    # Jobs whose worker died mid-run (crash, kill -9, lost connection): the
+    # heartbeat stopped. claim() already counted the dead run in attempts,
+    # so a job that keeps killing its worker fails at max_attempts instead
+    # of looping forever.
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE jobs
+        SET last_error = IF(attempts >= max_attempts,
+                            CONCAT('worker ', locked_by, ' stopped responding'), last_error),
+            finished_at = IF(attempts >= max_attempts, NOW(6), NULL),
+            status = IF(attempts >= max_attempts, 'failed', 'queued'),
+            locked_by = NULL
+        WHERE status = 'running' AND locked_at < NOW(6) - INTERVAL %s SECOND
+    ''', (_config['lock_timeout'],))
+    requeued = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return requeued
+
+
+def work(app, worker_id, stop, poll=1.0, burst=False):
+    # One worker thread: claim, run, repeat until `stop` is set (or, with
+    # burst, until nothing is due).
+    while not stop.is_set():
+        with app.app_context():
+            conn = db_pool.get_pool().acquire()
+            try:
+                rows = claim(conn, worker_id)
+                for row in rows:
+                    beat = threading.Event()
+                    threading.Thread(target=heartbeat, args=(row['job_id'], worker_id, beat),
+                                     name=f'{threading.current_thread().name}-heartbeat',
+                                     daemon=True).start()
+                    try:
+                        run_job(conn, row)
+                    finally:
+                        beat.set()
+            except Error:
+                log.exception('job worker %s lost its database connection', worker_id)
+                rows = []
+            finally:
+                conn.release()
+        if not rows:
+            if burst:
+                return
+            stop.wait(poll)
+
+
+def housekeeping(app, stop, every=15.0):
+    while not stop.is_set():
+        with app.app_context():
+            conn = db_pool.get_pool().acquire()
+            try:
+                enqueue_due_schedules(conn)
+                requeued = requeue_stale(conn)
+                if requeued:
+                    log.warning('requeued or failed %d job(s) abandoned by a dead worker', requeued)
+            except Error:
+                log.exception('job housekeeping failed')
+            finally:
+                conn.release()
+        stop.wait(every)
+
+
+@job('jobs.purge')
+def purge_finished(conn, payload):
+    cursor = conn.cursor()
+    while True:
+        cursor.execute('''
+            DELETE FROM jobs
+            WHERE status IN ('done', 'failed') AND finished_at < NOW() - INTERVAL %s DAY
+            LIMIT 5000
+        ''', (_config['retention_days'],))
+        conn.commit()
+        if cursor.rowcount < 5000:
+            break
+    cursor.close()
+
+
+# -- CLI ----------------------------------------------------------------------------
+
+@click.group('jobs')
+def jobs_cli():
+    """Background job queue."""
+
+
+@jobs_cli.command('worker')
+@click.option('--threads', default=1, show_default=True, help='Jobs run concurrently by this process.')
+@click.option('--poll', default=1.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due (cron, tests).')
+@with_appcontext
+def worker_command(threads, poll, burst):
+    """Run queued and scheduled jobs until SIGTERM/SIGINT."""
+    app = current_app._get_current_object()
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    workers = [threading.Thread(target=work, args=(app, f'{name}:{i}', stop, poll, burst),
+                                name=f'jobs-{i}') for i in range(threads)]
+    if burst:
+        with app.app_context():
+            conn = db_pool.get_pool().acquire()
+            try:
+                enqueue_due_schedules(conn)
+            finally:
+                conn.release()
+    else:
+        workers.append(threading.Thread(target=housekeeping, args=(app, stop), name='jobs-housekeeping',
+                                        daemon=True))
+    click.echo(f'job worker {name}: {threads} thread(s), handlers: {", ".join(sorted(_handlers))}')
+    for thread in workers:
+        thread.start()
+    # Waiting with a timeout keeps the main thread responsive to signals.
+    for thread in workers:
+        while thread.is_alive() and not thread.daemon:
+            thread.join(0.5)
+    stop.set()
+    click.echo('job worker stopped')
+
+
+@jobs_cli.command('status')
+@with_appcontext
+def status_command():
+    """Count jobs by name and status, and show the schedules."""
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('''
+            SELECT name, status, COUNT(*) AS n, MIN(run_at) AS next_run
+            FROM jobs GROUP BY name, status ORDER BY name, status
+        ''')
+        for row in cursor.fetchall():
+            next_run = f" (next due {row['next_run']:%Y-%m-%d %H:%M:%S})" if row['status'] == 'queued' else ''
+            click.echo(f"{row['name']:<28} {row['status']:<8} {row['n']}{next_run}")
+        cursor.execute('SELECT name, next_run_at FROM job_schedules ORDER BY name')
+        for row in cursor.fetchall():
+            every = _config['schedules'].get(row['name'])
+            click.echo(f"schedule {row['name']:<28} every {every or '-'}s, next {row['next_run_at']}")
+        cursor.close()
+    finally:
+        conn.release()
+
+
+@jobs_cli.command('enqueue')
+@click.argument('name')
+@click.option('--payload', default='{}', help='JSON object handed to the job.')
+@with_appcontext
+def enqueue_command(name, payload):
+    """Queue a job to run now."""
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        job_id = enqueue(cursor, name, json.loads(payload))
+        conn.commit()
+        cursor.close()
+    except KeyError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.release()
+    click.echo(f'queued job {job_id}')
@@ -0,0 +1,290 @@
+"""Versioned schema migrations and the EXPLAIN audit.
+
+Migrations are the ``migrations/NNNN_name.sql`` files, applied in order and
+recorded in ``schema_migrations``:
+
+    flask db upgrade            # create the database if needed, apply pending
+    flask db status
+    flask db stamp 0001         # adopt a database built by the old script
+    flask db audit              # EXPLAIN every statement the routes run
+
+MySQL commits DDL implicitly, so a migration is not atomic: a failure part
+way through leaves the earlier statements applied and the version
+unrecorded. Keep one concern per file and write them so they can be
+finished by hand.
+"""
+import hashlib
+import os
+import random
+import re
+
+import click
+import mysql.connector
+from flask import current_app
+from flask.cli import with_appcontext
+from mysql.connector import Error, errorcode
+
+import benchmark
+import catalogue_cache
+import db_pool
+import instrumentation
+import page_cache
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+FILENAME = re.compile(r'^(\d{4})_([\w-]+)\.sql$')
+STATEMENT_END = re.compile(r';[ \t]*(?:--[^\n]*)?$', re.MULTILINE)
+
+# EXPLAIN access types that read a whole table or a whole index.
+FULL_SCAN_TYPES = ('ALL', 'index')
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class Migration:
+    def __init__(self, path):
+        self.path = path
+        match = FILENAME.match(os.path.basename(path))
+        self.version, self.name = match.groups()
+        with open(path, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+
+    def statements(self):
+        for chunk in STATEMENT_END.split(self.sql):
+            lines = [line for line in chunk.splitlines() if not line.strip().startswith('--')]
+            statement = '\n'.join(lines).strip()
+            if statement:
+                yield statement
+
+
+def discover(directory=MIGRATIONS_DIR):
+    return [Migration(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if FILENAME.match(name)]
+
+
+# -- database helpers ----------------------------------------------------------------
+
+def connect(connect_args, create=False):
+    # create=True makes a missing database instead of failing on it.
+    try:
+        return mysql.connector.connect(**connect_args)
+    except Error as e:
+        if not create or e.errno != errorcode.ER_BAD_DB_ERROR:
+            raise
+    server_args = {k: v for k, v in connect_args.items() if k != 'database'}
+    conn = mysql.connector.connect(**server_args)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE `{connect_args['database']}` "
+                   'CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci')
+    cursor.close()
+    conn.close()
+    return mysql.connector.connect(**connect_args)
+
+
+def drop_database(connect_args):
+    server_args = {k: v for k, v in connect_args.items() if k != 'database'}
+    conn = mysql.connector.connect(**server_args)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{connect_args['database']}`")
+    cursor.close()
+    conn.close()
+
+
+def ensure_table(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version CHAR(4) PRIMARY KEY,
+          name VARCHAR(200) NOT NULL,
+          checksum CHAR(64) NOT NULL,
+          applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.close()
+
+
+def applied_versions(conn):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT version, checksum FROM schema_migrations')
+    applied = {row['version']: row['checksum'] for row in cursor.fetchall()}
+    cursor.close()
+    return applied
+
+
+def record(conn, migration):
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)',
+                   (migration.version, migration.name, migration.checksum))
+    conn.commit()
+    cursor.close()
+
+
+def upgrade(conn, target=None, echo=click.echo):
+    ensure_table(conn)
+    applied = applied_versions(conn)
+    done = 0
+    for migration in discover():
+        if target and migration.version > target:
+            break
+        if migration.version in applied:
+            continue
+        echo(f'applying {migration.version}_{migration.name}')
+        cursor = conn.cursor()
+        for statement in migration.statements():
+            try:
+                cursor.execute(statement)
+            except Error as e:
+                raise click.ClickException(
+                    f'{migration.version}_{migration.name} failed: {e}\n{statement[:500]}')
+        conn.commit()
+        cursor.close()
+        record(conn, migration)
+        done += 1
+    return done
+
+
+# -- plan audit ------------------------------------------------------------------------
+
+def capture_route_statements(app):
+    # Runs every benchmark scenario plus the admin listings once, in-process
+    # and with the caches off, and returns what the routes sent to MySQL.
+    registry = instrumentation.registry
+    db_pool.set_cursor_wrapper(instrumentation.InstrumentedCursor)
+    caches = (catalogue_cache.get_cache(), page_cache.get_cache())
+    enabled = [cache.enabled for cache in caches]
+    registry.captured = {}
+    try:
+        for cache in caches:
+            cache.enabled = False
+        fixtures, users, admin_id, _ = benchmark.load_fixtures(1)
+        vuser = benchmark.VirtualUser(lambda: benchmark.InProcessClient(app), users[0],
+                                      admin_id, fixtures, random.Random(7))
+        vuser.prepare()
+        for name in benchmark.SCENARIOS:
+            vuser.step(name)
+        admin = vuser.clients['admin']
+        for path in ('/admin', '/admin/manage/users', '/admin/manage/orders', '/search?q=zzzz'):
+            client = admin if path.startswith('/admin') else vuser.clients['user']
+            client.request('GET', path)
+        return registry.captured
+    finally:
+        registry.captured = None
+        for cache, was_enabled in zip(caches, enabled):
+            cache.enabled = was_enabled
+        if not app.config['PERF_INSTRUMENTATION']:
+            db_pool.set_cursor_wrapper(None)
+
+
+def explain(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params or ())
+    return cursor.fetchall()
+
+
+def audit_statements(conn, statements, max_rows):
+    # Returns [(endpoint, shape, plan_row)] for every full table/index scan
+    # estimated above max_rows.
+    failures = []
+    cursor = conn.cursor(dictionary=True)
+    for shape, (sql, params, endpoint) in sorted(statements.items(), key=lambda item: item[1][2] or ''):
+        if not sql.lstrip().upper().startswith(EXPLAINABLE) or isinstance(params, list):
+            continue
+        try:
+            plan = explain(cursor, sql, params)
+        except Error as e:
+            click.echo(f'  ? {endpoint}: could not EXPLAIN ({e.msg}): {shape[:120]}')
+            continue
+        worst = [row for row in plan
+                 if row.get('type') in FULL_SCAN_TYPES and (row.get('rows') or 0) > max_rows]
+        status = 'FAIL' if worst else 'ok'
+        click.echo(f'  {status:<4} {endpoint}: {shape[:140]}')
+        for row in plan:
+            click.echo(f"         {row.get('table')}: type={row.get('type')} key={row.get('key')} "
+                       f"rows={row.get('rows')} {row.get('Extra') or ''}")
+        failures += [(endpoint, shape, row) for row in worst]
+    cursor.close()
+    return failures
+
+
+# -- CLI --------------------------------------------------------------------------------
+
+@click.group('db')
+def db_cli():
+    """Schema migrations and query-plan checks."""
+
+
+@db_cli.command('upgrade')
+@click.option('--target', help='Stop after this version (e.g. 0002).')
+@with_appcontext
+def upgrade_command(target):
+    """Apply pending migrations, creating the database if it is missing."""
+    conn = connect(current_app.config['DB_CONNECT_ARGS'], create=True)
+    try:
+        done = upgrade(conn, target)
+    finally:
+        conn.close()
+    click.echo(f'{done} migration(s) applied.' if done else 'Already up to date.')
+
+
+@db_cli.command('status')
+@with_appcontext
+def status_command():
+    """List migrations and whether they are applied."""
+    conn = connect(current_app.config['DB_CONNECT_ARGS'])
+    try:
+        ensure_table(conn)
+        applied = applied_versions(conn)
+    finally:
+        conn.close()
+    for migration in discover():
+        checksum = applied.get(migration.version)
+        if checksum is None:
+            state = 'pending'
+        elif checksum != migration.checksum:
+            state = 'applied, file changed since'
+        else:
+            state = 'applied'
+        click.echo(f'{migration.version}_{migration.name}: {state}')
+
+
+@db_cli.command('stamp')
+@click.argument('version')
+@with_appcontext
+def stamp_command(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    conn = connect(current_app.config['DB_CONNECT_ARGS'])
+    try:
+        ensure_table(conn)
+        applied = applied_versions(conn)
+        for migration in discover():
+            if migration.version > version:
+                break
+            if migration.version not in applied:
+                record(conn, migration)
+                click.echo(f'stamped {migration.version}_{migration.name}')
+    finally:
+        conn.close()
+
+
+@db_cli.command('audit')
+@click.option('--max-rows', default=1000, show_default=True,
+              help='Fail on a full table/index scan estimated above this many rows.')
+@with_appcontext
+def audit_command(max_rows):
+    """EXPLAIN every statement the routes execute; fail on large full scans.
+
+    Run it against a seeded database ("flask bench seed"): on a near-empty
+    table every plan is a cheap scan and nothing is learned. Requests are
+    made in-process and do write (cart, one checkout).
+    """
+    app = current_app._get_current_object()
+    statements = capture_route_statements(app)
+    click.echo(f'{len(statements)} distinct statements captured')
+    conn = db_pool.get_pool().acquire()
+    try:
+        failures = audit_statements(conn, statements, max_rows)
+    finally:
+        conn.release()
+    if failures:
+        lines = '\n'.join(f"  {endpoint}: {row['table']} type={row['type']} rows={row['rows']}"
+                          for endpoint, _, row in failures)
+        raise click.ClickException(f'{len(failures)} full scan(s) above {max_rows} rows:\n{lines}')
+    click.echo('No full scans above the threshold.')
@@ -0,0 +1,125 @@
+-- Baseline: the schema create_database.sql used to build. Databases created
+-- from that script should be marked with "flask db stamp 0001" instead.
+
+CREATE TABLE users (
+  user_id INT AUTO_INCREMENT PRIMARY KEY,
+  username VARCHAR(50) NOT NULL UNIQUE,
+  email VARCHAR(120) NOT NULL UNIQUE,
+  password VARCHAR(255) NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE admins (
+  admin_id INT AUTO_INCREMENT PRIMARY KEY,
+  username VARCHAR(50) NOT NULL UNIQUE,
+  password VARCHAR(255) NOT NULL,
+  name VARCHAR(100)
+);
+
+CREATE TABLE artists (
+  artist_id INT AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(150) NOT NULL,
+  bio TEXT,
+  FULLTEXT INDEX ft_artists_name (name)
+);
+
+CREATE TABLE artworks (
+  artwork_id INT AUTO_INCREMENT PRIMARY KEY,
+  title VARCHAR(200) NOT NULL,
+  description TEXT,
+  price DECIMAL(10,2) NOT NULL,
+  image_filename VARCHAR(255),
+  image_variants JSON,
+  artist_id INT,
+  available_qty INT DEFAULT 1,
+  status VARCHAR(20) DEFAULT 'Available',
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  INDEX idx_artworks_created_id (created_at, artwork_id),
+  INDEX idx_artworks_price (price),
+  FULLTEXT INDEX ft_artworks_text (title, description),
+  FOREIGN KEY (artist_id) REFERENCES artists(artist_id) ON DELETE SET NULL
+);
+
+CREATE TABLE orders (
+  order_id INT AUTO_INCREMENT PRIMARY KEY,
+  user_id INT NOT NULL,
+  total_amount DECIMAL(10,2) NOT NULL,
+  status VARCHAR(50) DEFAULT 'Pending',
+  address TEXT,
+  delivery_date DATE,
+  payment_mode VARCHAR(30),
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE order_items (
+  order_item_id INT AUTO_INCREMENT PRIMARY KEY,
+  order_id INT NOT NULL,
+  artwork_id INT NOT NULL,
+  quantity INT NOT NULL,
+  unit_price DECIMAL(10,2) NOT NULL,
+  FOREIGN KEY (order_id) REFERENCES orders(order_id) ON DELETE CASCADE,
+  FOREIGN KEY (artwork_id) REFERENCES artworks(artwork_id) ON DELETE CASCADE
+);
+
+-- Server-side carts; the session cookie only holds cart_id
+CREATE TABLE carts (
+  cart_id CHAR(32) PRIMARY KEY,
+  user_id INT NULL UNIQUE,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE cart_items (
+  cart_id CHAR(32) NOT NULL,
+  artwork_id INT NOT NULL,
+  quantity INT NOT NULL,
+  PRIMARY KEY (cart_id, artwork_id),
+  FOREIGN KEY (cart_id) REFERENCES carts(cart_id) ON DELETE CASCADE,
+  FOREIGN KEY (artwork_id) REFERENCES artworks(artwork_id) ON DELETE CASCADE
+);
+
+-- Dashboard rollups, maintained by rollups.py
+CREATE TABLE stats_totals (
+  name VARCHAR(50) PRIMARY KEY,
+  value BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE stats_price_buckets (
+  price_range VARCHAR(50) PRIMARY KEY,
+  sort_order TINYINT NOT NULL DEFAULT 0,
+  artwork_count INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE stats_revenue_daily (
+  day DATE PRIMARY KEY,
+  order_count INT NOT NULL DEFAULT 0,
+  revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE stats_top_artworks (
+  list_name VARCHAR(20) NOT NULL,
+  position TINYINT NOT NULL,
+  artwork_id INT NOT NULL,
+  title VARCHAR(200) NOT NULL,
+  price DECIMAL(10,2) NOT NULL,
+  image_filename VARCHAR(255),
+  metric DECIMAL(14,2),
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (list_name, position)
+);
+
+INSERT INTO admins (username, password, name) VALUES
+('admin', 'scrypt:32768:8:1$YViLob8JvMeqQMoz$0959c5bf26b741be2e3d929f8aead903412c60dee5a91daeb5333c644c33575847d7263982eee5070eb8bf507d2d43f80091fde7193eeeda1c05485c38267bd1', 'Gallery Admin');
+
+INSERT INTO artists (name, bio) VALUES
+('Ravi Kumar', 'Contemporary painter from India.'),
+('Ananya Roy', 'Digital artist focusing on surreal landscapes.');
+
+INSERT INTO artworks (title, description, price, image_filename, artist_id, available_qty) VALUES
+('Sunset over Ganges', 'Oil painting with vibrant hues', 12000.00, 'sunset.jpg', 1, 1),
+('Dreamscape #1', 'Digital print, limited edition', 3500.00, 'dream1.jpg', 2, 5);
@@ -0,0 +1,25 @@
+-- Composite/covering indexes for the hot queries. Check them with
+-- "flask db audit" against a seeded database.
+
+-- Profile order history and sync_statuses(): WHERE user_id = ? ORDER BY
+-- created_at DESC, order_id DESC (keyset). Also serves the user_id FK.
+ALTER TABLE orders
+  ADD INDEX idx_orders_user_created (user_id, created_at, order_id);
+
+-- Admin order listing, newest first.
+ALTER TABLE orders
+  ADD INDEX idx_orders_created_id (created_at, order_id);
+
+-- fetch_items_by_order(): WHERE order_id IN (...) answered from the index
+-- alone, without touching the clustered rows.
+ALTER TABLE order_items
+  ADD INDEX idx_order_items_order_cover (order_id, artwork_id, quantity, unit_price);
+
+-- Best-selling rollup: GROUP BY artwork_id SUM(quantity) as an index-only scan.
+ALTER TABLE order_items
+  ADD INDEX idx_order_items_artwork_qty (artwork_id, quantity);
+
+-- Artist pages/filters: newest first within an artist. Also serves the artist_id FK.
+ALTER TABLE artworks
+  ADD INDEX idx_artworks_artist_created (artist_id, created_at, artwork_id);
+
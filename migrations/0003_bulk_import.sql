@@ -0,0 +1,11 @@
+-- Lookups made by the bulk importer (bulk.py) once per batch.
+
+-- Artist resolution: WHERE name IN (...). The FULLTEXT index cannot
+-- answer an equality match.
+ALTER TABLE artists
+  ADD INDEX idx_artists_name (name);
+
+-- Finding the rows of a batch that still need image variants:
+-- WHERE image_filename IN (...) AND image_variants IS NULL.
+ALTER TABLE artworks
+  ADD INDEX idx_artworks_image_filename (image_filename);
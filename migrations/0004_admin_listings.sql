@@ -0,0 +1,13 @@
+-- Sort orders of the admin user/order tables (admin_tables.py). InnoDB
+-- appends the primary key to every secondary index, which supplies the
+-- keyset tie-breaker.
+
+ALTER TABLE users
+  ADD INDEX idx_users_created (created_at);
+
+ALTER TABLE orders
+  ADD INDEX idx_orders_total (total_amount);
+
+-- Status filter, newest first.
+ALTER TABLE orders
+  ADD INDEX idx_orders_status_created (status, created_at);
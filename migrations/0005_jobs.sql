@@ -0,0 +1,33 @@
+-- Background job queue (jobs.py).
+
+CREATE TABLE jobs (
+  job_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(100) NOT NULL,
+  payload JSON,
+  status VARCHAR(10) NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+  attempts INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 5,
+  run_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  locked_by VARCHAR(100),
+  locked_at DATETIME(6),
+  last_error TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  finished_at DATETIME(6),
+  -- Claiming: WHERE status = 'queued' AND run_at <= NOW() ORDER BY run_at.
+  INDEX idx_jobs_claim (status, run_at),
+  -- Purging finished jobs.
+  INDEX idx_jobs_finished (status, finished_at)
+);
+
+CREATE TABLE job_schedules (
+  name VARCHAR(100) PRIMARY KEY,
+  next_run_at DATETIME NOT NULL
+);
+
+-- Scheduled status transitions: WHERE status = ? AND delivery_date < / >= CURDATE().
+ALTER TABLE orders
+  ADD INDEX idx_orders_status_delivery (status, delivery_date);
+
+-- Stale anonymous cart cleanup.
+ALTER TABLE carts
+  ADD INDEX idx_carts_updated (updated_at);
@@ -0,0 +1,29 @@
+-- Precomputed "related artworks" (recommendations.py).
+
+-- How many orders contained both artworks; both directions are stored so
+-- one artwork's partners are a primary-key range.
+CREATE TABLE artwork_copurchase (
+  artwork_id INT NOT NULL,
+  other_id INT NOT NULL,
+  orders INT NOT NULL,
+  PRIMARY KEY (artwork_id, other_id)
+);
+
+-- Top-K per artwork as shown on /artwork/<id>: one primary-key range read.
+CREATE TABLE artwork_related (
+  artwork_id INT NOT NULL,
+  rank_no TINYINT NOT NULL,
+  related_id INT NOT NULL,
+  reason VARCHAR(10) NOT NULL,  -- bought, artist, price
+  PRIMARY KEY (artwork_id, rank_no)
+);
+
+-- Watermarks of the incremental rebuild.
+CREATE TABLE recommendation_state (
+  name VARCHAR(50) PRIMARY KEY,
+  value VARCHAR(50) NOT NULL
+);
+
+-- Incremental refresh: artworks edited since the last run.
+ALTER TABLE artworks
+  ADD INDEX idx_artworks_updated (updated_at);
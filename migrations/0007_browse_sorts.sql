@@ -0,0 +1,7 @@
+-- Gallery sort by price (facets.py): keyset on (price, artwork_id) for
+-- price_asc/price_desc, and the price-bucket filters as range scans on its
+-- prefix. It replaces the baseline single-column price index, which every
+-- reader of idx_artworks_price can use the new index's prefix for.
+ALTER TABLE artworks
+  ADD INDEX idx_artworks_price_id (price, artwork_id),
+  DROP INDEX idx_artworks_price;
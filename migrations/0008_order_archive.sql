@@ -0,0 +1,32 @@
+-- Cold storage for old, completed orders (archive.py). Same columns as the
+-- hot tables; the orders.archive job moves rows across in batches.
+
+CREATE TABLE orders_archive (
+  order_id INT PRIMARY KEY,
+  user_id INT NOT NULL,
+  total_amount DECIMAL(10,2) NOT NULL,
+  status VARCHAR(50),
+  address TEXT,
+  delivery_date DATE,
+  payment_mode VARCHAR(30),
+  created_at TIMESTAMP NULL,
+  archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+  -- Same read paths as the hot table: profile history, admin listing sorts.
+  INDEX idx_orders_archive_user_created (user_id, created_at, order_id),
+  INDEX idx_orders_archive_created_id (created_at, order_id),
+  INDEX idx_orders_archive_status_created (status, created_at),
+  INDEX idx_orders_archive_total (total_amount)
+);
+
+CREATE TABLE order_items_archive (
+  order_item_id INT PRIMARY KEY,
+  order_id INT NOT NULL,
+  artwork_id INT NOT NULL,
+  quantity INT NOT NULL,
+  unit_price DECIMAL(10,2) NOT NULL,
+  FOREIGN KEY (order_id) REFERENCES orders_archive(order_id) ON DELETE CASCADE,
+  FOREIGN KEY (artwork_id) REFERENCES artworks(artwork_id) ON DELETE CASCADE,
+  INDEX idx_order_items_archive_order_cover (order_id, artwork_id, quantity, unit_price),
+  INDEX idx_order_items_archive_artwork_qty (artwork_id, quantity)
+);
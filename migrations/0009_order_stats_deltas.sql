@@ -0,0 +1,9 @@
+-- Checkout no longer updates the shared stats_totals('orders') and
+-- stats_revenue_daily rows (every concurrent checkout queued on their
+-- locks). It appends one row here instead; the rollups.fold_orders job
+-- adds them to the rollups and deletes them.
+CREATE TABLE stats_order_deltas (
+  delta_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  day DATE NOT NULL,
+  revenue DECIMAL(14,2) NOT NULL
+);
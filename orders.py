@@ -0,0 +1,316 @@
+"""Order queries shared by the profile, admin and checkout pages."""
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import click
+import mysql.connector
+from flask import current_app
+from flask.cli import with_appcontext
+from mysql.connector import Error
+
+import jobs
+import rollups
+from archive import order_tables
+from pagination import keyset_after, encode_cursor
+
+# Pending until the delivery date has passed, Completed afterwards. Moved
+# on by a scheduled job, so the pages that show statuses only read them.
+STATUS_TRANSITIONS = (
+    "UPDATE orders SET status = 'Completed' "
+    "WHERE status = 'Pending' AND delivery_date < CURDATE() LIMIT %s",
+    "UPDATE orders SET status = 'Pending' "
+    "WHERE status = 'Completed' AND delivery_date >= CURDATE() LIMIT %s",
+)
+STATUS_BATCH = 5000
+# Connections checkout-stress leaves free for the app and the admin.
+STRESS_HEADROOM = 10
+
+
+@jobs.job('orders.sync_statuses')
+def sync_statuses(conn, payload):
+    # Short batches so the row locks never block checkout for long.
+    cursor = conn.cursor()
+    changed = 0
+    for sql in STATUS_TRANSITIONS:
+        while True:
+            cursor.execute(sql, (STATUS_BATCH,))
+            conn.commit()
+            changed += cursor.rowcount
+            if cursor.rowcount < STATUS_BATCH:
+                break
+    cursor.close()
+    return changed
+
+
+def fetch_user_orders(cursor, user_id, before=None, limit=20, archived=False):
+    where, params = keyset_after('created_at', 'order_id', before)
+    cursor.execute(f'''
+        SELECT order_id, total_amount, status, delivery_date, created_at
+        FROM {order_tables(archived)[0]}
+        WHERE user_id = %s {'AND ' + where if where else ''}
+        ORDER BY created_at DESC, order_id DESC
+        LIMIT %s
+    ''', (user_id,) + params + (limit + 1,))
+    orders = cursor.fetchall()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1]['created_at'], orders[-1]['order_id'])
+    return orders, next_cursor
+
+
+def fetch_items_by_order(cursor, order_ids, archived=False):
+    # All items for a page of orders in one round trip, grouped in Python.
+    items = defaultdict(list)
+    if not order_ids:
+        return items
+    format_ids = ','.join(['%s'] * len(order_ids))
+    cursor.execute(f'''
+        SELECT oi.order_id, oi.artwork_id, oi.quantity, oi.unit_price,
+               a.title, a.image_filename
+        FROM {order_tables(archived)[1]} oi
+        JOIN artworks a ON oi.artwork_id = a.artwork_id
+        WHERE oi.order_id IN ({format_ids})
+    ''', tuple(order_ids))
+    for item in cursor.fetchall():
+        items[item['order_id']].append(item)
+    return items
+
+
+# -- checkout ----------------------------------------------------------------
+
+# ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT: the transaction was rolled back
+# (or can be) and is safe to run again from the top.
+RETRYABLE_ERRNOS = (1213, 1205)
+
+
+class OutOfStock(Exception):
+    def __init__(self, titles):
+        super().__init__(', '.join(titles))
+        self.titles = titles
+
+
+class InvalidQuantity(ValueError):
+    def __init__(self, artwork_ids):
+        super().__init__(', '.join(artwork_ids))
+        self.artwork_ids = artwork_ids
+
+
+def discount_for(total):
+    if total >= 10000:
+        return 15
+    if total >= 5000:
+        return 10
+    return 0
+
+
+def _place_order_once(conn, user_id, cart, address, delivery_date, payment_mode, cart_id):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Lock every artwork in the cart in one statement, in primary-key
+        # order so two overlapping carts always lock in the same sequence.
+        ids = sorted(int(i) for i in cart)
+        format_ids = ','.join(['%s'] * len(ids))
+        cursor.execute(f'''
+            SELECT artwork_id, title, price, available_qty
+            FROM artworks
+            WHERE artwork_id IN ({format_ids})
+            ORDER BY artwork_id
+            FOR UPDATE
+        ''', tuple(ids))
+        rows = cursor.fetchall()
+
+        found = {r['artwork_id'] for r in rows}
+        short = [r['title'] for r in rows if r['available_qty'] < cart[str(r['artwork_id'])]]
+        short += [f'#{i}' for i in ids if i not in found]
+        if short:
+            raise OutOfStock(short)
+
+        total = sum(float(r['price']) * cart[str(r['artwork_id'])] for r in rows)
+        discount_percentage = discount_for(total)
+        total_after_discount = total - total * discount_percentage / 100
+
+        cursor.execute('''
+            INSERT INTO orders (user_id, total_amount, address, delivery_date, payment_mode)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (user_id, total_after_discount, address, delivery_date, payment_mode))
+        order_id = cursor.lastrowid
+
+        # executemany() on an INSERT ... VALUES is sent as one multi-row insert.
+        cursor.executemany('''
+            INSERT INTO order_items (order_id, artwork_id, quantity, unit_price)
+            VALUES (%s, %s, %s, %s)
+        ''', [(order_id, r['artwork_id'], cart[str(r['artwork_id'])], r['price']) for r in rows])
+
+        # Stock and status in one statement; MySQL applies single-table SET
+        # clauses left to right, so status sees the decremented quantity.
+        cases = ' '.join(['WHEN %s THEN %s'] * len(rows))
+        params = [v for r in rows for v in (r['artwork_id'], cart[str(r['artwork_id'])])]
+        cursor.execute(f'''
+            UPDATE artworks
+            SET available_qty = available_qty - CASE artwork_id {cases} END,
+                status = IF(available_qty > 0, 'Available', 'Sold')
+            WHERE artwork_id IN ({format_ids})
+        ''', tuple(params) + tuple(ids))
+
+        rollups.on_order_placed(cursor, total_after_discount)
+        if cart_id is not None:
+            cursor.execute('DELETE FROM cart_items WHERE cart_id = %s', (cart_id,))
+        conn.commit()
+        return order_id, total_after_discount, discount_percentage
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def place_order(conn, user_id, cart, address, delivery_date, payment_mode, cart_id=None, retries=3):
+    # Returns (order_id, total, discount_percentage); raises OutOfStock if any
+    # line can't be fulfilled, leaving stock untouched. The stored cart, if
+    # given, is emptied in the same transaction as the order is placed.
+    # Raises InvalidQuantity for lines below 1.
+    cart = {str(k): int(v) for k, v in cart.items()}
+    # A zero or negative line would pass the stock check, put stock back
+    # and lower the total.
+    invalid = [k for k, v in cart.items() if v < 1]
+    if invalid:
+        raise InvalidQuantity(invalid)
+    attempt = 0
+    while True:
+        # Start from a clean snapshot; an earlier read on this pooled
+        # connection may have left a transaction open.
+        conn.rollback()
+        try:
+            return _place_order_once(conn, user_id, cart, address, delivery_date, payment_mode, cart_id)
+        except Error as e:
+            if e.errno not in RETRYABLE_ERRNOS or attempt >= retries:
+                raise
+            attempt += 1
+            time.sleep(0.02 * 2 ** attempt + random.random() * 0.02)
+
+
+def stress_checkout(connect_args, buyers, stock, echo=None):
+    """Fire ``buyers`` concurrent checkouts of one unit at a synthetic artwork
+    with ``stock`` units and report what happened.
+
+    Returns a dict with the buyer count actually used (capped to the free
+    connections of the server), the elapsed time, the outcomes and the sold
+    and remaining stock, plus ``problems``: empty when nothing oversold and
+    every buyer got to check out.
+    """
+    setup = mysql.connector.connect(**connect_args)
+    cursor = setup.cursor()
+    cursor.execute('SELECT user_id FROM users ORDER BY user_id LIMIT 1')
+    row = cursor.fetchone()
+    if row is None:
+        cursor.close()
+        setup.close()
+        raise ValueError('Need at least one user to place orders.')
+    user_id = row[0]
+    # Every buyer holds its own connection; stay inside max_connections
+    # (less those already open and a few for everyone else).
+    cursor.execute('SELECT @@max_connections')
+    max_connections = cursor.fetchone()[0]
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_connected'")
+    open_connections = cursor.fetchone()[1]
+    free = max(1, int(max_connections) - int(open_connections) - STRESS_HEADROOM)
+    if buyers > free:
+        if echo:
+            echo(f'{buyers} buyers capped to {free} (max_connections={max_connections})')
+        buyers = free
+    cursor.execute('INSERT INTO artworks (title, price, available_qty) VALUES (%s, %s, %s)',
+                   ('checkout-stress', 100, stock))
+    artwork_id = cursor.lastrowid
+    setup.commit()
+
+    outcomes = {'ok': 0, 'out_of_stock': 0, 'error': 0}
+    order_ids = []
+    lock = threading.Lock()
+    connected = threading.Semaphore(0)
+    go = threading.Event()
+
+    def buyer():
+        # Every buyer holds its own connection and waits at the gate, so all
+        # checkouts hit the row lock at the same moment.
+        order_id, result, conn = None, 'error', None
+        try:
+            conn = mysql.connector.connect(**connect_args)
+            connected.release()
+            go.wait()
+            order_id, _, _ = place_order(conn, user_id, {artwork_id: 1}, 'stress test',
+                                         date.today(), 'COD')
+            result = 'ok'
+        except OutOfStock:
+            result = 'out_of_stock'
+        except Error as e:
+            if conn is None:
+                connected.release()
+            if echo:
+                echo(f'checkout failed: {e}')
+        finally:
+            if conn is not None:
+                conn.close()
+        with lock:
+            outcomes[result] += 1
+            if order_id:
+                order_ids.append(order_id)
+
+    threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+    for t in threads:
+        t.start()
+    for _ in threads:
+        connected.acquire()
+    start = time.perf_counter()
+    go.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    cursor.execute('SELECT available_qty FROM artworks WHERE artwork_id = %s', (artwork_id,))
+    remaining = cursor.fetchone()[0]
+    cursor.execute('SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE artwork_id = %s', (artwork_id,))
+    sold = int(cursor.fetchone()[0])
+
+    # Clean up the synthetic artwork and the orders placed against it.
+    if order_ids:
+        format_ids = ','.join(['%s'] * len(order_ids))
+        cursor.execute(f'DELETE FROM orders WHERE order_id IN ({format_ids})', tuple(order_ids))
+    cursor.execute('DELETE FROM artworks WHERE artwork_id = %s', (artwork_id,))
+    setup.commit()
+    cursor.close()
+    # Every order also queued a dashboard delta; recount without the
+    # synthetic ones.
+    rollups.refresh_all(setup)
+    setup.close()
+
+    problems = []
+    if outcomes['error']:
+        problems.append(f"{outcomes['error']} buyers failed to check out")
+    if remaining < 0 or sold + remaining != stock or sold != outcomes['ok']:
+        problems.append('oversold or inconsistent stock')
+    if outcomes['ok'] != min(stock, buyers):
+        problems.append(f"{outcomes['ok']} checkouts succeeded, expected {min(stock, buyers)}")
+    return {'buyers': buyers, 'elapsed': elapsed, 'outcomes': outcomes, 'stock': stock,
+            'sold': sold, 'remaining': remaining, 'problems': problems}
+
+
+@click.command('checkout-stress')
+@click.option('--buyers', default=300, help='Number of simultaneous checkouts (capped to free DB connections).')
+@click.option('--stock', default=50, help='Units of the test artwork on sale.')
+@with_appcontext
+def checkout_stress_command(buyers, stock):
+    """Fire concurrent checkouts at one artwork and verify it never oversells."""
+    try:
+        result = stress_checkout(current_app.config['DB_CONNECT_ARGS'], buyers, stock,
+                                 echo=lambda message: click.echo(message, err=True))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{result['buyers']} buyers in {result['elapsed']:.2f}s: {result['outcomes']}")
+    click.echo(f"stock={result['stock']} sold={result['sold']} remaining={result['remaining']}")
+    if result['problems']:
+        raise click.ClickException('; '.join(result['problems']))
+    click.echo('OK: no oversell.')
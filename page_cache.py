@@ -0,0 +1,142 @@
+"""Whole-page HTML cache and conditional GETs for the public catalogue views.
+
+Entries are keyed by the catalogue cache generation of whatever the page
+shows, the request path + query string and the visitor's login state, so the
+invalidation hooks in the admin write routes retire cached pages too.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from flask import g, make_response, request, session
+
+import catalogue_cache
+from catalogue_cache import MemoryBackend, RedisBackend
+
+
+class PageCache:
+    def __init__(self, backend, ttl=300, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.not_modified = 0
+        self.render_time = 0.0
+        self.render_time_saved = 0.0
+
+    # -- steps of one cached request; cached_page() below and the async
+    # views in asgi.py both go through these ------------------------------------
+
+    def bypassed(self):
+        # Pending flash messages are rendered into the page, so those
+        # responses are personal and never cached.
+        if not self.enabled or '_flashes' in session:
+            self.bypasses += 1
+            return True
+        return False
+
+    def key(self, page_scope):
+        generation = catalogue_cache.get_cache().generation(page_scope)
+        return f'{page_scope}:{generation}:{login_state()}:{request.full_path}'
+
+    def lookup(self, key):
+        found, entry = self.backend.get(key)
+        if found:
+            self.hits += 1
+            self.render_time_saved += entry['render_time']
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, response, elapsed):
+        # Returns the new entry, or None when the response must not be cached.
+        self.render_time += elapsed
+        if response.status_code != 200 or session.modified:
+            return None
+        body = response.get_data()
+        entry = {
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': g.get('last_modified'),
+            'render_time': elapsed,
+        }
+        self.backend.set(key, entry, self.ttl)
+        return entry
+
+    def finish(self, response, entry):
+        response.set_etag(entry['etag'])
+        if entry['last_modified']:
+            response.last_modified = entry['last_modified']
+        # Always revalidate: the ETag makes that a cheap 304.
+        response.headers['Cache-Control'] = (
+            'private, no-cache' if session.get('user_id') or session.get('admin_id')
+            else 'public, no-cache')
+        response.vary.add('Cookie')
+        response.make_conditional(request)
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'not_modified': self.not_modified,
+            'render_time': round(self.render_time, 4),
+            'render_time_saved': round(self.render_time_saved, 4),
+            'evictions': self.backend.evictions,
+        }
+
+
+_cache = None
+
+
+def init_app(app):
+    global _cache
+    if app.config['CATALOGUE_CACHE_URL']:
+        backend = RedisBackend(app.config['CATALOGUE_CACHE_URL'], prefix='artvault:page:')
+    else:
+        backend = MemoryBackend(app.config['PAGE_CACHE_SIZE'])
+    _cache = PageCache(backend, ttl=app.config['PAGE_CACHE_TTL'],
+                       enabled=app.config['PAGE_CACHE_ENABLED'])
+
+
+def get_cache():
+    return _cache
+
+
+def login_state():
+    # The navbar differs per signed-in user (it shows the username), so
+    # signed-in pages are cached per user; anonymous visitors share one copy.
+    return f"u{session.get('user_id', '')}:a{1 if session.get('admin_id') else 0}"
+
+
+def cached_page(scope):
+    # scope(view_kwargs) -> catalogue cache generation scope the page depends
+    # on, e.g. 'listing' or 'artwork:<id>'.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            cache = _cache
+            if cache.bypassed():
+                return view(**kwargs)
+            key = cache.key(scope(kwargs))
+            entry = cache.lookup(key)
+            if entry is not None:
+                response = make_response(entry['body'])
+            else:
+                start = time.perf_counter()
+                response = make_response(view(**kwargs))
+                entry = cache.store(key, response, time.perf_counter() - start)
+                if entry is None:
+                    return response
+            return cache.finish(response, entry)
+        return wrapper
+    return decorator
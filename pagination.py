@@ -0,0 +1,58 @@
+"""Keyset (cursor) pagination helpers shared by the listing pages."""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+
+def encode_cursor(created_at, row_id):
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime('%Y%m%d%H%M%S%f')
+    return f'{created_at}-{row_id}'
+
+
+def decode_cursor(token):
+    # Returns (created_at, id) or None for a missing/garbled cursor, which
+    # simply restarts the listing from the first page.
+    if not token:
+        return None
+    try:
+        stamp, row_id = token.rsplit('-', 1)
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(row_id)
+    except ValueError:
+        return None
+
+
+def decode_sort_cursor(token, kind):
+    # Like decode_cursor for listings sortable on other columns; kind is
+    # 'datetime', 'int', 'decimal' or 'str'.
+    if kind == 'datetime':
+        return decode_cursor(token)
+    if not token or '-' not in token:
+        return None
+    value, row_id = token.rsplit('-', 1)
+    try:
+        if kind == 'int':
+            value = int(value)
+        elif kind == 'decimal':
+            value = Decimal(value)
+        return value, int(row_id)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def keyset_after(created_col, id_col, cursor, descending=True):
+    # Expanded form of (created_at, id) < (%s, %s) so MySQL can range-scan
+    # the composite index for a newest-first listing (> when ascending).
+    if cursor is None:
+        return '', ()
+    created_at, row_id = cursor
+    op = '<' if descending else '>'
+    sql = f'({created_col} {op} %s OR ({created_col} = %s AND {id_col} {op} %s))'
+    return sql, (created_at, created_at, row_id)
+
+
+def page_size(value, default, maximum=100):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
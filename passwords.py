@@ -0,0 +1,247 @@
+"""Password hashing off the request threads, with sign-in throttling.
+
+scrypt is slow on purpose and holds the GIL for the whole hash, so a burst
+of sign-ins on a threaded worker stalls every other request it serves.
+Hashes and checks run in a small process pool instead. At most
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE of them are in flight per
+server worker; past that a request waits PASSWORD_HASH_WAIT seconds for a
+slot and then gets a 503 (HashingBusy) instead of queueing without bound.
+
+Failed sign-ins are counted per account and per client address and
+refused before any hashing once LOGIN_MAX_FAILURES / LOGIN_MAX_IP_FAILURES
+is reached within LOGIN_FAILURE_WINDOW seconds. Registrations are limited
+separately, to REGISTER_MAX_PER_IP per client address per window. The
+counters have their own store (Redis at THROTTLE_STORE_URL, shared between
+workers, or an in-process dict), so catalogue cache evictions and clears
+never reset them. Behind a proxy, set TRUSTED_PROXY_HOPS so the client
+address is the visitor's, not the proxy's.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import request
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+import instrumentation
+from catalogue_cache import MemoryBackend, RedisBackend
+
+THROTTLE_ENTRIES = 100000
+
+_executor = None
+_throttle_store = None
+_slots = None
+_lock = threading.Lock()
+_config = {}
+_stats = {'in_flight': 0, 'rejected': 0, 'throttled': 0, 'rehashed': 0}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def init_app(app):
+    global _slots, _throttle_store
+    _config.update(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        full_method=_full_method(app.config['PASSWORD_HASH_METHOD']),
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue=app.config['PASSWORD_HASH_QUEUE'],
+        wait=app.config['PASSWORD_HASH_WAIT'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+        max_failures=app.config['LOGIN_MAX_FAILURES'],
+        max_ip_failures=app.config['LOGIN_MAX_IP_FAILURES'],
+        window=app.config['LOGIN_FAILURE_WINDOW'],
+        max_signups=app.config['REGISTER_MAX_PER_IP'],
+    )
+    if app.config['THROTTLE_STORE_URL']:
+        _throttle_store = RedisBackend(app.config['THROTTLE_STORE_URL'], prefix='artvault:throttle:')
+    else:
+        _throttle_store = MemoryBackend(THROTTLE_ENTRIES)
+    _slots = threading.BoundedSemaphore(_config['workers'] + _config['queue'])
+    app.register_error_handler(HashingBusy, _busy_response)
+    instrumentation.register_collector(collector)
+
+
+def _busy_response(e):
+    return ('Too many sign-ins are being processed right now. Please try again in a moment.',
+            503, {'Retry-After': '2'})
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: forking a threaded server worker could copy held locks.
+            _executor = ProcessPoolExecutor(max_workers=_config['workers'],
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def reset_after_fork():
+    # The pool's processes and management thread belong to the parent.
+    global _executor, _slots
+    _executor = None
+    _slots = threading.BoundedSemaphore(_config['workers'] + _config['queue'])
+    _stats['in_flight'] = 0
+
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+# -- hashing ------------------------------------------------------------------------
+
+def _timed_hash(password, method):
+    start = time.perf_counter()
+    return generate_password_hash(password, method=method), time.perf_counter() - start
+
+
+def _timed_check(stored, password):
+    start = time.perf_counter()
+    return check_password_hash(stored, password), time.perf_counter() - start
+
+
+def _release(future):
+    with _lock:
+        _stats['in_flight'] -= 1
+    _slots.release()
+
+
+def _run(operation, fn, *args):
+    global _executor
+    start = time.perf_counter()
+    if not _slots.acquire(timeout=_config['wait']):
+        with _lock:
+            _stats['rejected'] += 1
+        raise HashingBusy()
+    with _lock:
+        _stats['in_flight'] += 1
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BaseException:
+        _release(None)
+        raise
+    # The slot is held until the hash really finishes, even if we stop waiting.
+    future.add_done_callback(_release)
+    try:
+        result, elapsed = future.result(timeout=_config['timeout'])
+    except TimeoutError:
+        raise HashingBusy()
+    except BrokenProcessPool:
+        with _lock:
+            _executor = None
+        raise HashingBusy()
+    registry = instrumentation.registry
+    registry.histogram('artvault_password_hash_seconds',
+                       'CPU time of one password hash or check.', 'operation')[operation].observe(elapsed)
+    registry.histogram('artvault_password_queue_wait_seconds',
+                       'Time a hash or check waited for the pool.', 'operation')[operation].observe(
+        max(0.0, time.perf_counter() - start - elapsed))
+    return result
+
+
+def hash_password(password):
+    return _run('hash', _timed_hash, password, _config['method'])
+
+
+def verify_password(stored, password):
+    return _run('check', _timed_check, stored, password)
+
+
+def _full_method(method):
+    # Werkzeug's spelling of a method with every parameter filled in, as it
+    # writes it in front of a hash: "pbkdf2:sha256" -> "pbkdf2:sha256:600000".
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = [int(a) for a in args] + [2 ** 15, 8, 1][len(args):]
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+
+def needs_rehash(stored):
+    # Werkzeug stores "<method>$<salt>$<hash>"; anything hashed with other
+    # parameters than PASSWORD_HASH_METHOD is upgraded at the next sign-in.
+    return _full_method(stored.split('$', 1)[0]) != _config['full_method']
+
+
+def rehash_if_needed(cursor, table, id_column, row_id, stored, password):
+    if not needs_rehash(stored):
+        return False
+    try:
+        hashed = hash_password(password)
+    except HashingBusy:
+        # The password was already checked; upgrade at the next sign-in.
+        return False
+    cursor.execute(f'UPDATE {table} SET password = %s WHERE {id_column} = %s',
+                   (hashed, row_id))
+    with _lock:
+        _stats['rehashed'] += 1
+    return True
+
+
+# -- throttling ---------------------------------------------------------------------
+
+def _throttle_keys(scope, username):
+    return ((f'signin:{scope}:user:{username.strip().lower()}', _config['max_failures']),
+            (f'signin:{scope}:ip:{request.remote_addr}', _config['max_ip_failures']))
+
+
+def throttled(scope, username):
+    backend = _throttle_store
+    for key, limit in _throttle_keys(scope, username):
+        found, failures = backend.get(key)
+        if found and failures >= limit:
+            with _lock:
+                _stats['throttled'] += 1
+            return True
+    return False
+
+
+def record_failure(scope, username):
+    # Read-modify-write: concurrent failures can undercount by a few, which
+    # is fine for a throttle. Each failure restarts the window.
+    backend = _throttle_store
+    for key, _ in _throttle_keys(scope, username):
+        found, failures = backend.get(key)
+        backend.set(key, (failures if found else 0) + 1, ttl=_config['window'])
+
+
+def clear_failures(scope, username):
+    _throttle_store.delete(_throttle_keys(scope, username)[0][0])
+
+
+def signup_allowed():
+    # Counts every registration attempt from the client address; unlike
+    # the sign-in counters this is a rate, not a failure count.
+    key = f'signup:ip:{request.remote_addr}'
+    found, count = _throttle_store.get(key)
+    if found and count >= _config['max_signups']:
+        with _lock:
+            _stats['throttled'] += 1
+        return False
+    _throttle_store.set(key, (count if found else 0) + 1, ttl=_config['window'])
+    return True
+
+
+def collector():
+    yield ('artvault_password_hash_in_flight', 'gauge',
+           'Password hashes running or queued in this worker.', [({}, _stats['in_flight'])])
+    yield ('artvault_password_hash_capacity', 'gauge',
+           'Most hashes allowed in flight per worker.',
+           [({}, _config['workers'] + _config['queue'])])
+    yield ('artvault_password_hash_rejected_total', 'counter',
+           'Sign-ins refused with 503 because the hash pool was full.', [({}, _stats['rejected'])])
+    yield ('artvault_signin_throttled_total', 'counter',
+           'Sign-in attempts refused by the failure throttle.', [({}, _stats['throttled'])])
+    yield ('artvault_password_rehashed_total', 'counter',
+           'Stored hashes upgraded to the current parameters at sign-in.', [({}, _stats['rehashed'])])
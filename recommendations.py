@@ -0,0 +1,292 @@
+"""Precomputed "related artworks" for the detail page.
+
+Each artwork gets up to RELATED_TOP_K neighbours in ``artwork_related``:
+first the artworks most often bought in the same order, then other
+available works by the same artist, then the nearest prices. The page reads
+them with one primary-key range lookup (fetch_related).
+
+``refresh`` is incremental. Order lines past the ``copurchase_order_id``
+watermark are folded into ``artwork_copurchase`` with one grouped self-join
+per chunk of orders, and only artworks with new co-purchases or edits since
+the last run get their list rebuilt. Other artworks' artist/price
+neighbours pick up new or changed works on the full rebuild (``--full``,
+daily by default).
+
+    flask recommendations refresh [--full]
+"""
+import bisect
+import time
+from array import array
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+
+import db_pool
+import jobs
+
+ORDER_CHUNK = 20000
+LIST_CHUNK = 1000
+# Orders younger than this may still be committing with a lower order_id
+# than one already visible, so the watermark stays behind them.
+SETTLE_SECONDS = 60
+REFRESH_LOCK = 'artvault:recommendations_refresh'
+
+RELATED_SQL = '''
+    SELECT r.reason, a.artwork_id, a.title, a.price, a.image_filename, a.image_variants,
+           ar.name AS artist_name
+    FROM artwork_related r
+    JOIN artworks a ON a.artwork_id = r.related_id
+    LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+    WHERE r.artwork_id = %s AND a.available_qty > 0
+    ORDER BY r.rank_no
+'''
+
+_config = {'top_k': 8}
+
+
+def init_app(app):
+    _config['top_k'] = app.config['RELATED_TOP_K']
+
+
+def fetch_related(cursor, artwork_id):
+    cursor.execute(RELATED_SQL, (artwork_id,))
+    return cursor.fetchall()
+
+
+def _get_state(cursor, name):
+    cursor.execute('SELECT value FROM recommendation_state WHERE name = %s', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _set_state(cursor, name, value):
+    cursor.execute('''
+        INSERT INTO recommendation_state (name, value) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE value = VALUES(value)
+    ''', (name, str(value)))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# -- co-purchase counts ----------------------------------------------------------
+
+def fold_orders(conn, echo=None):
+    # Adds the pairs of every settled order past the watermark; returns the
+    # artworks whose partners changed.
+    cursor = conn.cursor()
+    start = int(_get_state(cursor, 'copurchase_order_id') or 0)
+    # The fold covers an order_id range, so the watermark is an order_id
+    # too; created_at need not follow the ids (seeded data does not).
+    # Scanning from the last watermark keeps this a short primary-key range.
+    cursor.execute('''
+        SELECT MAX(order_id) FROM orders
+        WHERE order_id > %s AND created_at < NOW() - INTERVAL %s SECOND
+    ''', (start, SETTLE_SECONDS))
+    row = cursor.fetchone()
+    end = row[0] if row and row[0] is not None else start
+
+    touched = set()
+    while start < end:
+        upto = min(start + ORDER_CHUNK, end)
+        cursor.execute('''
+            INSERT INTO artwork_copurchase (artwork_id, other_id, orders)
+            SELECT artwork_id, other_id, n FROM (
+                SELECT a.artwork_id, b.artwork_id AS other_id, COUNT(DISTINCT a.order_id) AS n
+                FROM order_items a
+                JOIN order_items b ON b.order_id = a.order_id AND b.artwork_id <> a.artwork_id
+                WHERE a.order_id > %s AND a.order_id <= %s
+                GROUP BY a.artwork_id, b.artwork_id
+            ) pairs
+            ON DUPLICATE KEY UPDATE orders = orders + pairs.n
+        ''', (start, upto))
+        if cursor.rowcount:
+            cursor.execute('''
+                SELECT DISTINCT artwork_id FROM order_items
+                WHERE order_id > %s AND order_id <= %s
+            ''', (start, upto))
+            touched.update(artwork_id for (artwork_id,) in cursor.fetchall())
+        _set_state(cursor, 'copurchase_order_id', upto)
+        conn.commit()
+        if echo:
+            echo(f'  co-purchases folded up to order {upto}')
+        start = upto
+    cursor.close()
+    return touched
+
+
+# -- top-K lists ------------------------------------------------------------------
+
+class CatalogueIndex:
+    # The available catalogue as flat arrays sorted by price (nearest-price
+    # lookups are a bisect) plus each artist's works, newest first. About
+    # 16 bytes per artwork, so a million artworks fit comfortably.
+
+    def __init__(self, cursor):
+        cursor.execute('''
+            SELECT artwork_id, artist_id, price FROM artworks
+            WHERE available_qty > 0
+            ORDER BY price, artwork_id
+        ''')
+        self.ids = array('i')
+        self.prices = array('d')
+        by_artist = defaultdict(lambda: array('i'))
+        for artwork_id, artist_id, price in cursor:
+            self.ids.append(artwork_id)
+            self.prices.append(float(price))
+            if artist_id is not None:
+                by_artist[artist_id].append(artwork_id)
+        self.by_artist = {artist_id: sorted(ids, reverse=True) for artist_id, ids in by_artist.items()}
+
+    def related(self, artwork_id, artist_id, price, bought, k):
+        picked = []
+        seen = {artwork_id}
+
+        def add(other, reason):
+            if other not in seen:
+                seen.add(other)
+                picked.append((other, reason))
+
+        for other in bought:
+            add(other, 'bought')
+        artist_limit = len(picked) + max(1, (k - len(picked)) // 2)
+        for other in self.by_artist.get(artist_id, ()):
+            if len(picked) >= min(k, artist_limit):
+                break
+            add(other, 'artist')
+
+        # Walk outwards from the artwork's own price.
+        prices, ids = self.prices, self.ids
+        price = float(price)
+        hi = bisect.bisect_left(prices, price)
+        lo = hi - 1
+        while len(picked) < k and (lo >= 0 or hi < len(ids)):
+            if hi >= len(ids) or (lo >= 0 and price - prices[lo] <= prices[hi] - price):
+                other, lo = ids[lo], lo - 1
+            else:
+                other, hi = ids[hi], hi + 1
+            add(other, 'price')
+        return picked[:k]
+
+
+def build_lists(conn, index, artwork_ids, k):
+    cursor = conn.cursor()
+    format_ids = ','.join(['%s'] * len(artwork_ids))
+    cursor.execute(f'SELECT artwork_id, artist_id, price FROM artworks WHERE artwork_id IN ({format_ids})',
+                   tuple(artwork_ids))
+    targets = cursor.fetchall()
+    cursor.execute(f'''
+        SELECT artwork_id, other_id FROM (
+            SELECT c.artwork_id, c.other_id,
+                   ROW_NUMBER() OVER (PARTITION BY c.artwork_id
+                                      ORDER BY c.orders DESC, c.other_id DESC) AS rn
+            FROM artwork_copurchase c
+            JOIN artworks a ON a.artwork_id = c.other_id AND a.available_qty > 0
+            WHERE c.artwork_id IN ({format_ids})
+        ) ranked
+        WHERE rn <= %s
+        ORDER BY artwork_id, rn
+    ''', (*artwork_ids, k))
+    bought = defaultdict(list)
+    for artwork_id, other_id in cursor.fetchall():
+        bought[artwork_id].append(other_id)
+
+    rows = []
+    for artwork_id, artist_id, price in targets:
+        for rank_no, (related_id, reason) in enumerate(
+                index.related(artwork_id, artist_id, price, bought[artwork_id], k)):
+            rows.append((artwork_id, rank_no, related_id, reason))
+    cursor.execute(f'DELETE FROM artwork_related WHERE artwork_id IN ({format_ids})', tuple(artwork_ids))
+    if rows:
+        cursor.executemany('''
+            INSERT INTO artwork_related (artwork_id, rank_no, related_id, reason)
+            VALUES (%s, %s, %s, %s)
+        ''', rows)
+    conn.commit()
+    cursor.close()
+    return len(rows)
+
+
+def refresh(conn, full=False, echo=None):
+    # Two runs at once (schedule plus a manual rebuild, a requeued job) would
+    # fold the same orders twice and double the co-purchase counts, so a
+    # run that cannot take the lock right away is skipped.
+    cursor = conn.cursor()
+    cursor.execute('SELECT GET_LOCK(%s, 0)', (REFRESH_LOCK,))
+    locked = cursor.fetchone()[0] == 1
+    cursor.close()
+    if not locked:
+        if echo:
+            echo('another recommendations refresh is running; skipped')
+        return 0
+    try:
+        return _refresh(conn, full, echo)
+    finally:
+        cursor = conn.cursor()
+        cursor.execute('SELECT RELEASE_LOCK(%s)', (REFRESH_LOCK,))
+        cursor.fetchall()
+        cursor.close()
+
+
+def _refresh(conn, full, echo):
+    start = time.perf_counter()
+    touched = fold_orders(conn, echo)
+    cursor = conn.cursor()
+    cursor.execute('SELECT NOW()')
+    started_at = cursor.fetchone()[0]
+    since = _get_state(cursor, 'lists_built_at')
+    if full or since is None:
+        cursor.execute('SELECT artwork_id FROM artworks')
+        targets = [artwork_id for (artwork_id,) in cursor.fetchall()]
+        cursor.execute('''
+            DELETE r FROM artwork_related r
+            LEFT JOIN artworks a ON a.artwork_id = r.artwork_id
+            WHERE a.artwork_id IS NULL
+        ''')
+    else:
+        cursor.execute('SELECT artwork_id FROM artworks WHERE updated_at >= %s', (since,))
+        touched.update(artwork_id for (artwork_id,) in cursor.fetchall())
+        targets = sorted(touched)
+    conn.commit()
+
+    written = 0
+    if targets:
+        index = CatalogueIndex(cursor)
+        for chunk in _chunks(targets, LIST_CHUNK):
+            written += build_lists(conn, index, chunk, _config['top_k'])
+    _set_state(cursor, 'lists_built_at', started_at)
+    conn.commit()
+    cursor.close()
+    if echo:
+        echo(f'{len(targets)} related lists ({written} rows) rebuilt in {time.perf_counter() - start:.1f}s')
+    return len(targets)
+
+
+@jobs.job('recommendations.refresh')
+def refresh_job(conn, payload):
+    refresh(conn, full=payload.get('full', False))
+
+
+@jobs.job('recommendations.rebuild')
+def rebuild_job(conn, payload):
+    refresh(conn, full=True)
+
+
+@click.group('recommendations')
+def recommendations_cli():
+    """Related-artwork index."""
+
+
+@recommendations_cli.command('refresh')
+@click.option('--full', is_flag=True, help='Rebuild every artwork\'s list, not just the changed ones.')
+@with_appcontext
+def refresh_command(full):
+    """Fold new orders into the co-purchase counts and rebuild related lists."""
+    conn = db_pool.get_pool().acquire()
+    try:
+        refresh(conn, full=full, echo=click.echo)
+    finally:
+        conn.release()
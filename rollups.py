@@ -0,0 +1,331 @@
+"""Precomputed dashboard numbers for /analytics and /admin/manage.
+
+The write paths keep the counters current incrementally (same transaction as
+the write itself); `flask rollups refresh` recomputes everything from the base
+tables and heals any drift, and is meant to run periodically. Checkout is the
+exception: it only appends to stats_order_deltas, and the rollups.fold_orders
+job (every JOB_ROLLUPS_FOLD_EVERY seconds) moves those into the order count
+and daily revenue, so concurrent checkouts never wait on a shared counter row.
+"""
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+import db_pool
+import jobs
+
+TOP_N = 5
+
+# Same boundaries as the old CASE expression in analytics(): BETWEEN is
+# inclusive, so 5000 falls in the lower band and 10000 in the middle one.
+PRICE_BUCKETS = ['Below ₹1000', '₹1000 - ₹5000', '₹5000 - ₹10000', 'Above ₹10000']
+
+PRICE_BUCKET_SQL = '''
+    CASE
+        WHEN price < 1000 THEN 'Below ₹1000'
+        WHEN price BETWEEN 1000 AND 5000 THEN '₹1000 - ₹5000'
+        WHEN price BETWEEN 5000 AND 10000 THEN '₹5000 - ₹10000'
+        ELSE 'Above ₹10000'
+    END
+'''
+
+TOP_LIST_SQL = {
+    'expensive': '''
+        SELECT artwork_id, title, price, image_filename, price AS metric
+        FROM artworks ORDER BY price DESC LIMIT %s
+    ''',
+    'recent': '''
+        SELECT artwork_id, title, price, image_filename, UNIX_TIMESTAMP(created_at) AS metric
+        FROM artworks ORDER BY created_at DESC, artwork_id DESC LIMIT %s
+    ''',
+    'best_selling': '''
+        SELECT a.artwork_id, a.title, a.price, a.image_filename, s.sold AS metric
+        FROM (SELECT artwork_id, SUM(quantity) AS sold
+              FROM (SELECT artwork_id, quantity FROM order_items
+                    UNION ALL
+                    SELECT artwork_id, quantity FROM order_items_archive) oi
+              GROUP BY artwork_id
+              ORDER BY sold DESC LIMIT %s) s
+        JOIN artworks a ON a.artwork_id = s.artwork_id
+        ORDER BY s.sold DESC
+    ''',
+}
+
+
+def price_bucket(price):
+    price = float(price)
+    if price < 1000:
+        return PRICE_BUCKETS[0]
+    if price <= 5000:
+        return PRICE_BUCKETS[1]
+    if price <= 10000:
+        return PRICE_BUCKETS[2]
+    return PRICE_BUCKETS[3]
+
+
+# -- incremental hooks (run inside the caller's transaction) -----------------
+
+def bump_total(cursor, name, delta):
+    cursor.execute('''
+        INSERT INTO stats_totals (name, value, updated_at) VALUES (%s, %s, NOW())
+        ON DUPLICATE KEY UPDATE value = value + VALUES(value), updated_at = NOW()
+    ''', (name, delta))
+
+
+def on_user_created(cursor):
+    bump_total(cursor, 'users', 1)
+
+
+def on_artwork_added(cursor, price):
+    bump_total(cursor, 'artworks', 1)
+    _bump_bucket(cursor, price, 1)
+    refresh_top_lists(cursor, ('expensive', 'recent'))
+
+
+def on_artworks_imported(cursor, prices):
+    # One bump per bucket and one top-list refresh for a whole import batch.
+    if not prices:
+        return
+    bump_total(cursor, 'artworks', len(prices))
+    per_bucket = Counter(price_bucket(price) for price in prices)
+    for bucket, count in per_bucket.items():
+        _bump_named_bucket(cursor, bucket, count)
+    refresh_top_lists(cursor, ('expensive', 'recent'))
+
+
+def on_artwork_deleted(cursor, artwork_id, price):
+    bump_total(cursor, 'artworks', -1)
+    _bump_bucket(cursor, price, -1)
+    refresh_top_lists(cursor, ('expensive', 'recent'))
+    # best_selling aggregates every order line, too much for a write path:
+    # drop the artwork now and let the refresh job recompute the list.
+    cursor.execute(
+        "DELETE FROM stats_top_artworks WHERE list_name = 'best_selling' AND artwork_id = %s",
+        (artwork_id,))
+
+
+def on_order_placed(cursor, total_amount):
+    # A new row, not an update of a shared one: nothing for other checkouts
+    # to queue on. fold_orders() adds it to the rollups.
+    cursor.execute('INSERT INTO stats_order_deltas (day, revenue) VALUES (CURDATE(), %s)',
+                   (total_amount,))
+
+
+def _take_order_deltas(cursor):
+    # Locks the committed deltas; ones still being inserted by an open
+    # checkout are skipped and left for the next fold.
+    cursor.execute('SELECT delta_id, day, revenue FROM stats_order_deltas FOR UPDATE SKIP LOCKED')
+    return cursor.fetchall()
+
+
+def _delete_order_deltas(cursor, rows):
+    for i in range(0, len(rows), 1000):
+        chunk = [r['delta_id'] for r in rows[i:i + 1000]]
+        cursor.execute(f"DELETE FROM stats_order_deltas WHERE delta_id IN ({','.join(['%s'] * len(chunk))})",
+                       tuple(chunk))
+
+
+def fold_orders(conn):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        rows = _take_order_deltas(cursor)
+        if rows:
+            per_day = {}
+            for r in rows:
+                count, revenue = per_day.get(r['day'], (0, 0))
+                per_day[r['day']] = (count + 1, revenue + r['revenue'])
+            bump_total(cursor, 'orders', len(rows))
+            cursor.executemany('''
+                INSERT INTO stats_revenue_daily (day, order_count, revenue, updated_at)
+                VALUES (%s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                                        revenue = revenue + VALUES(revenue),
+                                        updated_at = NOW()
+            ''', [(day, count, revenue) for day, (count, revenue) in sorted(per_day.items())])
+            _delete_order_deltas(cursor, rows)
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _bump_bucket(cursor, price, delta):
+    _bump_named_bucket(cursor, price_bucket(price), delta)
+
+
+def _bump_named_bucket(cursor, bucket, delta):
+    cursor.execute('''
+        INSERT INTO stats_price_buckets (price_range, sort_order, artwork_count, updated_at)
+        VALUES (%s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE artwork_count = artwork_count + VALUES(artwork_count),
+                                updated_at = NOW()
+    ''', (bucket, PRICE_BUCKETS.index(bucket), delta))
+
+
+def refresh_top_lists(cursor, lists=tuple(TOP_LIST_SQL)):
+    # expensive and recent are LIMIT queries over an index, cheap enough to
+    # redo on write; best_selling is left to the refresh job.
+    for name in lists:
+        cursor.execute(TOP_LIST_SQL[name], (TOP_N,))
+        rows = cursor.fetchall()
+        cursor.execute('DELETE FROM stats_top_artworks WHERE list_name = %s', (name,))
+        if rows:
+            cursor.executemany('''
+                INSERT INTO stats_top_artworks
+                    (list_name, position, artwork_id, title, price, image_filename, metric, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+            ''', [(name, pos, r['artwork_id'], r['title'], r['price'], r['image_filename'], r['metric'])
+                  for pos, r in enumerate(rows, 1)])
+
+
+# -- full refresh --------------------------------------------------------------
+
+def refresh_all(conn):
+    # Recomputes every rollup from the base tables in one transaction. An
+    # increment that commits while this runs can be overwritten; the next
+    # refresh picks it up again. The aggregates are plain SELECTs, which do
+    # not lock what they scan (INSERT ... SELECT would, and checkout would
+    # wait on it); only the rollup rows are written.
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # The recount below includes the orders behind these deltas.
+        deltas = _take_order_deltas(cursor)
+        # Archived orders (archive.py) still count towards the totals.
+        totals = []
+        for name, table in (('users', 'users'),
+                            ('orders', '(SELECT order_id FROM orders UNION ALL '
+                                       'SELECT order_id FROM orders_archive) o'),
+                            ('artworks', 'artworks')):
+            cursor.execute(f'SELECT COUNT(*) AS value FROM {table}')
+            totals.append((name, cursor.fetchone()['value']))
+        cursor.executemany('''
+            INSERT INTO stats_totals (name, value, updated_at) VALUES (%s, %s, NOW())
+            ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = NOW()
+        ''', totals)
+
+        cursor.execute(f'''
+            SELECT {PRICE_BUCKET_SQL} AS price_range, COUNT(*) AS artwork_count
+            FROM artworks GROUP BY price_range
+        ''')
+        counts = {r['price_range']: r['artwork_count'] for r in cursor.fetchall()}
+        cursor.executemany('''
+            INSERT INTO stats_price_buckets (price_range, sort_order, artwork_count, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE artwork_count = VALUES(artwork_count), updated_at = NOW()
+        ''', [(bucket, pos, counts.get(bucket, 0)) for pos, bucket in enumerate(PRICE_BUCKETS)])
+
+        cursor.execute('''
+            SELECT DATE(created_at) AS day, COUNT(*) AS order_count, SUM(total_amount) AS revenue
+            FROM (SELECT created_at, total_amount FROM orders
+                  UNION ALL
+                  SELECT created_at, total_amount FROM orders_archive) o
+            GROUP BY DATE(created_at)
+        ''')
+        revenue = [(r['day'], r['order_count'], r['revenue']) for r in cursor.fetchall()]
+        cursor.execute('DELETE FROM stats_revenue_daily')
+        if revenue:
+            cursor.executemany('''
+                INSERT INTO stats_revenue_daily (day, order_count, revenue, updated_at)
+                VALUES (%s, %s, %s, NOW())
+            ''', revenue)
+
+        refresh_top_lists(cursor)
+        _delete_order_deltas(cursor, deltas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# -- readers ---------------------------------------------------------------------
+
+@jobs.job('rollups.refresh')
+def refresh_job(conn, payload):
+    refresh_all(conn)
+
+
+@jobs.job('rollups.fold_orders')
+def fold_orders_job(conn, payload):
+    fold_orders(conn)
+
+
+def read_totals(cursor):
+    cursor.execute('SELECT name, value, updated_at FROM stats_totals')
+    rows = cursor.fetchall()
+    totals = {r['name']: r['value'] for r in rows}
+    freshness = max((r['updated_at'] for r in rows), default=None)
+    return totals, freshness
+
+
+def analytics_queries(revenue_days=30):
+    # The three reads behind /analytics, as (sql, params). They are
+    # independent, so the async views run them concurrently.
+    return (
+        ('''
+            SELECT price_range, artwork_count AS count, updated_at
+            FROM stats_price_buckets ORDER BY sort_order
+        ''', ()),
+        ('''
+            SELECT list_name, artwork_id, title, price, image_filename, metric, updated_at
+            FROM stats_top_artworks ORDER BY list_name, position
+        ''', ()),
+        ('''
+            SELECT day, order_count, revenue
+            FROM stats_revenue_daily
+            WHERE day >= %s ORDER BY day
+        ''', (date.today() - timedelta(days=revenue_days),)),
+    )
+
+
+def assemble_analytics(price_data, top_rows, revenue):
+    top_lists = {name: [] for name in TOP_LIST_SQL}
+    for row in top_rows:
+        top_lists[row['list_name']].append(row)
+    stamps = [r['updated_at'] for r in list(price_data) + list(top_rows)]
+    return {
+        'price_data': price_data,
+        'expensive_artworks': top_lists['expensive'],
+        'recent_artworks': top_lists['recent'],
+        'best_selling': top_lists['best_selling'],
+        'revenue_daily': revenue,
+        'updated_at': max(stamps, default=None),
+    }
+
+
+def read_analytics(cursor, revenue_days=30):
+    results = []
+    for sql, params in analytics_queries(revenue_days):
+        cursor.execute(sql, params)
+        results.append(cursor.fetchall())
+    return assemble_analytics(*results)
+
+
+@click.group('rollups')
+def rollups_cli():
+    """Dashboard rollup maintenance."""
+
+
+@rollups_cli.command('refresh')
+@click.option('--every', type=int, default=0, help='Keep running, refreshing every N seconds.')
+@with_appcontext
+def refresh_command(every):
+    """Recompute all dashboard rollups from the base tables."""
+    while True:
+        start = time.perf_counter()
+        conn = db_pool.get_pool().acquire()
+        try:
+            refresh_all(conn)
+        finally:
+            conn.release()
+        click.echo(f'Rollups refreshed in {time.perf_counter() - start:.2f}s')
+        if not every:
+            break
+        time.sleep(every)
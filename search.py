@@ -0,0 +1,116 @@
+"""Artwork search backed by the FULLTEXT indexes on artworks and artists."""
+import re
+import threading
+
+from catalogue import CARD_COLUMNS
+
+MAX_TERMS = 8
+
+_schema = None
+_schema_lock = threading.Lock()
+
+
+SCHEMA_QUERIES = (
+    'SHOW COLUMNS FROM artworks',
+    "SHOW INDEX FROM artworks WHERE Index_type = 'FULLTEXT'",
+    "SHOW INDEX FROM artists WHERE Index_type = 'FULLTEXT'",
+)
+
+
+def probe_schema(cursor):
+    # Column/index introspection is done once per process and reused; the
+    # schema only changes with a deploy.
+    if _schema is not None:
+        return _schema
+    with _schema_lock:
+        if _schema is None:
+            results = []
+            for sql in SCHEMA_QUERIES:
+                cursor.execute(sql)
+                results.append(cursor.fetchall())
+            remember_schema(*results)
+    return _schema
+
+
+def cached_schema():
+    return _schema
+
+
+def remember_schema(column_rows, artwork_ft_rows, artist_ft_rows):
+    # Takes the rows of SCHEMA_QUERIES, in order.
+    global _schema
+    artwork_ft = {row['Column_name'] for row in artwork_ft_rows}
+    artist_ft = {row['Column_name'] for row in artist_ft_rows}
+    _schema = {
+        'columns': {col['Field'] for col in column_rows},
+        'fulltext': {'title', 'description'} <= artwork_ft and 'name' in artist_ft,
+    }
+    return _schema
+
+
+def boolean_query(text):
+    # "sun gang" -> "sun* gang*": every word is a prefix match, operators typed
+    # by the user are dropped so they can't change the query semantics.
+    terms = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    return ' '.join(f'{term}*' for term in terms)
+
+
+def search_query(schema, text, page=1, per_page=24):
+    # (sql, params), or None when the text has no searchable words.
+    offset = (page - 1) * per_page
+    if schema['fulltext']:
+        terms = boolean_query(text)
+        if not terms:
+            return None
+        # Title/description hits rank above artist-name hits. Each branch
+        # of the UNION is a lookup on its own FULLTEXT index (a MATCH under
+        # an OR could use neither and scanned artworks); the artist branch
+        # reaches artworks through idx_artworks_artist_created. Only the
+        # matching ids are joined back for the card columns.
+        sql = f'''
+            SELECT {CARD_COLUMNS}, hits.score
+            FROM (
+                SELECT artwork_id, SUM(score) AS score FROM (
+                    SELECT artwork_id,
+                           MATCH(title, description) AGAINST (%s IN BOOLEAN MODE) * 2 AS score
+                    FROM artworks
+                    WHERE MATCH(title, description) AGAINST (%s IN BOOLEAN MODE)
+                    UNION ALL
+                    SELECT aw.artwork_id, MATCH(an.name) AGAINST (%s IN BOOLEAN MODE) AS score
+                    FROM artists an
+                    JOIN artworks aw ON aw.artist_id = an.artist_id
+                    WHERE MATCH(an.name) AGAINST (%s IN BOOLEAN MODE)
+                ) matches
+                GROUP BY artwork_id
+            ) hits
+            JOIN artworks a ON a.artwork_id = hits.artwork_id
+            LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+            ORDER BY hits.score DESC, a.artwork_id DESC
+            LIMIT %s OFFSET %s
+        '''
+        params = (terms, terms, terms, terms, per_page + 1, offset)
+    else:
+        # Schema without the FULLTEXT indexes: keep the old substring search.
+        like = f'%{text}%'
+        sql = f'''
+            SELECT {CARD_COLUMNS}
+            FROM artworks a
+            LEFT JOIN artists ar ON a.artist_id = ar.artist_id
+            WHERE a.title LIKE %s OR a.description LIKE %s OR ar.name LIKE %s
+            ORDER BY a.created_at DESC, a.artwork_id DESC
+            LIMIT %s OFFSET %s
+        '''
+        params = (like, like, like, per_page + 1, offset)
+    return sql, params
+
+
+def search_result(rows, per_page):
+    return rows[:per_page], len(rows) > per_page
+
+
+def search_artworks(cursor, text, page=1, per_page=24):
+    query = search_query(probe_schema(cursor), text, page, per_page)
+    if query is None:
+        return [], False
+    cursor.execute(*query)
+    return search_result(cursor.fetchall(), per_page)
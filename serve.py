@@ -0,0 +1,302 @@
+"""Production entry point: gunicorn, or waitress where gunicorn cannot run.
+
+    python serve.py run --workers 4 --threads 8
+    python serve.py bench --users 32 --duration 30
+
+run also starts one "flask jobs worker" process (--jobs threads) next to
+the web server: upload variants, order statuses, dashboard rollups and
+archiving all run as jobs (jobs.py). Pass --jobs 0 when the workers are
+run separately.
+
+gunicorn gives pre-forked workers, gthread worker threads, preload, worker
+recycling (--max-requests plus jitter) and graceful reloads: SIGHUP to the
+master replaces every worker once its in-flight requests finish. With
+--preload the code is loaded once in the master, so picking up new code
+needs a restart; without it a HUP is enough.
+"""
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import click
+
+import benchmark
+import catalogue_cache
+import db_pool
+import images
+import instrumentation
+import page_cache
+import passwords
+import startup
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+except ImportError:  # not installed, or Windows
+    BaseApplication = Arbiter = None
+
+PRIVATE_CACHES_ERROR = (
+    'each worker would keep its own in-memory catalogue/page cache, so a price, '
+    'stock or checkout change would only reach the worker that made it. Set '
+    'CATALOGUE_CACHE_URL to share one Redis cache, run --workers 1 (with more '
+    '--threads), or turn the caches off (CATALOGUE_CACHE_ENABLED=0, '
+    'PAGE_CACHE_ENABLED=0).')
+
+_config = {'check_caches': False}
+
+try:
+    import waitress
+except ImportError:  # optional fallback server
+    waitress = None
+
+
+def load_app():
+    return startup.get_app()
+
+
+def after_fork(app):
+    # A preloaded app was imported in the master; everything holding
+    # sockets, locks or threads is rebuilt in each worker.
+    db_pool.reset_after_fork()
+    catalogue_cache.init_app(app)
+    page_cache.init_app(app)
+    images.reset_after_fork()
+    passwords.reset_after_fork()
+    instrumentation.registry.reset()
+    startup.reset_after_fork()
+
+
+# -- gunicorn hooks -------------------------------------------------------------
+
+def _pre_fork(server, worker):
+    # Nothing pooled in the master may leak into a worker.
+    if server.cfg.preload_app and db_pool.get_pool() is not None:
+        db_pool.get_pool().dispose()
+
+
+def _post_fork(server, worker):
+    if server.cfg.preload_app:
+        after_fork(load_app())
+
+
+def _post_worker_init(worker):
+    # Runs before the worker accepts connections, so it joins warm.
+    app = load_app()
+    if _config['check_caches'] and not shared_caches(app.config):
+        worker.log.error(PRIVATE_CACHES_ERROR)
+        # Tells the gunicorn master to stop instead of respawning.
+        sys.exit(Arbiter.WORKER_BOOT_ERROR)
+    startup.warm(app)
+    connections = app.config['DB_POOL_SIZE'] + app.config['DB_POOL_MAX_OVERFLOW']
+    if worker.cfg.threads > connections:
+        worker.log.warning('%d threads share %d pooled DB connections; requests will queue '
+                           'on the pool (raise DB_POOL_SIZE/DB_POOL_MAX_OVERFLOW)',
+                           worker.cfg.threads, connections)
+
+
+def _worker_exit(server, worker):
+    images.shutdown(wait=True)
+    passwords.shutdown(wait=False)
+    if db_pool.get_pool() is not None:
+        db_pool.get_pool().dispose()
+
+
+if BaseApplication is not None:
+    class GunicornServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+
+def run_gunicorn(bind, workers, threads, preload, max_requests, max_requests_jitter,
+                 keepalive, graceful_timeout, timeout, access_log):
+    GunicornServer({
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': preload,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests_jitter,
+        'keepalive': keepalive,
+        'graceful_timeout': graceful_timeout,
+        'timeout': timeout,
+        'accesslog': '-' if access_log else None,
+        'pre_fork': _pre_fork,
+        'post_fork': _post_fork,
+        'post_worker_init': _post_worker_init,
+        'worker_exit': _worker_exit,
+    }).run()
+
+
+def run_waitress(bind, threads, timeout):
+    # Single process, so there is nothing to re-initialise after a fork.
+    app = load_app()
+    startup.warm(app)
+    waitress.serve(app, listen=bind, threads=threads, channel_timeout=timeout)
+
+
+# -- CLI --------------------------------------------------------------------------
+
+@click.group()
+def cli():
+    """Run ArtVault under a production WSGI server."""
+
+
+@cli.command('run')
+@click.option('--server', type=click.Choice(['auto', 'gunicorn', 'waitress']), default='auto',
+              envvar='WEB_SERVER', show_default=True)
+@click.option('--bind', default='0.0.0.0:8000', envvar='WEB_BIND', show_default=True)
+@click.option('--workers', type=int, default=os.cpu_count() or 2, envvar='WEB_WORKERS',
+              show_default='CPU count', help='Worker processes (gunicorn).')
+@click.option('--threads', type=int, default=4, envvar='WEB_THREADS', show_default=True,
+              help='Threads per worker; keep <= DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW.')
+@click.option('--preload/--no-preload', default=True, envvar='WEB_PRELOAD', show_default=True,
+              help='Import the app once in the master before forking.')
+@click.option('--max-requests', type=int, default=2000, envvar='WEB_MAX_REQUESTS', show_default=True,
+              help='Recycle a worker after this many requests (0 = never).')
+@click.option('--max-requests-jitter', type=int, default=200, envvar='WEB_MAX_REQUESTS_JITTER',
+              show_default=True, help='Random extra requests so workers do not recycle together.')
+@click.option('--keepalive', type=int, default=5, envvar='WEB_KEEPALIVE', show_default=True,
+              help='Seconds to hold an idle keep-alive connection.')
+@click.option('--graceful-timeout', type=int, default=30, envvar='WEB_GRACEFUL_TIMEOUT',
+              show_default=True, help='Seconds a worker gets to finish on reload/shutdown.')
+@click.option('--timeout', type=int, default=60, envvar='WEB_TIMEOUT', show_default=True,
+              help='Kill a worker stuck on one request for this long.')
+@click.option('--access-log', is_flag=True, envvar='WEB_ACCESS_LOG', help='Log requests to stdout.')
+@click.option('--jobs', 'job_threads', type=int, default=2, envvar='WEB_JOB_THREADS', show_default=True,
+              help='Threads of the job worker started alongside (0 = run "flask jobs worker" yourself).')
+@click.option('--private-caches', is_flag=True, hidden=True,
+              help='Allow per-worker in-memory caches (benchmarks only; edits go stale).')
+def run_command(server, bind, workers, threads, preload, max_requests, max_requests_jitter,
+                keepalive, graceful_timeout, timeout, access_log, job_threads, private_caches):
+    """Serve the app with tuned workers and threads."""
+    if server == 'auto':
+        server = 'gunicorn' if BaseApplication is not None else 'waitress'
+    if server == 'gunicorn' and BaseApplication is None:
+        raise click.ClickException('gunicorn is not installed (pip install gunicorn).')
+    if server == 'waitress' and waitress is None:
+        raise click.ClickException('waitress is not installed (pip install waitress).')
+
+    if server == 'gunicorn':
+        _config['check_caches'] = workers > 1 and not private_caches
+        # Without --preload the master must not import the app (a HUP would
+        # not pick up new code), so each worker checks once it has loaded it.
+        if preload and _config['check_caches'] and not shared_caches(load_app().config):
+            raise click.ClickException(PRIVATE_CACHES_ERROR)
+    else:
+        click.echo(f'waitress on {bind} with {threads} threads; --workers, --preload, '
+                   '--max-requests, --keepalive and --access-log apply to gunicorn only.', err=True)
+
+    job_worker = start_job_worker(job_threads) if job_threads > 0 else None
+    try:
+        if server == 'gunicorn':
+            run_gunicorn(bind, workers, threads, preload, max_requests, max_requests_jitter,
+                         keepalive, graceful_timeout, timeout, access_log)
+        else:
+            run_waitress(bind, threads, timeout)
+    finally:
+        if job_worker is not None:
+            stop_job_worker(job_worker)
+
+
+def start_job_worker(threads):
+    # A separate process, so jobs never share the web workers' GIL or
+    # connection pool.
+    return subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'jobs', 'worker',
+                             '--threads', str(threads)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def stop_job_worker(process, timeout=30):
+    # SIGTERM lets the running jobs finish; what is left is handed out again.
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def shared_caches(config):
+    # True when every worker sees the same cache entries and generation
+    # counters: they live in Redis, or the caches are off.
+    if config['CATALOGUE_CACHE_URL']:
+        return True
+    return not config['CATALOGUE_CACHE_ENABLED'] and not config['PAGE_CACHE_ENABLED']
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException(f'server for {url} exited with code {process.returncode}')
+        try:
+            with urllib.request.urlopen(url + '/', timeout=2) as resp:
+                resp.read()
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.25)
+    raise click.ClickException(f'{url} did not come up within {timeout}s')
+
+
+@cli.command('bench')
+@click.option('--users', 'vusers', default=16, show_default=True, help='Concurrent virtual users.')
+@click.option('--duration', default=30.0, show_default=True, help='Measured seconds per server.')
+@click.option('--warmup', default=5.0, show_default=True)
+@click.option('--workers', type=int, default=os.cpu_count() or 2, show_default='CPU count')
+@click.option('--threads', type=int, default=4, show_default=True)
+@click.option('--dev-port', default=5051, show_default=True)
+@click.option('--port', default=8051, show_default=True)
+@click.option('--admin-username', default='admin', show_default=True,
+              help='Signs in to /metrics for query counts.')
+@click.option('--admin-password', envvar='BENCH_ADMIN_PASSWORD')
+def bench_command(vusers, duration, warmup, workers, threads, dev_port, port,
+                  admin_username, admin_password):
+    """Throughput of the Flask dev server versus the production server.
+
+    Both are started on localhost against the configured database and
+    driven over HTTP with the same route mix (see benchmark.py).
+    """
+    app = load_app()
+    servers = (
+        ('dev-server', dev_port,
+         [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(dev_port), '--no-reload']),
+        ('production', port,
+         [sys.executable, os.path.abspath(__file__), 'run', '--bind', f'127.0.0.1:{port}',
+          '--workers', str(workers), '--threads', str(threads), '--jobs', '0', '--private-caches']),
+    )
+    results = []
+    with app.app_context():
+        for label, server_port, command in servers:
+            process = subprocess.Popen(command, cwd=app.root_path)
+            try:
+                url = f'http://127.0.0.1:{server_port}'
+                wait_until_up(url, process)
+                result, path = benchmark.run_benchmark(
+                    app, vusers, duration, warmup, base_url=url, admin_username=admin_username,
+                    admin_password=admin_password, label=label)
+                benchmark.print_report(result)
+                click.echo(f'Saved {path}\n')
+                results.append(result)
+            finally:
+                process.terminate()
+                process.wait(60)
+    benchmark.print_comparison(*results)
+
+
+if __name__ == '__main__':
+    cli()
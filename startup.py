@@ -0,0 +1,152 @@
+"""Application startup: warm workers and the /healthz and /readyz probes.
+
+serve.py and asgi.py get the app with get_app(). It imports the
+module-level app from app.py (which configures everything at import time;
+this is not an application factory) and prepares it: it creates the
+upload folder, compiles the URL map and every template once (in the
+gunicorn master when preloading, so the forked workers share them), and
+with TEMPLATE_CACHE_DIR set keeps Jinja bytecode on disk for the next
+start. warm() then runs in each worker before it takes traffic. It opens
+the pooled DB connections, loads the first gallery page into the
+catalogue cache and builds the facet index.
+
+/healthz only says the process is serving (liveness). /readyz also checks
+a pooled connection and the cache backend. It answers 503 until warm() has
+run in this worker, so a load balancer only routes to warm workers.
+"""
+import logging
+import os
+import time
+
+from flask import Blueprint, jsonify
+from jinja2 import FileSystemBytecodeCache
+
+import catalogue_cache
+import db_pool
+import facets
+from catalogue import CARD_COLUMNS, fetch_artwork_page
+
+log = logging.getLogger('artvault.startup')
+
+bp = Blueprint('health', __name__)
+_state = {'phase': 'cold', 'warmed_in': None, 'templates': 0, 'errors': []}
+_app = None
+
+
+def init_app(app):
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.register_blueprint(bp)
+
+
+def prepare(app):
+    # Process-wide work that survives fork().
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.url_map.update()
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    _state['templates'] = len(names)
+
+
+def get_app():
+    global _app
+    if _app is None:
+        from app import app
+        start = time.perf_counter()
+        prepare(app)
+        log.info('%d templates compiled in %.2fs', _state['templates'], time.perf_counter() - start)
+        _app = app
+    return _app
+
+
+def warm(app):
+    # Per worker: connections and caches cannot cross a fork. Failures are
+    # logged, not raised; /readyz keeps answering 503 until the database is
+    # reachable. /readyz only routes to a worker once this has run.
+    if not app.config['STARTUP_WARM']:
+        _state.update(phase='warm', warmed_in=0.0, errors=[])
+        return
+    _state.update(phase='warming', errors=[])
+    start = time.perf_counter()
+    pool = db_pool.get_pool()
+    connections = []
+    try:
+        for _ in range(pool.size):
+            connections.append(pool.acquire())
+    except Exception as e:
+        _state['errors'].append(f'db pool: {e}')
+    finally:
+        for conn in connections:
+            conn.release()
+
+    with app.app_context():
+        try:
+            size = app.config['GALLERY_PAGE_SIZE']
+
+            def loader():
+                conn = pool.acquire()
+                try:
+                    cursor = conn.cursor(dictionary=True)
+                    page = fetch_artwork_page(cursor, None, size, columns=CARD_COLUMNS)
+                    cursor.close()
+                finally:
+                    conn.release()
+                return page
+            catalogue_cache.get_cache().get_listing('card', None, size, loader)
+            facets.get_index(wait=True)
+        except Exception as e:
+            _state['errors'].append(f'catalogue cache: {e}')
+    _state.update(phase='warm', warmed_in=round(time.perf_counter() - start, 3))
+    if _state['errors']:
+        log.warning('worker warmed with errors in %.2fs: %s', _state['warmed_in'], '; '.join(_state['errors']))
+    else:
+        log.info('worker warm in %.2fs', _state['warmed_in'])
+
+
+def reset_after_fork():
+    # A preloaded master may have warmed itself; each worker starts cold.
+    _state.update(phase='cold', warmed_in=None, errors=[])
+
+
+# -- probes --------------------------------------------------------------------------
+
+def _check_db():
+    conn = db_pool.get_pool().acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.release()
+
+
+def _check_cache():
+    catalogue_cache.get_cache().backend.counter('gen:listing')
+
+
+@bp.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+
+@bp.route('/readyz')
+def readyz():
+    checks = {}
+    for name, check in (('db', _check_db), ('cache', _check_cache)):
+        try:
+            check()
+            checks[name] = 'ok'
+        except Exception as e:
+            checks[name] = f'error: {e}'
+    ready = _state['phase'] == 'warm' and all(v == 'ok' for v in checks.values())
+    response = jsonify(status='ready' if ready else 'unavailable', phase=_state['phase'],
+                       warmed_in=_state['warmed_in'], templates=_state['templates'],
+                       warm_errors=_state['errors'], checks=checks,
+                       db_pool=db_pool.get_pool().stats())
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
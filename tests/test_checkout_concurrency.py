@@ -0,0 +1,35 @@
+"""Concurrent checkouts against a real MySQL database never oversell.
+
+Needs the app's database (DB_* settings or .env) with the migrations
+applied and at least one user; skipped when it is not reachable.
+"""
+import pytest
+
+pytest.importorskip('flask')
+mysql_connector = pytest.importorskip('mysql.connector')
+
+from app import app  # noqa: E402
+from orders import stress_checkout  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def connect_args():
+    args = app.config['DB_CONNECT_ARGS']
+    try:
+        mysql_connector.connect(**args).close()
+    except mysql_connector.Error as e:
+        pytest.skip(f'database not reachable: {e}')
+    return args
+
+
+@pytest.mark.parametrize('buyers, stock', [(40, 10), (20, 30)])
+def test_concurrent_checkouts_never_oversell(connect_args, buyers, stock):
+    try:
+        result = stress_checkout(connect_args, buyers, stock)
+    except ValueError as e:
+        pytest.skip(str(e))
+    assert result['problems'] == []
+    assert result['outcomes']['error'] == 0
+    assert result['outcomes']['ok'] == min(stock, result['buyers'])
+    assert result['sold'] + result['remaining'] == stock
+    assert result['remaining'] >= 0
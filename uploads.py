@@ -0,0 +1,85 @@
+"""Content-addressed storage and cache-friendly serving for uploaded images.
+
+Uploads are stored under the SHA-256 of their bytes, so a URL always refers
+to exactly one content: identical uploads share one file, two different
+``art.jpg`` uploads no longer overwrite each other, and responses can be
+cached by browsers and proxies forever.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from flask import current_app, make_response, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import safe_join
+
+CHUNK_SIZE = 64 * 1024
+ONE_YEAR = 365 * 24 * 3600
+
+# <32 hex digest>[__<variant>-v<n>].<ext>
+CONTENT_ADDRESSED = re.compile(r'^([0-9a-f]{32})(__[a-z]+-v\d+)?\.[a-z0-9]+$')
+
+
+def _store(chunks, upload_folder, ext):
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f'{digest.hexdigest()[:32]}.{ext}'
+        path = os.path.join(upload_folder, filename)
+        if os.path.exists(path):
+            os.remove(tmp_path)  # already stored: deduplicated
+        else:
+            os.replace(tmp_path, path)
+        return filename
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_upload(file, upload_folder):
+    # file is a werkzeug FileStorage; it is streamed, never read whole.
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    if ext == 'jpeg':
+        ext = 'jpg'
+    return _store(iter(lambda: file.stream.read(CHUNK_SIZE), b''), upload_folder, ext)
+
+
+def store_bytes(data, ext, upload_folder):
+    return _store([data], upload_folder, ext.lower())
+
+
+def serve_upload(filename):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    match = CONTENT_ADDRESSED.match(filename)
+    accel_prefix = current_app.config.get('UPLOAD_ACCEL_REDIRECT_PREFIX')
+
+    if accel_prefix:
+        # Let nginx stream the bytes (and handle Range/conditional requests);
+        # the worker only authorises and names the file.
+        if safe_join(upload_folder, filename) is None or not os.path.isfile(
+                os.path.join(upload_folder, filename)):
+            raise NotFound()
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    else:
+        # conditional=True gives If-None-Match/If-Modified-Since 304s and Range
+        # support; USE_X_SENDFILE makes Werkzeug emit X-Sendfile instead.
+        response = send_from_directory(
+            upload_folder, filename, conditional=True,
+            etag=match.group(0) if match else True,
+            max_age=ONE_YEAR if match else current_app.config['UPLOAD_LEGACY_MAX_AGE'],
+        )
+
+    if match:
+        response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        if accel_prefix:
+            response.set_etag(match.group(0))
+    return response